@@ -0,0 +1,213 @@
+"""
+Runs the agent graph end to end offline: a scripted chat model plays the assistant, the Gmail API
+and the router are in-memory fakes and the state database is a temporary file. For every scenario
+it reports the wall time per node, the LLM turns, the prompt and completion tokens and the tool
+calls, as one JSON object per line to compare runs.
+
+    python benchmark/agent_scenarios.py [--runs 3] [--output results.jsonl] [--metrics-dir metrics] [--llm-cache-db cache.db] [scenario ...]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+sys.path.append(os.path.realpath(f"{dir_path}/../test"))
+from benchmark.scriptedmodel import ScriptedChatModel, SmallTalkScript
+from config.createdb import create_database
+from fakegmail import FakeGmailService
+from smalltalk_agent import SmallTalkAgent
+from smalltalk_llmcache import SqliteLLMCache
+from stubrouter import StubRouter
+from tools.gmailreplywatcher import GmailReplyWatcher
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.metrics import Metrics
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage, to_epoch
+
+
+class Scenario:
+    """
+    A household (humans with their phone handle, availability and contact history as hours ago)
+    and the instructions of the day.
+    """
+
+    def __init__(self, name: str, humans: list[dict], instructions: str, follow_up: bool = False, reply: str = "Doing great, thanks!", parallel_tool_calls: bool = True, route_models: bool = False):
+        self.name = name
+        self.humans = humans
+        self.instructions = instructions
+        self.follow_up = follow_up
+        self.reply = reply
+        self.parallel_tool_calls = parallel_tool_calls
+        self.route_models = route_models
+
+
+def _household(size: int, seed: int = 0) -> list[dict]:
+    # Reproducible contact histories over the last month, nobody contacted today
+    rng = random.Random(seed)
+    return [{
+        "name": f"Human{i}",
+        "email": f"human{i}@example.com",
+        "phone": ":".join(f"{rng.randrange(256):02X}" for _ in range(6)),
+        "available": rng.random() < 0.7,
+        "contacts_hours_ago": sorted(rng.uniform(30, 30 * 24) for _ in range(rng.randrange(6))),
+    } for i in range(size)]
+
+
+_CHAT = "Have a chat with a human, but not if you already contacted someone today or no one is available."
+
+_PAWEL_AND_GIULIA = [
+    {"name": "Pawel", "email": "pawel@example.com", "phone": "B2:66:C2:5D:17:71", "available": True, "contacts_hours_ago": []},
+    {"name": "Giulia", "email": "giulia@example.com", "phone": "3A:52:10:1D:4D:75", "available": True, "contacts_hours_ago": [25]},
+]
+_FOLLOW_UP = f"{_CHAT} If the human sends you a response within a minute, send a goodbye follow up message."
+
+SCENARIOS = [
+    Scenario("contact_fairly", _PAWEL_AND_GIULIA, _FOLLOW_UP, follow_up=True),
+    Scenario("contact_fairly_sequential_tools", _PAWEL_AND_GIULIA, _FOLLOW_UP, follow_up=True, parallel_tool_calls=False),
+    Scenario("contact_fairly_routed", _PAWEL_AND_GIULIA, _FOLLOW_UP, follow_up=True, route_models=True),
+    Scenario("skip_contacted_today", [
+        {"name": "Pawel", "email": None, "phone": None, "available": True, "contacts_hours_ago": []},
+        {"name": "Giulia", "email": None, "phone": None, "available": True, "contacts_hours_ago": [1]},
+    ], _CHAT),
+    Scenario("household_10", _household(10), _CHAT),
+    Scenario("household_50", _household(50), _CHAT),
+    Scenario("household_200", _household(200), _CHAT),
+]
+
+
+class _VirtualClock:
+    # The reply watcher waits on this clock, so awaiting a response takes no real time
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+    def time(self) -> float:
+        return self.now
+
+
+def _seed(storage: StateStorage, humans: list[dict], now: datetime):
+    with storage.transaction() as cursor:
+        for human in humans:
+            cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (human["email"], human["phone"], human["name"]))
+            cursor.executemany("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)",
+                               [(cursor.lastrowid, to_epoch(now - timedelta(hours=hours))) for hours in human["contacts_hours_ago"]])
+
+
+def run_scenario(scenario: Scenario, metrics_dir: str = None, llm_cache_db: str = None) -> dict:
+    """
+    Runs the scenario once on fresh fakes and returns its measurements. With metrics_dir, the
+    traces of the run are exported there as <scenario>.jsonl and <scenario>.prom. With
+    llm_cache_db, the turns seen in previous runs are answered from that LLM cache.
+    """
+    metrics = Metrics()
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "state.db")
+        create_database(db_path)
+        storage = StateStorage(db_path, metrics=metrics)
+        _seed(storage, scenario.humans, datetime.now())
+
+        gmail = FakeGmailService()
+        # The first message sent opens thread tm1, the human answers it on the first poll
+        gmail.schedule_reply("tm1", scenario.reply, after_history_polls=0)
+        clock = _VirtualClock()
+        messaging_tool = HumanMessagingInterfaceTool(service=gmail, metrics=metrics)
+        messaging_tool._reply_watcher = GmailReplyWatcher(gmail, sleep=clock.sleep, clock=clock.time, metrics=metrics)
+
+        router = StubRouter({human["phone"]: human["available"] for human in scenario.humans if human["phone"]})
+        host_cache = RouterHostCache(client_factory=router.create_client, metrics=metrics)
+
+        script = SmallTalkScript(follow_up=scenario.follow_up, parallel_tool_calls=scenario.parallel_tool_calls)
+        agent = SmallTalkAgent(
+            model=ScriptedChatModel(script=script),
+            small_model=ScriptedChatModel(script=script) if scenario.route_models else None,
+            parallel_tool_calls=scenario.parallel_tool_calls,
+            storage=storage,
+            messaging_tool=messaging_tool,
+            host_cache=host_cache,
+            metrics=metrics,
+            llm_cache=SqliteLLMCache(llm_cache_db, metrics=metrics) if llm_cache_db else None)
+
+        node_seconds = defaultdict(float)
+        node_calls = Counter()
+        messages = [HumanMessage(content=f"Good morning, it's {datetime.now().strftime('%I:%M%p on %B %d, %Y')}. {scenario.instructions}")]
+        final_state = None
+        start = time.perf_counter()
+        step_start = start
+        for mode, chunk in agent.compiled_graph.stream({"messages": messages}, stream_mode=["updates", "values"]):
+            if mode == "updates":
+                # Nodes run one after the other, the time since the previous update is the node's
+                step_end = time.perf_counter()
+                for node in chunk:
+                    node_seconds[node] += step_end - step_start
+                    node_calls[node] += 1
+                step_start = step_end
+            else:
+                final_state = chunk
+        wall_seconds = time.perf_counter() - start
+
+        host_cache.close()
+        storage.close()
+
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics.export(os.path.join(metrics_dir, f"{scenario.name}.jsonl"), os.path.join(metrics_dir, f"{scenario.name}.prom"))
+
+    ai_messages = [message for message in final_state["messages"] if isinstance(message, AIMessage) and message.usage_metadata]
+    tool_calls = Counter(tool_call["name"] for message in ai_messages for tool_call in message.tool_calls)
+    contacted = [tool_call["args"]["human_name"] for message in ai_messages for tool_call in message.tool_calls if tool_call["name"] == "write_contact_event"]
+    return {
+        "scenario": scenario.name,
+        "humans": len(scenario.humans),
+        "wall_seconds": wall_seconds,
+        "node_seconds": dict(node_seconds),
+        "node_calls": dict(node_calls),
+        "llm_turns": len(ai_messages),
+        "llm_turns_by_model": {counter["labels"]["model"]: counter["value"] for counter in metrics.summary().get("llm_turns", [])},
+        # Spent by this run, the turns answered from the LLM cache are not counted
+        "prompt_tokens": sum(counter["value"] for counter in metrics.summary().get("llm_tokens", []) if counter["labels"]["kind"] == "input"),
+        "completion_tokens": sum(counter["value"] for counter in metrics.summary().get("llm_tokens", []) if counter["labels"]["kind"] == "output"),
+        "tool_calls": dict(tool_calls),
+        "contacted": contacted,
+        "gmail_round_trips": gmail.round_trips,
+        "router_host_downloads": router.get_hosts_calls,
+        "tool_seconds": {span["labels"]["tool"]: span["seconds"] for span in metrics.summary().get("tool", [])},
+        "llm_cache_hits": sum(counter["value"] for counter in metrics.summary().get("llm_cache", []) if counter["labels"]["result"] == "hit"),
+        "sqlite_statements": sum(span["count"] for span in metrics.summary().get("sqlite", [])),
+        "sqlite_seconds": sum(span["seconds"] for span in metrics.summary().get("sqlite", [])),
+    }
+
+
+def run_scenarios(names: list[str] = None, runs: int = 1, metrics_dir: str = None, llm_cache_db: str = None) -> list[dict]:
+    """
+    Runs the selected scenarios (all by default), keeping the fastest of the runs of each.
+    """
+    selected = [scenario for scenario in SCENARIOS if not names or scenario.name in names]
+    return [min((run_scenario(scenario, metrics_dir, llm_cache_db) for _ in range(runs)), key=lambda result: result["wall_seconds"]) for scenario in selected]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run, among {', '.join(scenario.name for scenario in SCENARIOS)}")
+    parser.add_argument("--runs", type=int, default=1, help="Runs per scenario, the fastest is reported")
+    parser.add_argument("--output", help="File to write the JSON lines to, instead of the standard output")
+    parser.add_argument("--metrics-dir", help="Directory to export the traces of every scenario to")
+    parser.add_argument("--llm-cache-db", help="LLM cache database shared by the runs, to measure replays")
+    arguments = parser.parse_args()
+
+    lines = [json.dumps(result, sort_keys=True) for result in run_scenarios(arguments.scenarios, arguments.runs, arguments.metrics_dir, arguments.llm_cache_db)]
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            output.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
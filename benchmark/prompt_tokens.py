@@ -0,0 +1,75 @@
+"""
+Measures the prompt tokens the assistant node sends on every turn before the conversation itself:
+the system prompt and the bound tool definitions. The previous layout repeated every tool
+description inside the system prompt, the current one relies on the tool definitions only.
+
+    python benchmark/prompt_tokens.py
+"""
+import json
+import os
+import sys
+
+import tiktoken
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from smalltalk_agent import SYSTEM_PROMPT
+from tools.humancontacthistory import HumansAndContactsEventsReaderTool, ContactEventRecorderTool
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.nextcontactschedule import NextContactScheduleTool
+from tools.humanavailabilityverifier import HumanAvailabilityVerifierTool, HumansAvailabilityVerifierTool
+from tools.fairnessranking import FairnessRankingTool
+
+# OpenAI caches prompt prefixes from 1024 tokens on, in increments of 128 tokens
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT_TOKENS = 128
+
+
+def _agent_tools() -> list:
+    # Only the descriptions and signatures are needed, the services are never created
+    return [
+        HumansAndContactsEventsReaderTool(),
+        HumanMessagingInterfaceTool(),
+        ContactEventRecorderTool(),
+        NextContactScheduleTool(),
+        HumanAvailabilityVerifierTool(),
+        HumansAvailabilityVerifierTool(),
+        FairnessRankingTool(),
+    ]
+
+
+def _legacy_system_prompt(tools: list) -> str:
+    instructions = SYSTEM_PROMPT.rsplit("\n\n", 1)[0]
+    descriptions = "\n".join(f"- {tool.description()}" for tool in tools)
+    return f"{instructions}\n\nYou have these tools at your disposal:\n{descriptions}"
+
+
+def _cacheable_tokens(prefix_tokens: int) -> int:
+    if prefix_tokens < CACHE_MIN_TOKENS:
+        return 0
+    return prefix_tokens - prefix_tokens % CACHE_INCREMENT_TOKENS
+
+
+def measure_static_prompt(model: str = "gpt-4o") -> dict:
+    """
+    Tokens of the per-turn static prefix (system prompt + tool definitions) with both layouts.
+    """
+    encoding = tiktoken.encoding_for_model(model)
+    tools = _agent_tools()
+    tool_tokens = sum(len(encoding.encode(json.dumps(convert_to_openai_tool(tool.definition)))) for tool in tools)
+
+    legacy_prefix = len(encoding.encode(_legacy_system_prompt(tools))) + tool_tokens
+    static_prefix = len(encoding.encode(SYSTEM_PROMPT)) + tool_tokens
+    return {
+        "model": model,
+        "tool_definition_tokens": tool_tokens,
+        "legacy_prefix_tokens_per_turn": legacy_prefix,
+        "static_prefix_tokens_per_turn": static_prefix,
+        "saved_tokens_per_turn": legacy_prefix - static_prefix,
+        "cacheable_prefix_tokens": _cacheable_tokens(static_prefix),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure_static_prompt(), indent=2))
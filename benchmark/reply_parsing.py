@@ -0,0 +1,65 @@
+"""
+Measures the reply extraction on the sample messages of test/replycorpus.py: the messages parsed
+per second by tools.replyparser.extract_reply and by the marker splitting read_reply used before,
+and how many of the samples each of them gets right.
+
+    python benchmark/reply_parsing.py [--repeat 2000]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+sys.path.append(os.path.realpath(f"{dir_path}/../test"))
+from replycorpus import CORPUS
+from tools.replyparser import extract_reply
+
+_LEGACY_MARKERS = ["\r\n\r\nOn ", "\n\nOn ", "\r\n> ", "\n> ", "\r\n\r\n-----Original Message-----", "\n\n-----Original Message-----"]
+
+
+def legacy_extract_reply(payload: dict) -> str:
+    # The first part only, decoded as UTF-8, and cut at every marker in turn
+    body = payload["body"] if "data" in payload["body"] else payload["parts"][0]["body"]
+    data = body["data"]
+    message_body = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)).decode("utf-8")
+    for marker in _LEGACY_MARKERS:
+        if marker in message_body:
+            message_body = message_body.split(marker)[0].strip()
+    return message_body
+
+
+def _measure(extract, repeat: int) -> dict:
+    correct = 0
+    for _, payload, expected in CORPUS:
+        try:
+            correct += extract(payload) == expected
+        except Exception:
+            pass
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, payload, _ in CORPUS:
+            try:
+                extract(payload)
+            except Exception:
+                pass
+    seconds = time.perf_counter() - start
+    return {"correct": correct, "messages_per_second": round(repeat * len(CORPUS) / seconds)}
+
+
+def measure_reply_parsing(repeat: int) -> dict:
+    return {
+        "messages": len(CORPUS),
+        "replyparser": _measure(extract_reply, repeat),
+        "legacy": _measure(legacy_extract_reply, repeat),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the reply extraction throughput")
+    parser.add_argument("--repeat", type=int, default=2000, help="passes over the sample messages")
+    args = parser.parse_args()
+    print(json.dumps(measure_reply_parsing(args.repeat), indent=2))
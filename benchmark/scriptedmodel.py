@@ -0,0 +1,123 @@
+"""
+A deterministic stand-in for the chat model, so that the agent graph can run offline: every turn is
+decided by a script from the conversation so far, and token usage is estimated like a provider
+would report it.
+"""
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from smalltalk_compaction import estimate_tokens
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model answering with script(messages) -> AIMessage. The usage metadata of every answer
+    counts the prompt (conversation and bound tool definitions) and the completion with the same
+    estimate as the history compaction.
+    """
+
+    script: Callable[[list[BaseMessage]], AIMessage]
+    tool_definition_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        # Bound like the provider models do, so the tools are part of the cache key
+        tool_definitions = [convert_to_openai_tool(tool) for tool in tools]
+        tool_definition_tokens = sum(len(json.dumps(definition)) // 4 for definition in tool_definitions)
+        return self.model_copy(update={"tool_definition_tokens": tool_definition_tokens}).bind(tools=tool_definitions, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self.script(messages)
+        input_tokens = estimate_tokens(messages) + self.tool_definition_tokens
+        output_tokens = estimate_tokens([message])
+        message = message.model_copy(update={"usage_metadata": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _tool_calls(messages: list[AnyMessage], *calls: tuple[str, dict]) -> AIMessage:
+    turn = sum(isinstance(message, AIMessage) for message in messages)
+    return AIMessage(content="", tool_calls=[
+        {"name": name, "args": args, "id": f"call_{turn}_{i}", "type": "tool_call"} for i, (name, args) in enumerate(calls)])
+
+
+def _tool_call(messages: list[AnyMessage], name: str, args: dict) -> AIMessage:
+    return _tool_calls(messages, (name, args))
+
+
+def _last_tool_message(messages: list[AnyMessage], name: str) -> Optional[ToolMessage]:
+    return next((message for message in reversed(messages) if isinstance(message, ToolMessage) and message.name == name), None)
+
+
+class SmallTalkScript:
+    """
+    Plays the agent the way the system prompt asks: rank the humans, message the best eligible one
+    awaiting the response, send a goodbye follow up when asked to and a response came, record the
+    contact and schedule the next one. With parallel_tool_calls, the last two are called in the
+    same turn.
+    """
+
+    def __init__(self, follow_up: bool = False, response_timeout: int = 1, parallel_tool_calls: bool = True):
+        self._follow_up = follow_up
+        self._response_timeout = response_timeout
+        self._parallel_tool_calls = parallel_tool_calls
+
+    def __call__(self, messages: list[AnyMessage]) -> AIMessage:
+        last = messages[-1]
+        if not isinstance(last, ToolMessage):
+            return _tool_call(messages, "rank_humans_for_contact", {"check_availability": True})
+
+        ranking = _last_tool_message(messages, "rank_humans_for_contact")
+        header, _, table = str(ranking.content).partition("\n")
+        if not header.startswith("contact_allowed: yes"):
+            return AIMessage(content=f"No contact today. {header}")
+
+        columns, best = table.split("\n")[:2]
+        human = dict(zip(columns.split("|"), best.split("|")))
+
+        if last.name == "rank_humans_for_contact":
+            return _tool_call(messages, "human_messaging_interface", {
+                "human_email": human["email"],
+                "message_subject": "Ciao!",
+                "message_body": f"Hi {human['name']}, it has been {human['days_since_last_contact'] + ' days' if human['days_since_last_contact'] else 'a while'} since we last talked. How is your day going?",
+                "await_response": True,
+                "response_timeout": self._response_timeout,
+            })
+
+        if last.name == "human_messaging_interface":
+            sent = sum(1 for message in messages if isinstance(message, ToolMessage) and message.name == "human_messaging_interface")
+            if self._follow_up and sent == 1 and "RETURNED_WITH_RESPONSE:" in str(last.content):
+                thread_id = re.findall(r"'([^']*)'", str(last.content))[-1]
+                return _tool_call(messages, "human_messaging_interface", {
+                    "human_email": human["email"],
+                    "message_subject": "Ciao!",
+                    "message_body": f"Thanks {human['name']}, have a lovely day! Goodbye.",
+                    "messaging_thread_handle": thread_id,
+                })
+            if self._parallel_tool_calls:
+                return _tool_calls(messages, ("write_contact_event", {"human_name": human["name"]}), self._next_contact_call())
+            return _tool_call(messages, "write_contact_event", {"human_name": human["name"]})
+
+        if last.name == "write_contact_event" and not self._parallel_tool_calls:
+            return _tool_calls(messages, self._next_contact_call())
+
+        return AIMessage(content=f"I had a chat with {human['name']} today.")
+
+    @staticmethod
+    def _next_contact_call() -> tuple[str, dict]:
+        next_contact = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        return ("next_contact_schedule", {"next_contact_datetime": next_contact.strftime("%Y-%m-%d %H:%M:%S")})
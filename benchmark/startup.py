@@ -0,0 +1,62 @@
+"""
+Measures the agent startup: the import of smalltalk_agent and the construction of SmallTalkAgent,
+each in a fresh interpreter, and lists the heavy modules loaded by then. None of them should be,
+they are only needed once the first LLM turn runs or the first message is sent.
+
+    python benchmark/startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+root_path = os.path.realpath(f"{dir_path}/..")
+
+HEAVY_MODULES = [
+    "langchain_openai",
+    "openai",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "langchain_google_community",
+    "IPython",
+    "sagemcom_api",
+    "sqlalchemy",
+]
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import smalltalk_agent
+imported = time.perf_counter()
+agent = smalltalk_agent.SmallTalkAgent()
+constructed = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "construct_seconds": constructed - imported,
+    "loaded_heavy_modules": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def measure_startup(runs: int = 3) -> dict:
+    """
+    Best of a few runs, every run in a new interpreter working on an empty state database.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "benchmark"), SMALLTALK_STATE_DB=os.path.join(work_dir, "state.db"))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [root_path, env.get("PYTHONPATH")]))
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", _STARTUP_SCRIPT % (HEAVY_MODULES,)],
+                cwd=work_dir, env=env, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    best = min(results, key=lambda result: result["import_seconds"] + result["construct_seconds"])
+    return dict(best, runs=runs)
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure_startup(), indent=2))
@@ -1,40 +1,29 @@
-import sqlite3
+import os
+import sys
 
-def create_database(db_file: str):
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from tools.statemigrations import SCHEMA_VERSION, migrate
+from tools.statestorage import StateStorage
+
+def create_database(db_file: str) -> list[int]:
     """
-    Creates the state.db SQLite database and initializes the schema.
+    Creates the state.db SQLite database, or upgrades an existing one in place, to the latest
+    schema version. Returns the schema versions applied.
     """
-    # Connect to the SQLite database (will create if it doesn't exist)
-    conn = sqlite3.connect(db_file)
-    
-    # Create a cursor to execute SQL commands
-    cursor = conn.cursor()
-    
-    # Create the Human table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Human (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT,
-        phone TEXT,
-        name TEXT
-    );
-    """)
-    
-    # Create the ContactEvent table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS ContactEvent (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        human_id INTEGER,
-        datetime TEXT,
-        FOREIGN KEY (human_id) REFERENCES Human(id)
-    );
-    """)
-    
-    # Commit the changes and close the connection
-    conn.commit()
-    conn.close()
+    # Open the SQLite database (will create if it doesn't exist) in WAL mode
+    storage = StateStorage(db_file)
+
+    try:
+        # Tables, typed timestamps and indexes, each migration in its own transaction
+        return migrate(storage)
+    finally:
+        # Close the pooled connections
+        storage.close()
 
 if __name__ == "__main__":
-    create_database("state.db")
-    print("Database created with tables Human and ContactEvent.")
-    
\ No newline at end of file
+    applied = create_database("state.db")
+    if applied:
+        print(f"Database upgraded to schema version {SCHEMA_VERSION}, applied migrations: {', '.join(map(str, applied))}.")
+    else:
+        print(f"Database already at schema version {SCHEMA_VERSION}.")
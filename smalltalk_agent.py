@@ -1,102 +1,368 @@
-import base64
-from typing import List, TypedDict, Annotated, Optional
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AnyMessage, SystemMessage
+from typing import TypedDict, Annotated, Optional
+from langchain_core.caches import BaseCache
+from langchain_core.messages import AIMessage, AnyMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
 from langgraph.graph.message import add_messages
-from langgraph.graph import START, StateGraph
+from langgraph.graph import END, START, StateGraph
 from langgraph.prebuilt import tools_condition
 from langgraph.prebuilt import ToolNode
-from IPython.display import Image, display
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.types import Command, interrupt
 from dotenv import load_dotenv
 import os
+import textwrap
 
 from tools.humancontacthistory import HumansAndContactsEventsReaderTool, ContactEventRecorderTool
-from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool, HumanMessagingInterfaceReturnStatus
 from tools.nextcontactschedule import NextContactScheduleTool
-from tools.humanavailabilityverifier import HumanAvailabilityVerifierTool
-from langchain_google_community import GmailToolkit
+from tools.humanavailabilityverifier import HumanAvailabilityVerifierTool, HumansAvailabilityVerifierTool
+from tools.fairnessranking import FairnessRankingTool
+from tools.metrics import Metrics, get_metrics
+from tools.ratelimits import BaseRateLimiter
+from tools.routerhostcache import RouterHostCache, get_router_host_cache
+from tools.statemigrations import migrate
+from tools.statestorage import StateStorage, get_storage
+from smalltalk_checkpoints import SqliteCheckpointSaver
+from smalltalk_compaction import compact_tool_messages
+from smalltalk_llmcache import CACHE_HIT_METADATA, SqliteLLMCache
+from smalltalk_routing import LARGE_MODEL, LargeModelOnlyPolicy, ModelRoutingPolicy
 
 class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    gate_decision: Optional[dict]
+
+
+# Built once and kept byte-identical across turns and runs, so that the provider can cache the
+# prompt prefix (system prompt and tool definitions). The tools are described by their bound
+# definitions only, and volatile content (date, instructions) comes last, in the user message.
+SYSTEM_PROMPT = textwrap.dedent("""
+    You are a very kind agent. You want to message a group of humans on a daily basis, but you do not want to be overwhelming.
+
+    Before you message, you want to:
+    - Understand the history of your interactions with the humans. You want to be very fair in which human you choose to message. It is very important that you contact any human only once per day. If someone was contacted today, avoid any additional contacts.
+    - You also want to verify if the human is available to receive a message. If the human is not available, you want to avoid contacting them.
+
+    Call independent tools together in the same turn, e.g. recording the contact event and setting the next contact datetime.
+
+    Start by calling rank_humans_for_contact: it applies these rules to the history and the availability of all humans for you. If it reports that no contact is allowed, do not message anyone. Otherwise contact the best eligible human it ranked first, there is no need to read the history or verify the availability separately.
+
+    When preparing a message, you want to be very kind and friendly and in that tone engage a human in a small talk, address them by name. In the first message, you want to:
+    - Provide a precise rationale why you chose them today over other humans, considering the history of your interactions with them, today's availability of the humans and the fact that you want to be fair and do not want to be overwhelming.
+    - Ask a little engaging question.
+
+    If the human responds, you want to your message you may want to send a follow up message, following the same tone and style as in the first message. If there are any limitations on the length of the exchange specified in the user message, you want to follow those limitations.
+
+    Remember to:
+    - Keep a record of all your contact events, so you can take fair decisions in the future.
+    - Always analyze what would be the best next time to contact a human. Based on your conclusions, set the next contact datetime.
+
+    The tools at your disposal are described in their definitions. The current date and time and the instructions for today are given in the user message.
+    """).strip()
 
 
 class SmallTalkAgent:
-    def __init__(self):
-        load_dotenv()
-        self._model = ChatOpenAI(
-            model="gpt-4o",
-            api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, defer_responses: bool = False, checkpointer=None, checkpoint_db: str = None, pre_gate: bool = True, pre_gate_checks_availability: bool = False, history_token_budget: int = 8000, parallel_tool_calls: bool = True,
+                 model=None, storage: StateStorage = None, messaging_tool: HumanMessagingInterfaceTool = None, host_cache: RouterHostCache = None,
+                 metrics: Metrics = None, llm_cache: BaseCache = None, rate_limiters: dict[str, BaseRateLimiter] = None,
+                 small_model=None, routing_policy: ModelRoutingPolicy = None, metrics_dir: str = None):
+        """
+        With defer_responses=True, awaiting a human response does not block: the run is suspended
+        after the message is sent and must be resumed (see ReplyDispatcher in smalltalk_replies.py).
+        Suspended runs are kept by the checkpointer, in memory unless another one is given.
+
+        With checkpoint_db, every completed node is saved to that SQLite database (see
+        smalltalk_checkpoints.py) and run() continues a run interrupted by a crash or a restart from
+        its last completed node. Combined with defer_responses, a restart while awaiting a response
+        neither loses the run nor sends the message again.
 
-        self._tool1 = HumansAndContactsEventsReaderTool()
-        self._tool2 = HumanMessagingInterfaceTool()
-        self._tool3 = ContactEventRecorderTool()
-        self._tool4 = NextContactScheduleTool()
-        self._tool5 = HumanAvailabilityVerifierTool()
+        With pre_gate=True, a run ends before the first LLM call when the fairness rules do not
+        allow any contact (someone was already contacted today, or, when pre_gate_checks_availability
+        is set, nobody is available).
 
-        self._tools = [
+        Once the conversation exceeds history_token_budget (estimated tokens), older tool results are
+        replaced by compact summaries before the next assistant turn. None disables the compaction.
+
+        With parallel_tool_calls=True, the model may call several tools in one turn: the read-only
+        ones run concurrently, the others one after the other, in the order they were called.
+
+        model (a chat model supporting bind_tools), storage, messaging_tool and host_cache replace
+        gpt-4o, the shared state database, the Gmail messaging tool and the router host cache, e.g.
+        to run the agent offline (see benchmark/agent_scenarios.py).
+
+        Every node, tool call and LLM turn is recorded in metrics (by default the shared ones, where
+        the Gmail, router and SQLite calls are recorded too). At the end of every run and resume,
+        they are exported as smalltalk.jsonl and smalltalk.prom to metrics_dir, or the
+        SMALLTALK_METRICS_DIR environment variable, when set (see Metrics.export_to_dir).
+
+        With llm_cache (e.g. SqliteLLMCache from smalltalk_llmcache.py), a turn whose model, bound
+        tools and messages were already seen is answered from the cache. Setting the
+        SMALLTALK_LLM_CACHE_DB environment variable enables an on-disk cache at that path. Cached turns
+        are counted as llm_cache_hits rather than llm_turns and llm_tokens.
+
+        rate_limiters (see create_rate_limiters in tools/ratelimits.py) throttle the "llm", "gmail"
+        and "router" requests, pass the same ones to all the agents of a process to share the quotas.
+        Without host_cache, the agents sharing a router limiter share one router session.
+
+        Tool orchestration turns run on small_model and the turns composing the message to the human
+        on model, as decided by routing_policy (see smalltalk_routing.py); the model of every turn is
+        a label of the llm metrics. Without model, gpt-4o is paired with gpt-4o-mini (or the
+        SMALLTALK_SMALL_MODEL environment variable); with model but no small_model, every turn runs
+        on model.
+
+        The state database is upgraded to the latest schema version on start, see
+        tools/statemigrations.py.
+        """
+        load_dotenv()
+        self._defer_responses = defer_responses
+        self._pre_gate = pre_gate
+        self._pre_gate_checks_availability = pre_gate_checks_availability
+        self._history_token_budget = history_token_budget
+        self._parallel_tool_calls = parallel_tool_calls
+        if checkpointer is None and checkpoint_db is not None:
+            checkpointer = SqliteCheckpointSaver(checkpoint_db)
+        self._checkpointer = checkpointer or (MemorySaver() if defer_responses else None)
+        self._model = model
+        self._small_model = small_model
+        if routing_policy is None:
+            routing_policy = ModelRoutingPolicy() if model is None or small_model is not None else LargeModelOnlyPolicy()
+        self._routing_policy = routing_policy
+        self._metrics = metrics or get_metrics()
+        self._metrics_dir = metrics_dir
+        if llm_cache is None and os.getenv("SMALLTALK_LLM_CACHE_DB"):
+            llm_cache = SqliteLLMCache(metrics=self._metrics)
+        self._llm_cache = llm_cache
+        storage = storage or get_storage()
+        migrate(storage)
+        self._tool1 = HumansAndContactsEventsReaderTool(storage=storage)
+        self._rate_limiters = rate_limiters or {}
+        # One router session for all the agents sharing the router limiter
+        self._host_cache = host_cache or get_router_host_cache(self._rate_limiters.get("router"))
+        self._tool2 = messaging_tool or HumanMessagingInterfaceTool(defer_responses=defer_responses, rate_limiter=self._rate_limiters.get("gmail"))
+        self._tool3 = ContactEventRecorderTool(storage=storage)
+        self._tool4 = NextContactScheduleTool(storage=storage)
+        self._tool5 = HumanAvailabilityVerifierTool(host_cache=self._host_cache, metrics=self._metrics)
+        self._tool6 = HumansAvailabilityVerifierTool(host_cache=self._host_cache, storage=storage, metrics=self._metrics)
+        self._tool7 = FairnessRankingTool(storage=storage, availability_tool=self._tool6)
+
+        self._tools = [self._traced_tool(definition) for definition in [
             self._tool1.definition,
             self._tool2.definition,
             self._tool3.definition,
             self._tool4.definition,
-            self._tool5.definition
-        ]
-        self._llm_with_tools = self._model.bind_tools(self._tools, parallel_tool_calls=False)
+            self._tool5.definition,
+            self._tool6.definition,
+            self._tool7.definition
+        ]]
+        self._read_only_tools = {tool.name for tool in self._tools if (tool.metadata or {}).get("read_only")}
+        self._tool_node = ToolNode(self._tools)
+        self._llms_with_tools = {}
+        self._system_message = SystemMessage(content=SYSTEM_PROMPT)
         self._create_graph()
 
+    def _traced_tool(self, definition: StructuredTool) -> StructuredTool:
+        # The schema was inferred from the tool's use, only the call is wrapped
+        definition.func = self._metrics.traced("tool", definition.func, tool=definition.name)
+        return definition
+
+    def _traced_node(self, name: str, node):
+        return self._metrics.traced("node", node, node=name)
+
     def _create_graph(self):
         ## The graph
         builder = StateGraph(AgentState)
 
         # Define nodes: these do the work
-        builder.add_node("assistant", self._assistant)
-        builder.add_node("tools", ToolNode(self._tools))
+        builder.add_node("assistant", self._traced_node("assistant", self._assistant))
+        builder.add_node("tools", self._run_tools)
 
         # Define edges: these determine how the control flow moves
-        builder.add_edge(START, "assistant")
+        if self._pre_gate:
+            builder.add_node("gate", self._traced_node("gate", self._gate))
+            builder.add_edge(START, "gate")
+            builder.add_conditional_edges(
+                "gate",
+                lambda state: "assistant" if state["gate_decision"]["contact_allowed"] else END
+            )
+        else:
+            builder.add_edge(START, "assistant")
         builder.add_conditional_edges(
             "assistant",
             tools_condition
         )
-        builder.add_edge("tools", "assistant")
-        self._graph = builder.compile()
+        # Tool results go back to the assistant through the optional reply wait and compaction
+        after_tools = ["tools"]
+        if self._defer_responses:
+            builder.add_node("await_reply", self._traced_node("await_reply", self._await_reply))
+            after_tools.append("await_reply")
+        if self._history_token_budget is not None:
+            builder.add_node("compact", self._traced_node("compact", self._compact))
+            after_tools.append("compact")
+        after_tools.append("assistant")
+        for source, target in zip(after_tools, after_tools[1:]):
+            builder.add_edge(source, target)
+        self._graph = builder.compile(checkpointer=self._checkpointer)
 
-    def _assistant(self, state: AgentState):
-        sys_msg = SystemMessage(
-            content=f"""
-            You are a very kind agent. You want to message a group of humans on a daily basis, but you do not want to be overwhelming.
-            
-            Before you message, you want to:
-            - Understand the history of your interactions with the humans. You want to be very fair in which human you choose to message. It is very important that you contact any human only once per day. If someone was contacted today, avoid any additional contacts.
-            - You also want to verify if the human is available to receive a message. If the human is not available, you want to avoid contacting them.
-
-            When preparing a message, you want to be very kind and friendly and in that tone engage a human in a small talk, address them by name. In the first message, you want to:
-            - Provide a precise rationale why you chose them today over other humans, considering the history of your interactions with them, today's availability of the humans and the fact that you want to be fair and do not want to be overwhelming.
-            - Ask a little engaging question.
-
-            If the human responds, you want to your message you may want to send a follow up message, following the same tone and style as in the first message. If there are any limitations on the length of the exchange specified in the user message, you want to follow those limitations.
-
-            Remember to:
-            - Keep a record of all your contact events, so you can take fair decisions in the future.
-            - Always analyze what would be the best next time to contact a human. Based on your conclusions, set the next contact datetime.
-
-            You have these tools at your disposal:
-            - {self._tool1.description()}
-            - {self._tool2.description()}
-            - {self._tool3.description()}
-            - {self._tool4.description()}
-            - {self._tool5.description()}
-            """
-        )
+    def _gate(self, state: AgentState):
+        # Deterministic check of the fairness rules, no LLM call is needed to decide to do nothing
+        ranking = self._tool7.rank(check_availability=self._pre_gate_checks_availability)
+        if ranking.contact_allowed:
+            return {"gate_decision": {"contact_allowed": True, "reason": ranking.reason}}
 
         return {
-            "messages": [self._llm_with_tools.invoke([sys_msg] + state["messages"])]
+            "gate_decision": {"contact_allowed": False, "reason": ranking.reason},
+            "messages": [AIMessage(content=f"No contact today. {ranking.reason}.")]
+        }
+
+    def _get_llm_with_tools(self, route: str = LARGE_MODEL):
+        # The OpenAI client is created on the first assistant turn, runs ended by the gate never need it
+        if route not in self._llms_with_tools:
+            model = self._model if route == LARGE_MODEL else self._small_model
+            if model is None:
+                from langchain_openai import ChatOpenAI
+
+                model = ChatOpenAI(
+                    model="gpt-4o" if route == LARGE_MODEL else os.getenv("SMALLTALK_SMALL_MODEL", "gpt-4o-mini"),
+                    api_key=os.getenv("OPENAI_API_KEY"))
+            if self._llm_cache is not None:
+                model = model.model_copy(update={"cache": self._llm_cache})
+            if self._rate_limiters.get("llm") is not None:
+                # Cache hits are not throttled, the limiter is only waited for on provider calls
+                model = model.model_copy(update={"rate_limiter": self._rate_limiters["llm"]})
+            self._llms_with_tools[route] = model.bind_tools(self._tools, parallel_tool_calls=self._parallel_tool_calls)
+        return self._llms_with_tools[route]
+
+    def _invoke_llm(self, route: str, messages: list[AnyMessage]) -> AIMessage:
+        llm_with_tools = self._get_llm_with_tools(route)
+        with self._metrics.span("llm", model=route):
+            message = llm_with_tools.invoke(messages)
+        if message.response_metadata.pop(CACHE_HIT_METADATA, False):
+            # Answered from the LLM cache, the stored usage was spent by an earlier run
+            self._metrics.count("llm_cache_hits", model=route)
+        else:
+            self._metrics.record_llm_usage(message, model=route)
+        return message
+
+    def _assistant(self, state: AgentState):
+        messages = [self._system_message] + state["messages"]
+        route = self._routing_policy.route(state["messages"])
+        message = self._invoke_llm(route, messages)
+        if route != LARGE_MODEL and self._routing_policy.escalate(message):
+            # The small model wrote to a human, the large model composes that message instead. The
+            # discarded small model turn stays in llm_turns and llm_tokens, it was paid for
+            self._metrics.count("llm_escalations")
+            self._metrics.count("llm_discarded_turns", model=route)
+            message = self._invoke_llm(LARGE_MODEL, messages)
+        return {
+            "messages": [message]
         }
     
+    def _run_tools(self, state: AgentState, config: RunnableConfig):
+        with self._metrics.span("node", node="tools"):
+            tool_calls = state["messages"][-1].tool_calls
+            read_only_calls = [tool_call for tool_call in tool_calls if tool_call["name"] in self._read_only_tools]
+            if len(read_only_calls) == len(tool_calls):
+                # The tool node runs the calls of a step concurrently
+                return self._tool_node.invoke(state, config)
+
+            # Consecutive reads run concurrently, every side effect runs on its own, in the order called
+            batches = []
+            for tool_call in tool_calls:
+                if tool_call["name"] in self._read_only_tools and batches and batches[-1][0]["name"] in self._read_only_tools:
+                    batches[-1].append(tool_call)
+                else:
+                    batches.append([tool_call])
+            results = {}
+            for batch in batches:
+                output = self._tool_node.invoke({"messages": [AIMessage(content="", tool_calls=batch)]}, config)
+                results.update((message.tool_call_id, message) for message in output["messages"])
+            return {"messages": [results[tool_call["id"]] for tool_call in tool_calls]}
+
+    def _await_reply(self, state: AgentState):
+        # Suspend the run while a message sent in the last tool step awaits its response
+        last_assistant_index = max(i for i, message in enumerate(state["messages"]) if isinstance(message, AIMessage))
+        updates = []
+        for message in state["messages"][last_assistant_index + 1:]:
+            pending_reply = message.artifact if isinstance(message, ToolMessage) else None
+            if not pending_reply or pending_reply.get("status") != HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE_PENDING.name:
+                continue
+
+            reply = interrupt(pending_reply)
+
+            # Replace the pending tool result (same message id) with the final one
+            status = HumanMessagingInterfaceReturnStatus[reply["status"]]
+            updates.append(ToolMessage(
+                id=message.id,
+                name=message.name,
+                tool_call_id=message.tool_call_id,
+                content=str((status, reply["response"], reply["thread_id"])),
+                artifact={"status": status.name}))
+        return {"messages": updates}
+
+    def _compact(self, state: AgentState):
+        # Replace old tool results (same message ids) with summaries once over the token budget
+        return {"messages": compact_tool_messages(state["messages"], self._history_token_budget)}
+
+    def run(self, run_id: str, messages: list[AnyMessage]) -> dict:
+        """
+        Starts the run, unless the checkpointer already has it: a run interrupted by a crash or
+        a restart continues after its last completed node, without replaying the LLM turns and tool
+        calls before it, and a finished or suspended run is returned as it is.
+        """
+        config = {"configurable": {"thread_id": run_id}}
+        try:
+            if self._checkpointer is not None:
+                snapshot = self._graph.get_state(config)
+                if snapshot.values:
+                    if snapshot.next and not any(task.interrupts for task in snapshot.tasks):
+                        return self._graph.invoke(None, config)
+                    return snapshot.values
+            return self._graph.invoke({"messages": messages}, config)
+        finally:
+            self._export_metrics()
+
+    def _export_metrics(self):
+        # A slow or failed run leaves its trace, an export failure never fails the run
+        try:
+            self._metrics.export_to_dir(self._metrics_dir)
+        except OSError:
+            self._metrics.count("metrics_export_errors")
+
+    def pending_replies(self, run_id: str) -> list[dict]:
+        """Get the replies a suspended run is waiting for"""
+        snapshot = self._graph.get_state({"configurable": {"thread_id": run_id}})
+        return [interrupt_.value for task in snapshot.tasks for interrupt_ in task.interrupts]
+
+    def resume(self, run_id: str, reply: dict) -> dict:
+        """Resume a suspended run with the reply (status name, response and thread id) it waited for"""
+        try:
+            return self._graph.invoke(Command(resume=reply), {"configurable": {"thread_id": run_id}})
+        finally:
+            self._export_metrics()
+
     @property
     def compiled_graph(self):
         """Get the compiled graph"""
         return self._graph
 
+    def warm_up(self):
+        """
+        Builds upfront what the first run would otherwise build: the chat model bound to the
+        tools, the Gmail client (OAuth credentials and discovery) and the router session.
+
+        The router is best effort: when it cannot be reached, the error is counted in the metrics
+        (warm_up_errors) and the availability is checked again by the runs, as it would be anyway.
+        """
+        for route in self._routing_policy.routes:
+            self._get_llm_with_tools(route)
+        self._tool2.service
+        try:
+            self._host_cache.active_hosts()
+        except Exception as error:
+            self._metrics.count("warm_up_errors", component="router", error=type(error).__name__)
+
+    @property
+    def messaging_tool(self) -> HumanMessagingInterfaceTool:
+        """Get the tool used to message humans"""
+        return self._tool2
 
-# Show the thought process
-# display(Image(react_graph.get_graph(xray=True).draw_mermaid_png()))
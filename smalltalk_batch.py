@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from langchain_core.messages import AIMessage
+
+from config.createdb import create_database
+from smalltalk_scheduler import DEFAULT_INSTRUCTIONS, run_messages
+from tools.metrics import Metrics, get_metrics
+from tools.ratelimits import BaseRateLimiter, create_rate_limiters
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage
+
+
+class HouseholdOutcome:
+    __slots__ = ("household", "status", "seconds", "contacted", "error")
+
+    def __init__(self, household, status, seconds, contacted, error=None):
+        self.household = household
+        self.status = status
+        self.seconds = seconds
+        self.contacted = contacted
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {"household": self.household, "status": self.status, "seconds": self.seconds, "contacted": self.contacted, "error": self.error}
+
+    def __repr__(self):
+        return f"HouseholdOutcome(household='{self.household}', status='{self.status}', seconds={self.seconds:.3f}, contacted={self.contacted}, error={self.error!r})"
+
+
+class BatchReport:
+    __slots__ = ("outcomes", "wall_seconds")
+
+    def __init__(self, outcomes: list[HouseholdOutcome], wall_seconds: float):
+        self.outcomes = outcomes
+        self.wall_seconds = wall_seconds
+
+    @property
+    def succeeded(self) -> int:
+        return sum(outcome.status == "ok" for outcome in self.outcomes)
+
+    @property
+    def households_per_minute(self) -> float:
+        return 60 * len(self.outcomes) / self.wall_seconds if self.wall_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "households": len(self.outcomes),
+            "succeeded": self.succeeded,
+            "failed": len(self.outcomes) - self.succeeded,
+            "wall_seconds": self.wall_seconds,
+            "households_per_minute": self.households_per_minute,
+            "outcomes": [outcome.to_dict() for outcome in self.outcomes],
+        }
+
+
+def _create_agent(household: str, storage: StateStorage, rate_limiters: dict[str, BaseRateLimiter], host_cache: RouterHostCache, metrics: Metrics):
+    from smalltalk_agent import SmallTalkAgent
+
+    return SmallTalkAgent(storage=storage, rate_limiters=rate_limiters, host_cache=host_cache, metrics=metrics)
+
+
+class BatchRunner:
+    """
+    Runs the agent of many households concurrently, each against its own state database, at
+    most max_concurrency at a time. All the agents share the rate limiters (one token bucket per
+    API, see tools/ratelimits.py), so that together they stay under the OpenAI, Gmail and router
+    quotas. They also share one router session, host_cache. By default it is a RouterHostCache
+    under the router limiter, created by the runner and closed when the batch ends; a given
+    host_cache is left open, its owner closes it.
+
+    agent_factory(household, storage, rate_limiters, host_cache, metrics) creates the agent of a
+    household, by default a SmallTalkAgent.
+
+    At the end of every batch the metrics are exported to metrics_dir (or SMALLTALK_METRICS_DIR)
+    as smalltalk_batch.jsonl and .prom, see Metrics.export_to_dir.
+    """
+
+    def __init__(self, agent_factory=_create_agent, max_concurrency: int = 4, rate_limiters: dict[str, BaseRateLimiter] = None, host_cache: RouterHostCache = None, metrics: Metrics = None, metrics_dir: str = None, clock=time.perf_counter):
+        self._agent_factory = agent_factory
+        self._max_concurrency = max_concurrency
+        self._rate_limiters = rate_limiters if rate_limiters is not None else create_rate_limiters()
+        self._metrics = metrics or get_metrics()
+        self._metrics_dir = metrics_dir
+        self._owns_host_cache = host_cache is None
+        self._host_cache = host_cache or RouterHostCache(ttl=float(os.getenv("ROUTER_HOSTS_TTL", "60")), metrics=self._metrics, rate_limiter=self._rate_limiters.get("router"))
+        self._clock = clock
+
+    def _run_household(self, household: str, state_db: str, instructions: str) -> HouseholdOutcome:
+        start = self._clock()
+        storage = None
+        try:
+            create_database(state_db)
+            storage = StateStorage(state_db, metrics=self._metrics)
+            agent = self._agent_factory(household, storage, self._rate_limiters, self._host_cache, self._metrics)
+            now = datetime.now()
+            with self._metrics.span("batch_run", household=household):
+                result = agent.run(f"{household}@{now.date().isoformat()}", run_messages(instructions, now))
+        except Exception as error:
+            return HouseholdOutcome(household, "error", self._clock() - start, [], f"{type(error).__name__}: {error}")
+        finally:
+            if storage is not None:
+                storage.close()
+
+        contacted = [tool_call["args"].get("human_name") for message in result["messages"] if isinstance(message, AIMessage)
+                     for tool_call in message.tool_calls if tool_call["name"] == "write_contact_event"]
+        return HouseholdOutcome(household, "ok", self._clock() - start, contacted)
+
+    def run(self, households: dict[str, str], instructions: str = DEFAULT_INSTRUCTIONS) -> BatchReport:
+        """
+        Runs every household (name -> state database path) and reports the outcome of each,
+        in the given order, and the throughput of the batch.
+        """
+        start = self._clock()
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_concurrency, thread_name_prefix="household") as executor:
+                futures = [executor.submit(self._run_household, household, state_db, instructions) for household, state_db in households.items()]
+                outcomes = [future.result() for future in futures]
+        finally:
+            if self._owns_host_cache:
+                # Logs out of the router, the next batch logs in again
+                self._host_cache.close()
+            try:
+                self._metrics.export_to_dir(self._metrics_dir, "smalltalk_batch")
+            except OSError:
+                self._metrics.count("metrics_export_errors")
+        return BatchReport(outcomes, self._clock() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the agent of many households concurrently, under shared rate limits")
+    parser.add_argument("state_dbs", nargs="+", help="State database of every household, its name is the household name")
+    parser.add_argument("--concurrency", type=int, default=4, help="Households run at the same time")
+    parser.add_argument("--llm-rps", type=float, help="OpenAI requests per second, for all households")
+    parser.add_argument("--gmail-rps", type=float, help="Gmail requests per second, for all households")
+    parser.add_argument("--router-rps", type=float, help="Router requests per second, for all households")
+    arguments = parser.parse_args()
+
+    rates = {api: rate for api, rate in [("llm", arguments.llm_rps), ("gmail", arguments.gmail_rps), ("router", arguments.router_rps)] if rate}
+    runner = BatchRunner(max_concurrency=arguments.concurrency, rate_limiters=create_rate_limiters(rates))
+    print(json.dumps(runner.run({state_db: state_db for state_db in arguments.state_dbs}).to_dict(), indent=2))
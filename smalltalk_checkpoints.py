@@ -0,0 +1,266 @@
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.types import TASKS
+
+from tools.statestorage import StateStorage
+
+DEFAULT_CHECKPOINT_DB_PATH = "checkpoints.db"
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[int]):
+    """
+    Durable checkpointer for the agent graph: every completed node of a run (thread_id) is saved to
+    a SQLite database, so that a run interrupted by a crash or a restart continues from its last
+    completed node instead of replaying its LLM turns and tool calls.
+
+    Only the latest keep_last checkpoints of a run are kept, and runs not updated for max_age_days
+    are dropped by prune(), which also runs on creation.
+    """
+
+    def __init__(self, db_path: str = None, keep_last: int = 3, max_age_days: float = 14, serde=None):
+        super().__init__(serde=serde)
+        self._storage = StateStorage(db_path or os.getenv("SMALLTALK_CHECKPOINT_DB", DEFAULT_CHECKPOINT_DB_PATH))
+        self._keep_last = keep_last
+        self._max_age_days = max_age_days
+        with self._storage.connection() as conn:
+            # Only effective on a new database, lets prune() give the freed pages back
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with self._storage.transaction() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Checkpoint (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                saved_at REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS CheckpointWrite (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            """)
+        self.prune()
+
+    @property
+    def storage(self) -> StateStorage:
+        return self._storage
+
+    def _read_tuple(self, cursor, thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata) -> CheckpointTuple:
+        cursor.execute("""
+            SELECT task_id, channel, type, value FROM CheckpointWrite
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx
+        """, (thread_id, checkpoint_ns, checkpoint_id))
+        pending_writes = [(task_id, channel, self.serde.loads_typed((value_type, value))) for task_id, channel, value_type, value in cursor.fetchall()]
+
+        # Sends issued by the parent step are delivered to this one
+        pending_sends = []
+        if parent_checkpoint_id:
+            cursor.execute("""
+                SELECT type, value FROM CheckpointWrite
+                WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ?
+                ORDER BY task_path, task_id, idx
+            """, (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS))
+            pending_sends = [self.serde.loads_typed(row) for row in cursor.fetchall()]
+
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**self.serde.loads_typed((type_, checkpoint)), "pending_sends": pending_sends},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id else None),
+            pending_writes=pending_writes)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self._storage.transaction() as cursor:
+            if checkpoint_id:
+                cursor.execute("""
+                    SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata
+                    FROM Checkpoint WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+                """, (thread_id, checkpoint_ns, checkpoint_id))
+            else:
+                cursor.execute("""
+                    SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata
+                    FROM Checkpoint WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT 1
+                """, (thread_id, checkpoint_ns))
+            row = cursor.fetchone()
+            return self._read_tuple(cursor, *row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None, before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        conditions, parameters = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            parameters.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                parameters.append(config["configurable"]["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                parameters.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            conditions.append("checkpoint_id < ?")
+            parameters.append(get_checkpoint_id(before))
+
+        with self._storage.transaction() as cursor:
+            cursor.execute(f"""
+                SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata
+                FROM Checkpoint {"WHERE " + " AND ".join(conditions) if conditions else ""}
+                ORDER BY checkpoint_id DESC
+            """, parameters)
+            rows = cursor.fetchall()
+
+            tuples = []
+            for row in rows:
+                if limit is not None and len(tuples) >= limit:
+                    break
+                # Metadata is stored serialized, it is filtered once loaded
+                if filter:
+                    metadata = self.serde.loads_typed((row[6], row[7]))
+                    if not all(metadata.get(key) == value for key, value in filter.items()):
+                        continue
+                tuples.append(self._read_tuple(cursor, *row))
+        yield from tuples
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        saved_checkpoint = checkpoint.copy()
+        saved_checkpoint.pop("pending_sends", None)
+        type_, serialized_checkpoint = self.serde.dumps_typed(saved_checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.execute("""
+                INSERT OR REPLACE INTO Checkpoint (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata, saved_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                  type_, serialized_checkpoint, metadata_type, serialized_metadata, time.time()))
+            if self._keep_last is not None:
+                self._prune_thread(cursor, thread_id, checkpoint_ns)
+
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized_value = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, type_, serialized_value, task_path))
+
+        # Special writes (errors, interrupts...) overwrite the previous ones, regular writes are kept once
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.executemany("""
+                INSERT OR REPLACE INTO CheckpointWrite (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [row for row in rows if row[4] < 0])
+            cursor.executemany("""
+                INSERT OR IGNORE INTO CheckpointWrite (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [row for row in rows if row[4] >= 0])
+
+    def _prune_thread(self, cursor, thread_id: str, checkpoint_ns: str):
+        cursor.execute("""
+            DELETE FROM Checkpoint
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                SELECT checkpoint_id FROM Checkpoint WHERE thread_id = ? AND checkpoint_ns = ?
+                ORDER BY checkpoint_id DESC LIMIT ?)
+        """, (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self._keep_last))
+        if cursor.rowcount:
+            cursor.execute("""
+                DELETE FROM CheckpointWrite
+                WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM Checkpoint WHERE thread_id = ? AND checkpoint_ns = ?)
+            """, (thread_id, checkpoint_ns, thread_id, checkpoint_ns))
+
+    def prune(self) -> int:
+        """
+        Drops the runs not updated for max_age_days and the checkpoints beyond the latest keep_last
+        of every other run. Returns the number of runs dropped.
+        """
+        with self._storage.transaction(immediate=True) as cursor:
+            dropped = 0
+            if self._max_age_days is not None:
+                cursor.execute("""
+                    SELECT thread_id FROM Checkpoint GROUP BY thread_id HAVING MAX(saved_at) < ?
+                """, (time.time() - self._max_age_days * 24 * 3600,))
+                stale_thread_ids = [row[0] for row in cursor.fetchall()]
+                for thread_id in stale_thread_ids:
+                    self._delete_thread(cursor, thread_id)
+                dropped = len(stale_thread_ids)
+
+            if self._keep_last is not None:
+                cursor.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM Checkpoint")
+                for thread_id, checkpoint_ns in cursor.fetchall():
+                    self._prune_thread(cursor, thread_id, checkpoint_ns)
+
+        # Give the freed pages back once in a while
+        with self._storage.connection() as conn:
+            conn.execute("PRAGMA incremental_vacuum")
+        return dropped
+
+    def _delete_thread(self, cursor, thread_id: str):
+        cursor.execute("DELETE FROM Checkpoint WHERE thread_id = ?", (thread_id,))
+        cursor.execute("DELETE FROM CheckpointWrite WHERE thread_id = ?", (thread_id,))
+
+    def delete_thread(self, thread_id: str):
+        """Drops all the checkpoints of a run"""
+        with self._storage.transaction(immediate=True) as cursor:
+            self._delete_thread(cursor, thread_id)
+
+    def thread_ids(self) -> "list[str]":
+        """Ids of the runs with saved checkpoints"""
+        with self._storage.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM Checkpoint ORDER BY thread_id").fetchall()]
+
+    def close(self):
+        self._storage.close()
+
+    # The graph runs synchronously, the async variants share the same implementation
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None, before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        self.put_writes(config, writes, task_id, task_path)
@@ -0,0 +1,51 @@
+from langchain_core.messages import AIMessage, AnyMessage, ToolMessage
+
+COMPACTED_PREFIX = "[compacted]"
+
+
+def estimate_tokens(messages: list[AnyMessage]) -> int:
+    """
+    Cheap token estimate (about four characters per token), good enough to enforce a budget.
+    """
+    total = 0
+    for message in messages:
+        total += len(str(message.content)) // 4 + 4
+        if isinstance(message, AIMessage):
+            total += sum(len(str(tool_call["args"])) // 4 + 4 for tool_call in message.tool_calls)
+    return total
+
+
+def summarize_tool_message(message: ToolMessage, max_chars: int = 160) -> str:
+    content = str(message.content)
+    if len(content) <= max_chars:
+        return f"{COMPACTED_PREFIX} {content}"
+    return f"{COMPACTED_PREFIX} {content[:max_chars]}... ({len(content) - max_chars} more characters of the {message.name} result omitted)"
+
+
+def compact_tool_messages(messages: list[AnyMessage], token_budget: int, max_chars: int = 160) -> list[ToolMessage]:
+    """
+    Returns replacements (same message ids) for the oldest tool results, until the conversation
+    fits the token budget. The results of the latest tool step are always kept verbatim.
+    """
+    if estimate_tokens(messages) <= token_budget:
+        return []
+
+    # Tool results after the last assistant message are the latest step
+    last_assistant_index = max((i for i, message in enumerate(messages) if isinstance(message, AIMessage)), default=len(messages))
+
+    total = estimate_tokens(messages)
+    replacements = []
+    for message in messages[:last_assistant_index]:
+        if total <= token_budget:
+            break
+        if not isinstance(message, ToolMessage) or str(message.content).startswith(COMPACTED_PREFIX):
+            continue
+
+        summary = summarize_tool_message(message, max_chars)
+        total -= estimate_tokens([message]) - estimate_tokens([ToolMessage(content=summary, tool_call_id=message.tool_call_id)])
+        replacements.append(ToolMessage(
+            id=message.id,
+            name=message.name,
+            tool_call_id=message.tool_call_id,
+            content=summary))
+    return replacements
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+import warnings
+from typing import Optional, Sequence
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+from tools.metrics import Metrics, get_metrics
+from tools.statestorage import StateStorage
+
+DEFAULT_LLM_CACHE_DB_PATH = "llm_cache.db"
+# Response metadata flag of the messages answered from the cache, no tokens were spent on them
+CACHE_HIT_METADATA = "llm_cache_hit"
+
+
+class SqliteLLMCache(BaseCache):
+    """
+    On-disk cache of chat model responses, keyed by a hash of the model string (model name,
+    parameters and bound tools) and the serialized messages. A replayed turn (test and benchmark
+    reruns, retried runs) is answered without calling the provider.
+
+    Entries expire after ttl seconds, and once more than max_entries are stored the least
+    recently used ones are evicted.
+
+    Messages answered from the cache carry CACHE_HIT_METADATA in their response metadata, so that
+    their stored usage is not counted again.
+    """
+
+    def __init__(self, db_path: str = None, max_entries: int = 1000, ttl: float = 7 * 24 * 3600, clock=time.time, metrics: Metrics = None):
+        self._storage = StateStorage(db_path or os.getenv("SMALLTALK_LLM_CACHE_DB", DEFAULT_LLM_CACHE_DB_PATH))
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._metrics = metrics or get_metrics()
+        with self._storage.transaction() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS LLMCacheEntry (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS LLMCacheEntryAccessedAt ON LLMCacheEntry (accessed_at)")
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        # The graph gives every message a random id, the same conversation must map to the same key
+        try:
+            messages = json.loads(prompt)
+        except ValueError:
+            messages = None
+        if isinstance(messages, list):
+            for message in messages:
+                if isinstance(message, dict) and isinstance(message.get("kwargs"), dict):
+                    message["kwargs"].pop("id", None)
+                    (message["kwargs"].get("response_metadata") or {}).pop(CACHE_HIT_METADATA, None)
+            prompt = json.dumps(messages, sort_keys=True)
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        key = self._key(prompt, llm_string)
+        now = self._clock()
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.execute("SELECT response, created_at FROM LLMCacheEntry WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            if row is not None and now - row[1] >= self._ttl:
+                cursor.execute("DELETE FROM LLMCacheEntry WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                cursor.execute("UPDATE LLMCacheEntry SET accessed_at = ? WHERE key = ?", (now, key))
+
+        self._metrics.count("llm_cache", result="hit" if row is not None else "miss")
+        if row is None:
+            return None
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", LangChainBetaWarning)
+            generations = [loads(generation) for generation in json.loads(row[0])]
+        for generation in generations:
+            # A replayed message is a new message of the conversation, it gets a new id
+            if getattr(generation, "message", None) is not None:
+                generation.message.id = None
+                generation.message.response_metadata[CACHE_HIT_METADATA] = True
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        now = self._clock()
+        response = json.dumps([dumps(generation) for generation in return_val])
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.execute("""
+                INSERT OR REPLACE INTO LLMCacheEntry (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)
+            """, (self._key(prompt, llm_string), response, now, now))
+            # Expired entries go first, then the least recently used beyond the size bound
+            cursor.execute("DELETE FROM LLMCacheEntry WHERE created_at <= ?", (now - self._ttl,))
+            cursor.execute("""
+                DELETE FROM LLMCacheEntry WHERE key IN (
+                    SELECT key FROM LLMCacheEntry ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)
+            """, (self._max_entries,))
+
+    def clear(self, **kwargs) -> None:
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.execute("DELETE FROM LLMCacheEntry")
+
+    def close(self):
+        self._storage.close()
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from tools.gmailreplywatcher import is_history_expired
+from tools.humanmessaginginterface import HumanMessagingInterfaceReturnStatus
+from tools.metrics import Metrics, get_metrics
+
+
+class ReplyDispatcher:
+    """
+    Services many suspended SmallTalkAgent runs (created with defer_responses=True) from one
+    thread: all awaited Gmail threads are checked with a single history request per poll, and
+    each run is resumed as soon as its reply arrives or its timeout expires.
+
+    A run awaits one reply at a time: when a step sent several messages, the run is suspended
+    on the first one, and on the next only once resumed. So only that first reply is watched.
+    Runs awaiting the same thread are all resumed with the first reply on it.
+
+    Errors are counted in metrics ("reply_polls" and "reply_resumes" with result="error") and
+    never stop the dispatcher. A failed poll is retried on the next one, and timed out runs are
+    resumed anyway. When the history of the awaited threads has expired, the threads are
+    re-scanned. A run whose resume failed is retried on the next poll while it still awaits
+    its reply; otherwise it is no longer watched and continues with run() (given a durable
+    checkpointer), e.g. on recover after a restart.
+    """
+
+    def __init__(self, agent, poll_interval: float = 5.0, clock=time.time, metrics: Metrics = None):
+        self._agent = agent
+        self._messaging_tool = agent.messaging_tool
+        self._poll_interval = poll_interval
+        self._clock = clock
+        self._metrics = metrics or get_metrics()
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def start(self, run_id: str, messages: list) -> dict:
+        """
+        Runs the agent until it finishes or suspends awaiting a reply, in which case the run
+        is watched until it can be resumed.
+        """
+        result = self._agent.run(run_id, messages)
+        self._watch(run_id)
+        return result
+
+    def recover(self, run_ids: list[str]) -> list[str]:
+        """
+        Watches again the runs that were suspended before a restart (with a durable checkpointer).
+        Returns the ids of those still awaiting a reply.
+        """
+        for run_id in run_ids:
+            self._watch(run_id)
+        pending_runs = self.pending_runs
+        return [run_id for run_id in run_ids if run_id in pending_runs]
+
+    def _watch(self, run_id: str):
+        # Only the reply the run is suspended on, see the class docstring
+        pending_replies = self._agent.pending_replies(run_id)
+        with self._lock:
+            if pending_replies:
+                self._pending[run_id] = dict(pending_replies[0])
+            else:
+                self._pending.pop(run_id, None)
+
+    @property
+    def pending_runs(self) -> list[str]:
+        with self._lock:
+            return list(self._pending)
+
+    def poll_once(self) -> list[str]:
+        """
+        Checks all awaited threads once and resumes the runs whose reply arrived or timed out.
+        Returns the ids of the resumed runs.
+        """
+        with self._lock:
+            pending = {run_id: dict(pending_reply) for run_id, pending_reply in self._pending.items()}
+        if not pending:
+            return []
+
+        start_history_id = min(pending.values(), key=lambda pending_reply: int(pending_reply["start_history_id"]))["start_history_id"]
+        # Runs may await the same thread, it is watched from the earliest of their start ids and
+        # its reply goes to each of them
+        thread_start_ids = {}
+        for pending_reply in pending.values():
+            thread_id = pending_reply["thread_id"]
+            if thread_id not in thread_start_ids or int(pending_reply["start_history_id"]) < int(thread_start_ids[thread_id]):
+                thread_start_ids[thread_id] = pending_reply["start_history_id"]
+        replies, latest_history_id = self._poll(start_history_id, thread_start_ids)
+
+        resumed = []
+        now = self._clock()
+        for run_id, pending_reply in pending.items():
+            reply_ids = replies.get(pending_reply["thread_id"])
+            if not reply_ids and now < pending_reply["deadline"]:
+                # Nothing yet, continue from where this poll stopped
+                if latest_history_id is not None:
+                    with self._lock:
+                        if run_id in self._pending:
+                            self._pending[run_id]["start_history_id"] = latest_history_id
+                continue
+
+            try:
+                self._resume(run_id, pending_reply, reply_ids)
+            except Exception as error:
+                self._metrics.count("reply_resumes", result="error", error=type(error).__name__)
+                try:
+                    # Retried on the next poll if the run still awaits the reply
+                    self._watch(run_id)
+                except Exception:
+                    pass
+                continue
+            self._metrics.count("reply_resumes", result="ok")
+            resumed.append(run_id)
+
+        return resumed
+
+    def _poll(self, start_history_id: str, thread_start_ids: dict) -> tuple[dict, str]:
+        # No replies and no new start id when the poll failed, it is tried again next time
+        watcher = self._messaging_tool.reply_watcher
+        try:
+            try:
+                return watcher.poll(start_history_id, thread_start_ids)
+            except Exception as error:
+                if not is_history_expired(error):
+                    raise
+                self._metrics.count("reply_polls", result="rescan")
+                return watcher.rescan(thread_start_ids)
+        except Exception as error:
+            self._metrics.count("reply_polls", result="error", error=type(error).__name__)
+            return {}, None
+
+    def _resume(self, run_id: str, pending_reply: dict, reply_ids: list[str]):
+        if reply_ids:
+            reply = {
+                "status": HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE.name,
+                "response": self._messaging_tool.read_reply(reply_ids[0]),
+                "thread_id": pending_reply["thread_id"],
+            }
+        else:
+            reply = {
+                "status": HumanMessagingInterfaceReturnStatus.RETURNED_ON_TIMEOUT_REACHED.name,
+                "response": None,
+                "thread_id": None,
+            }
+        self._agent.resume(run_id, reply)
+        # The run may have sent a follow up and suspended again
+        self._watch(run_id)
+
+    def run_forever(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as error:
+                self._metrics.count("reply_polls", result="error", error=type(error).__name__)
+            stop_event.wait(self._poll_interval)
@@ -0,0 +1,60 @@
+from langchain_core.messages import AIMessage, AnyMessage, ToolMessage
+
+from tools.humanmessaginginterface import HumanMessagingInterfaceReturnStatus
+
+LARGE_MODEL = "large"
+SMALL_MODEL = "small"
+
+
+class ModelRoutingPolicy:
+    """
+    Chooses the model of every assistant turn. Turns that only orchestrate tools (reading the
+    history, recording the contact, scheduling the next one, wrapping up) go to the small model;
+    the turns that follow the ranking, the history, the availability or a human response, where
+    the model picks the human and writes to them, go to the large one.
+
+    A small model turn that messages a human anyway is escalated: the turn is answered again by
+    the large model, so every human-facing message is composed by it. Subclass and override
+    route and escalate to plug in another policy.
+    """
+
+    # The models the policy may choose
+    routes = (LARGE_MODEL, SMALL_MODEL)
+
+    # After these results the next turn usually composes the message to the human
+    COMPOSING_AFTER = frozenset({
+        "rank_humans_for_contact",
+        "read_humans_and_contacts_events",
+        "human_availability_verifier",
+        "humans_availability_verifier",
+    })
+    HUMAN_FACING_TOOLS = frozenset({"human_messaging_interface"})
+
+    def route(self, messages: list[AnyMessage]) -> str:
+        tool_messages = []
+        for message in reversed(messages):
+            if not isinstance(message, ToolMessage):
+                break
+            tool_messages.append(message)
+        if any(message.name in self.COMPOSING_AFTER for message in tool_messages):
+            return LARGE_MODEL
+        # A response came in, the model may answer it with a follow up
+        if any(message.name in self.HUMAN_FACING_TOOLS and (message.artifact or {}).get("status") == HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE.name
+               for message in tool_messages):
+            return LARGE_MODEL
+        return SMALL_MODEL
+
+    def escalate(self, message: AIMessage) -> bool:
+        return any(tool_call["name"] in self.HUMAN_FACING_TOOLS for tool_call in message.tool_calls)
+
+
+class LargeModelOnlyPolicy(ModelRoutingPolicy):
+    """Every turn on the large model, i.e. no routing"""
+
+    routes = (LARGE_MODEL,)
+
+    def route(self, messages: list[AnyMessage]) -> str:
+        return LARGE_MODEL
+
+    def escalate(self, message: AIMessage) -> bool:
+        return False
@@ -0,0 +1,185 @@
+import argparse
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+from langchain_core.messages import HumanMessage
+
+from tools.metrics import Metrics, get_metrics
+from tools.statestorage import StateStorage
+
+DEFAULT_INSTRUCTIONS = "Have a chat with a human, but not if you already contacted someone today or no one is available."
+
+
+def run_messages(instructions: str, now: datetime) -> list:
+    """The messages starting a run: the current time and the instructions"""
+    return [HumanMessage(content=f"Hi, it's {now.strftime('%I:%M%p on %B %d, %Y')}. {instructions}")]
+
+
+class _Household:
+    __slots__ = ("name", "agent", "storage", "instructions")
+
+    def __init__(self, name, agent, storage, instructions):
+        self.name = name
+        self.agent = agent
+        self.storage = storage
+        self.instructions = instructions
+
+
+class ContactScheduler:
+    """
+    Runs the agent of every household only when its next contact (set with next_contact_schedule
+    and kept in the ContactSchedule table of its state database) is due. The due times of all
+    households are kept in one priority queue, the scheduler sleeps until the earliest one.
+
+    A household without a schedule is due right away. When a run does not set the next contact,
+    it is scheduled fallback_interval seconds later; when a run fails, it is retried after
+    retry_interval seconds, under the same run id, so that a run checkpointed midway continues
+    instead of starting over. After a restart the queue is rebuilt from the databases, and with a
+    durable checkpointer a run interrupted midway continues under the same run id.
+
+    After the runs, the metrics are exported to metrics_dir (or SMALLTALK_METRICS_DIR) as
+    smalltalk_scheduler.jsonl and .prom, see Metrics.export_to_dir.
+    """
+
+    def __init__(self, fallback_interval: float = 24 * 3600, retry_interval: float = 15 * 60, max_sleep: float = 60.0, clock=time.time, metrics: Metrics = None, metrics_dir: str = None):
+        self._fallback_interval = fallback_interval
+        self._retry_interval = retry_interval
+        self._max_sleep = max_sleep
+        self._clock = clock
+        self._metrics = metrics or get_metrics()
+        self._metrics_dir = metrics_dir
+        self._condition = threading.Condition()
+        self._households = {}
+        self._queue = []
+        self._due = {}
+        # The due time (so the run id) of the failed run each retry continues
+        self._retried_due = {}
+
+    def add_household(self, name: str, agent, storage: StateStorage, instructions: str = DEFAULT_INSTRUCTIONS):
+        """Registers the household (its agent and state database) and queues its next contact"""
+        with self._condition:
+            self._households[name] = _Household(name, agent, storage, instructions)
+            self._retried_due.pop(name, None)
+        self._push(name, self._read_due(storage))
+
+    @staticmethod
+    def _read_due(storage: StateStorage) -> float:
+        with storage.connection() as conn:
+            due = conn.execute("SELECT MIN(datetime) FROM ContactSchedule").fetchone()[0]
+        return due if due is not None else 0
+
+    def _push(self, name: str, due: float):
+        with self._condition:
+            # One live entry per household: the superseded ones stay in the heap and are skipped
+            if self._due.get(name) == due:
+                return
+            self._due[name] = due
+            heapq.heappush(self._queue, (due, name))
+            self._condition.notify_all()
+
+    def _pop_due(self, now: float) -> list[tuple[float, str]]:
+        due_entries = []
+        with self._condition:
+            while self._queue and self._queue[0][0] <= now:
+                due, name = heapq.heappop(self._queue)
+                if self._due.get(name) == due:
+                    del self._due[name]
+                    due_entries.append((due, name))
+        return due_entries
+
+    @property
+    def next_due(self) -> tuple[float, str]:
+        """The earliest (due time, household name), None when nothing is queued"""
+        with self._condition:
+            while self._queue and self._due.get(self._queue[0][1]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+            return self._queue[0] if self._queue else None
+
+    def run_due(self) -> list[str]:
+        """
+        Runs the households whose next contact is due, one after the other, and queues their
+        following one. Returns the names of the households run.
+        """
+        ran = []
+        due_entries = self._pop_due(self._clock())
+        for due, name in due_entries:
+            household = self._households[name]
+            with self._condition:
+                due = self._retried_due.pop(name, due)
+            try:
+                with self._metrics.span("scheduled_run", household=name):
+                    self._run(household, due)
+            except Exception:
+                self._metrics.count("scheduled_runs", household=name, result="error")
+                with self._condition:
+                    self._retried_due[name] = due
+                self._push(name, self._clock() + self._retry_interval)
+                continue
+            self._metrics.count("scheduled_runs", household=name, result="ok")
+            self._push(name, self._complete(household.storage, due))
+            ran.append(name)
+        if due_entries:
+            self._export_metrics()
+        return ran
+
+    def _export_metrics(self):
+        # Also when runs failed, a failed export never stops the scheduler
+        try:
+            self._metrics.export_to_dir(self._metrics_dir, "smalltalk_scheduler")
+        except OSError:
+            self._metrics.count("metrics_export_errors")
+
+    def _run(self, household: _Household, due: float):
+        messages = run_messages(household.instructions, datetime.fromtimestamp(self._clock()))
+        # The run id is stable for a due time, a restart continues the run instead of starting over
+        household.agent.run(f"{household.name}@{int(due)}", messages)
+
+    def _complete(self, storage: StateStorage, due: float) -> float:
+        # The contact that was due is done, keep the one the run may have set
+        with storage.transaction(immediate=True) as cursor:
+            cursor.execute("DELETE FROM ContactSchedule WHERE datetime <= ?", (due,))
+            next_due = cursor.execute("SELECT MIN(datetime) FROM ContactSchedule").fetchone()[0]
+            if next_due is None:
+                next_due = math.ceil(max(due, self._clock()) + self._fallback_interval)
+                cursor.execute("INSERT INTO ContactSchedule (datetime) VALUES (?)", (next_due,))
+        return next_due
+
+    def run_forever(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            self.run_due()
+            with self._condition:
+                next_due = self.next_due
+                timeout = self._max_sleep if next_due is None else min(max(next_due[0] - self._clock(), 0), self._max_sleep)
+                if timeout > 0:
+                    # Woken up early when a household is added or rescheduled
+                    self._condition.wait(timeout)
+
+    def stop(self, stop_event: threading.Event):
+        stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+
+if __name__ == "__main__":
+    from config.createdb import create_database
+    from smalltalk_agent import SmallTalkAgent
+
+    parser = argparse.ArgumentParser(description="Runs the agent of every household when its next contact is due")
+    parser.add_argument("state_dbs", nargs="+", help="State database of every household")
+    parser.add_argument("--checkpoint-db", help="Checkpoint database, to continue the runs interrupted by a restart")
+    arguments = parser.parse_args()
+
+    scheduler = ContactScheduler()
+    for state_db in arguments.state_dbs:
+        create_database(state_db)
+        storage = StateStorage(state_db)
+        scheduler.add_household(state_db, SmallTalkAgent(storage=storage, checkpoint_db=arguments.checkpoint_db), storage)
+
+    stop_event = threading.Event()
+    try:
+        scheduler.run_forever(stop_event)
+    except KeyboardInterrupt:
+        scheduler.stop(stop_event)
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage
+
+from smalltalk_scheduler import DEFAULT_INSTRUCTIONS, run_messages
+from tools.metrics import Metrics, get_metrics
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RunRequestHandler(BaseHTTPRequestHandler):
+    # POST /runs {"run_id": ..., "instructions": ...} runs the agent, GET /health reports the service
+    # and GET /metrics serves the metrics in the Prometheus text format
+    service = None
+
+    def _reply(self, status: int, body):
+        if isinstance(body, str):
+            payload, content_type = body.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            payload, content_type = json.dumps(body).encode("utf-8"), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._reply(200, self.service.health())
+        if self.path == "/metrics":
+            return self._reply(200, self.service.metrics.to_prometheus())
+        self._reply(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/runs":
+            return self._reply(404, {"error": f"Unknown path: {self.path}"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            trigger = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as error:
+            return self._reply(400, {"error": f"Malformed trigger: {error}"})
+        try:
+            self._reply(200, self.service.trigger(trigger.get("run_id"), trigger.get("instructions")))
+        except Exception as error:
+            self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+
+    def log_message(self, format, *args):
+        # Runs are recorded in the metrics, no access log (Unix socket clients have no address)
+        pass
+
+
+class SmallTalkService:
+    """
+    Keeps one SmallTalkAgent resident: the compiled graph, the chat model bound to the tools,
+    the Gmail client and the router session are built once on start, so that a run only costs
+    its LLM turns and tool calls. Runs are triggered over a local endpoint, either HTTP on a
+    host:port or a Unix socket path, one at a time. The OAuth access token is refreshed in the
+    background before it expires.
+    """
+
+    def __init__(self, agent, instructions: str = DEFAULT_INSTRUCTIONS, credential_refresh_interval: float = 300.0, metrics: Metrics = None, clock=datetime.now):
+        self._agent = agent
+        self._instructions = instructions
+        self._credential_refresh_interval = credential_refresh_interval
+        self._metrics = metrics or get_metrics()
+        self._clock = clock
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._server = None
+        self._threads = []
+        self._runs = 0
+        self._started_at = None
+
+    def trigger(self, run_id: str = None, instructions: str = None) -> dict:
+        """Runs the agent now and reports the run"""
+        now = self._clock()
+        run_id = run_id or now.strftime("%Y-%m-%dT%H:%M:%S.%f")
+        start = time.perf_counter()
+        # One run at a time, two concurrent runs could contact the same household twice
+        with self._run_lock, self._metrics.span("service_run"):
+            result = self._agent.run(run_id, run_messages(instructions or self._instructions, now))
+            self._runs += 1
+        ai_messages = [message for message in result["messages"] if isinstance(message, AIMessage)]
+        return {
+            "run_id": run_id,
+            "seconds": time.perf_counter() - start,
+            "contacted": [tool_call["args"].get("human_name") for message in ai_messages for tool_call in message.tool_calls if tool_call["name"] == "write_contact_event"],
+            "answer": ai_messages[-1].content if ai_messages else None,
+        }
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    def health(self) -> dict:
+        return {"status": "ok", "runs": self._runs, "uptime_seconds": time.monotonic() - self._started_at if self._started_at else 0.0}
+
+    def _refresh_credentials(self):
+        while not self._stop_event.wait(self._credential_refresh_interval):
+            try:
+                refreshed = self._agent.messaging_tool.refresh_credentials(margin=2 * self._credential_refresh_interval)
+                self._metrics.count("credential_refresh", result="refreshed" if refreshed else "valid")
+            except Exception:
+                # Retried on the next interval, a send would refresh the token itself anyway
+                self._metrics.count("credential_refresh", result="error")
+
+    def start(self, address: str, warm_up: bool = True):
+        """
+        Warms the agent up and starts serving on address ("host:port", port 0 for any free one,
+        or the path of a Unix socket). Returns the address served.
+        """
+        if warm_up:
+            with self._metrics.span("service_warm_up"):
+                self._agent.warm_up()
+
+        handler = type("RunRequestHandler", (_RunRequestHandler,), {"service": self})
+        if ":" in address:
+            host, port = address.rsplit(":", 1)
+            self._server = ThreadingHTTPServer((host, int(port)), handler)
+            served = f"{host}:{self._server.server_address[1]}"
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = _UnixHTTPServer(address, handler)
+            served = address
+
+        self._started_at = time.monotonic()
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="smalltalk-service", daemon=True),
+            threading.Thread(target=self._refresh_credentials, name="smalltalk-credentials", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return served
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if isinstance(self._server, _UnixHTTPServer) and os.path.exists(self._server.server_address):
+                os.unlink(self._server.server_address)
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+if __name__ == "__main__":
+    from smalltalk_agent import SmallTalkAgent
+
+    parser = argparse.ArgumentParser(description="Serves agent runs from a resident, warmed up, agent")
+    parser.add_argument("--listen", default="127.0.0.1:8765", help="host:port to serve HTTP on, or the path of a Unix socket")
+    parser.add_argument("--checkpoint-db", help="Checkpoint database, to continue the runs interrupted by a restart")
+    arguments = parser.parse_args()
+
+    service = SmallTalkService(SmallTalkAgent(checkpoint_db=arguments.checkpoint_db))
+    print(f"Serving on {service.start(arguments.listen)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
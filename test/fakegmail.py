@@ -0,0 +1,160 @@
+import base64
+from collections import Counter
+
+
+class _FakeRequest:
+    def __init__(self, gmail, name, handler, kwargs=None):
+        self._gmail = gmail
+        self._name = name
+        self._handler = handler
+        self._kwargs = kwargs or {}
+
+    def _run(self):
+        self._gmail.calls[self._name] += 1
+        self._gmail.requests.append((self._name, self._kwargs))
+        return self._handler()
+
+    def execute(self):
+        self._gmail.round_trips += 1
+        return self._run()
+
+
+class _FakeBatch:
+    def __init__(self, gmail, callback):
+        self._gmail = gmail
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self):
+        # All the requests of a batch travel in one HTTP round trip
+        self._gmail.round_trips += 1
+        self._gmail.calls["batch"] += 1
+        for request, callback, request_id in self._requests:
+            try:
+                response, exception = request._run(), None
+            except Exception as error:
+                response, exception = None, error
+            callback(request_id, response, exception)
+
+
+class _FakeResource:
+    def __init__(self, gmail, prefix):
+        self._gmail = gmail
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        handler = getattr(self._gmail, f"_{self._prefix}_{name}")
+        return lambda **kwargs: _FakeRequest(self._gmail, f"{self._prefix}.{name}", lambda: handler(**kwargs), kwargs)
+
+
+class _FakeUsers:
+    def __init__(self, gmail):
+        self._gmail = gmail
+
+    def getProfile(self, userId, **kwargs):
+        return _FakeRequest(self._gmail, "users.getProfile", lambda: {"historyId": str(self._gmail.history_id)}, kwargs)
+
+    def messages(self):
+        return _FakeResource(self._gmail, "messages")
+
+    def threads(self):
+        return _FakeResource(self._gmail, "threads")
+
+    def history(self):
+        return _FakeResource(self._gmail, "history")
+
+
+class FakeGmailService:
+    """
+    In-memory stand-in for the Gmail API client, with the subset of users() used by the
+    messaging tool. Every executed request is counted in calls and logged with its arguments
+    in requests, round_trips counts the HTTP round trips (a batch is a single one).
+    """
+
+    def __init__(self, history_page_size: int = 100):
+        self.calls = Counter()
+        self.requests = []
+        self.round_trips = 0
+        self.history_id = 1000
+        self.messages = {}
+        self.sent = []
+        self._history = []
+        self._history_page_size = history_page_size
+        self._scheduled_replies = []
+        self._next_id = 1
+
+    def users(self):
+        return _FakeUsers(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+    def add_reply(self, thread_id: str, body: str) -> str:
+        """
+        Simulates a human replying in the thread.
+        """
+        return self._add_message(thread_id, ["INBOX", "UNREAD"], body)
+
+    def schedule_reply(self, thread_id: str, body: str, after_history_polls: int):
+        """
+        Makes the reply arrive after the given number of history.list calls.
+        """
+        self._scheduled_replies.append([after_history_polls, thread_id, body])
+
+    def _add_message(self, thread_id, label_ids, body):
+        message_id = f"m{self._next_id}"
+        self._next_id += 1
+        thread_id = thread_id or f"t{message_id}"
+        self.history_id += 1
+        self.messages[message_id] = {
+            "id": message_id,
+            "threadId": thread_id,
+            "labelIds": list(label_ids),
+            "historyId": str(self.history_id),
+            "payload": {
+                "mimeType": "text/plain",
+                "body": {"data": base64.urlsafe_b64encode(body.encode("utf-8")).decode("ascii")},
+            },
+        }
+        self._history.append({
+            "id": str(self.history_id),
+            "messagesAdded": [{"message": {"id": message_id, "threadId": thread_id, "labelIds": list(label_ids)}}],
+        })
+        return message_id
+
+    def _messages_send(self, userId, body, **kwargs):
+        message_id = self._add_message(body.get("threadId"), ["SENT"], "")
+        self.sent.append(body)
+        message = self.messages[message_id]
+        return {"id": message_id, "threadId": message["threadId"], "labelIds": message["labelIds"]}
+
+    def _messages_get(self, userId, id, format="full", **kwargs):
+        return self.messages[id]
+
+    def _messages_modify(self, userId, id, body, **kwargs):
+        message = self.messages[id]
+        message["labelIds"] = [label for label in message["labelIds"] if label not in body.get("removeLabelIds", [])]
+        return message
+
+    def _threads_get(self, userId, id, **kwargs):
+        return {"id": id, "messages": [message for message in self.messages.values() if message["threadId"] == id]}
+
+    def _history_list(self, userId, startHistoryId, historyTypes=None, pageToken=None, **kwargs):
+        for scheduled in list(self._scheduled_replies):
+            scheduled[0] -= 1
+            if scheduled[0] < 0:
+                self._scheduled_replies.remove(scheduled)
+                self.add_reply(scheduled[1], scheduled[2])
+
+        records = [record for record in self._history if int(record["id"]) > int(startHistoryId)]
+        offset = int(pageToken or 0)
+        page = records[offset:offset + self._history_page_size]
+        response = {"historyId": str(self.history_id)}
+        if page:
+            response["history"] = page
+        if offset + self._history_page_size < len(records):
+            response["nextPageToken"] = str(offset + self._history_page_size)
+        return response
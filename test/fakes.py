@@ -0,0 +1,43 @@
+"""
+Test doubles shared by the tests: a virtual clock and a counting chat model script.
+"""
+
+
+class FakeClock:
+    """
+    Virtual time for the clock and sleep parameters: time() returns now, which the tests move
+    forward, and sleep advances it, keeping every duration slept in sleeps.
+    """
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def time(self):
+        return self.now
+
+
+class CountingScript:
+    """
+    Script of a ScriptedChatModel counting its turns, by default playing SmallTalkScript. The
+    process "crashes" with a ConnectionError on crash_on_turn.
+    """
+
+    def __init__(self, script=None, crash_on_turn: int = None):
+        if script is None:
+            from benchmark.scriptedmodel import SmallTalkScript
+
+            script = SmallTalkScript()
+        self.turns = 0
+        self._script = script
+        self._crash_on_turn = crash_on_turn
+
+    def __call__(self, messages):
+        self.turns += 1
+        if self.turns == self._crash_on_turn:
+            raise ConnectionError("Process killed")
+        return self._script(messages)
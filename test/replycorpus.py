@@ -0,0 +1,87 @@
+"""
+Sample Gmail reply payloads (format=full) with the text the human actually wrote, shared by the
+reply parser tests and benchmark/reply_parsing.py.
+"""
+import base64
+
+
+def text_part(mime_type: str, text: str, charset: str = "utf-8", filename: str = "") -> dict:
+    return {
+        "mimeType": mime_type,
+        "filename": filename,
+        "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}],
+        "body": {"data": base64.urlsafe_b64encode(text.encode(charset)).decode("ascii").rstrip("=")},
+    }
+
+
+def multipart(mime_type: str, *parts: dict) -> dict:
+    return {"mimeType": mime_type, "filename": "", "headers": [{"name": "Content-Type", "value": f"{mime_type}; boundary=b"}], "body": {"size": 0}, "parts": list(parts)}
+
+
+def attachment(filename: str) -> dict:
+    part = text_part("text/plain", "not the reply", filename=filename)
+    part["headers"].append({"name": "Content-Disposition", "value": f'attachment; filename="{filename}"'})
+    return part
+
+
+_GMAIL_HTML_QUOTE = (
+    '<div dir="ltr">{reply}</div><br><div class="gmail_quote"><div dir="ltr" class="gmail_attr">'
+    "On Mon, Mar 3, 2025 at 9:00 AM Agent &lt;agent@example.com&gt; wrote:<br></div>"
+    '<blockquote class="gmail_quote">How is your day going?</blockquote></div>'
+)
+
+CORPUS = [
+    ("plain_with_attribution",
+     text_part("text/plain", "Doing great, thanks!\r\n\r\nOn Mon, Mar 3, 2025 at 9:00 AM Agent <agent@example.com> wrote:\r\n> How is your day going?\r\n"),
+     "Doing great, thanks!"),
+    ("plain_with_wrapped_attribution",
+     text_part("text/plain", "All good here.\nSee you soon\n\nOn Mon, Mar 3, 2025 at 9:00 AM Agent <\nagent@example.com> wrote:\n\n> How is your day going?\n"),
+     "All good here.\nSee you soon"),
+    ("bottom_posted",
+     text_part("text/plain", "> How is your day going?\n> \n\nBusy, but fine!\n"),
+     "Busy, but fine!"),
+    ("outlook_original_message",
+     text_part("text/plain", "Thanks for asking :)\r\n\r\n-----Original Message-----\r\nFrom: Agent <agent@example.com>\r\nSent: Monday, March 3, 2025 9:00 AM\r\n\r\nHow is your day going?"),
+     "Thanks for asking :)"),
+    ("outlook_separator_line",
+     text_part("text/plain", "Fine, thank you.\r\n\r\n________________________________\r\nFrom: Agent <agent@example.com>\r\nHow is your day going?"),
+     "Fine, thank you."),
+    ("signature",
+     text_part("text/plain", "Lovely day, we went hiking.\n\n-- \nPawel Skorupinski\nSoftware Engineer\n"),
+     "Lovely day, we went hiking."),
+    ("mobile_signature",
+     text_part("text/plain", "Great!\n\nSent from my iPhone\n\n> On 3 Mar 2025, at 09:00, Agent <agent@example.com> wrote:\n"),
+     "Great!"),
+    ("italian_attribution",
+     text_part("text/plain", "Tutto bene, grazie!\n\nIl giorno lun 3 mar 2025 alle ore 09:00 Agent <agent@example.com> ha scritto:\n> Come va?\n"),
+     "Tutto bene, grazie!"),
+    ("latin1_charset",
+     text_part("text/plain", "Sì, è stata una bella giornata.\n\nInviato da iPhone\n", charset="iso-8859-1"),
+     "Sì, è stata una bella giornata."),
+    ("alternative",
+     multipart("multipart/alternative",
+               text_part("text/plain", "Doing great!\n\nOn Mon, Agent wrote:\n> How are you?\n"),
+               text_part("text/html", _GMAIL_HTML_QUOTE.format(reply="Doing great!"))),
+     "Doing great!"),
+    ("html_only",
+     text_part("text/html", _GMAIL_HTML_QUOTE.format(reply="Doing <b>great</b>,<br>thanks &amp; you?")),
+     "Doing great,\nthanks & you?"),
+    ("nested_mixed_with_attachment",
+     multipart("multipart/mixed",
+               multipart("multipart/related",
+                         multipart("multipart/alternative",
+                                   text_part("text/plain", "Photos from today attached.\n\nOn Mon, Agent wrote:\n> How are you?\n"),
+                                   text_part("text/html", _GMAIL_HTML_QUOTE.format(reply="Photos from today attached.")))),
+               attachment("notes.txt")),
+     "Photos from today attached."),
+    ("html_in_mixed_without_plain",
+     multipart("multipart/mixed",
+               text_part("text/html", "<html><head><style>p {color: red}</style></head><body><p>Not much, relaxing.</p>"
+                                      "<div class=\"moz-cite-prefix\">On 03/03/2025 09:00, Agent wrote:</div>"
+                                      "<blockquote>How is your day going?</blockquote></body></html>"),
+               attachment("photo.txt")),
+     "Not much, relaxing."),
+    ("no_text",
+     multipart("multipart/mixed", attachment("calendar.txt")),
+     ""),
+]
@@ -0,0 +1,44 @@
+class StubDevice:
+    def __init__(self, mac_address: str, active: bool):
+        self.id = mac_address.upper()
+        self.active = active
+
+
+class StubRouter:
+    """
+    Stand-in for the Sagemcom router: hands out clients sharing the same host table and
+    counts logins and host table downloads.
+    """
+
+    def __init__(self, devices: dict[str, bool] = None):
+        self.devices = dict(devices or {})
+        self.logins = 0
+        self.get_hosts_calls = 0
+        self.fail_logins = False
+        self.expire_sessions = False
+
+    def create_client(self) -> "StubRouterClient":
+        return StubRouterClient(self)
+
+
+class StubRouterClient:
+    def __init__(self, router: StubRouter):
+        self._router = router
+        self._logged_in = False
+        self.closed = False
+
+    async def login(self):
+        if self._router.fail_logins:
+            raise ConnectionError("Router refused the login")
+        self._router.logins += 1
+        self._logged_in = True
+
+    async def get_hosts(self) -> list[StubDevice]:
+        if not self._logged_in or self._router.expire_sessions:
+            self._router.expire_sessions = False
+            raise ConnectionError("Session expired")
+        self._router.get_hosts_calls += 1
+        return [StubDevice(mac_address, active) for mac_address, active in self._router.devices.items()]
+
+    async def close(self):
+        self.closed = True
@@ -0,0 +1,226 @@
+import pytest
+import functools
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from benchmark.agent_scenarios import run_scenarios
+from benchmark.scriptedmodel import ScriptedChatModel
+from config.createdb import create_database
+from smalltalk_agent import SmallTalkAgent
+from tools.humanavailabilityverifier import HumansAvailabilityVerifierTool
+from tools.humancontacthistory import HumansAndContactsEventsReaderTool
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.metrics import Metrics
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage, to_epoch
+from fakegmail import FakeGmailService
+from stubrouter import StubRouter
+
+
+def test_offline_agent_should_contact_fairly_then_record_and_schedule():
+    # WHEN
+    [result] = run_scenarios(["contact_fairly"])
+
+    # THEN
+    assert result["contacted"] == ["Pawel"]
+    assert result["tool_calls"] == {"rank_humans_for_contact": 1, "human_messaging_interface": 2, "write_contact_event": 1, "next_contact_schedule": 1}
+    # Recording the contact and scheduling the next one take a single turn
+    assert result["llm_turns"] == 5
+    assert result["prompt_tokens"] > result["completion_tokens"] > 0
+    assert set(result["node_seconds"]) == {"gate", "assistant", "tools", "compact"}
+
+
+def test_routed_agent_should_compose_messages_on_the_large_model_only():
+    # WHEN
+    [result] = run_scenarios(["contact_fairly_routed"])
+
+    # THEN
+    assert result["contacted"] == ["Pawel"]
+    # Ranking, recording and wrapping up on the small model, the message and the follow up on the large one
+    assert result["llm_turns_by_model"] == {"small": 3, "large": 2}
+
+
+def test_agent_should_escalate_small_model_turns_messaging_a_human(tmp_path):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    message_call = {"name": "human_messaging_interface", "args": {"human_email": "pawel@example.com", "message_subject": "Ciao!", "message_body": "Hi!"}, "id": "call", "type": "tool_call"}
+
+    def script(messages):
+        if isinstance(messages[-1], HumanMessage):
+            return AIMessage(content="", tool_calls=[message_call])
+        return AIMessage(content="Done.")
+
+    large_model = ScriptedChatModel(script=script)
+    small_model = ScriptedChatModel(script=script)
+    metrics = Metrics()
+    agent = SmallTalkAgent(
+        pre_gate=False,
+        model=large_model,
+        small_model=small_model,
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService(), metrics=metrics),
+        metrics=metrics)
+
+    # WHEN
+    agent.compiled_graph.invoke({"messages": [HumanMessage(content="Say hi to Pawel.")]})
+
+    # THEN
+    turns = {counter["labels"]["model"]: counter["value"] for counter in metrics.summary()["llm_turns"]}
+    # The first turn went to the small model, then again to the large one
+    assert turns == {"small": 2, "large": 1}
+    assert metrics.summary()["llm_escalations"] == [{"labels": {}, "value": 1}]
+    assert metrics.summary()["llm_discarded_turns"] == [{"labels": {"model": "small"}, "value": 1}]
+    storage.close()
+
+
+def test_offline_agent_should_skip_contact_without_llm_turns_if_someone_was_contacted_today():
+    # WHEN
+    [result] = run_scenarios(["skip_contacted_today"])
+
+    # THEN
+    assert result["contacted"] == []
+    assert result["llm_turns"] == 0
+    assert result["node_calls"] == {"gate": 1}
+
+
+def test_gate_should_end_the_run_without_calling_the_model_when_no_contact_is_allowed(tmp_path):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("giulia@example.com", "3A:52:10:1D:4D:75", "Giulia"))
+        cursor.execute("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)", (2, to_epoch(datetime.now() - timedelta(hours=1))))
+    prompts = []
+
+    def script(messages):
+        prompts.append(messages)
+        return AIMessage(content="Done.")
+
+    metrics = Metrics()
+    agent = SmallTalkAgent(
+        model=ScriptedChatModel(script=script),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService()),
+        metrics=metrics)
+
+    # WHEN
+    result = agent.compiled_graph.invoke({"messages": [HumanMessage(content="Have a chat with a human.")]})
+
+    # THEN
+    assert prompts == []
+    assert result["gate_decision"]["contact_allowed"] is False
+    assert result["messages"][-1].content.startswith("No contact today.")
+    assert "llm_turns" not in metrics.summary()
+    storage.close()
+
+
+def test_agent_should_run_read_only_tools_together_and_side_effects_in_call_order(tmp_path):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+    calls = [
+        ("write_contact_event", {"human_name": "Pawel"}),
+        ("read_humans_and_contacts_events", {}),
+        ("humans_availability_verifier", {}),
+        ("next_contact_schedule", {"next_contact_datetime": "2025-03-22 09:00:00"}),
+    ]
+
+    def script(messages):
+        if isinstance(messages[-1], HumanMessage):
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": name, "type": "tool_call"} for name, args in calls])
+        return AIMessage(content="Done.")
+
+    agent = SmallTalkAgent(
+        pre_gate=False,
+        model=ScriptedChatModel(script=script),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService()),
+        host_cache=RouterHostCache(client_factory=StubRouter({"B2:66:C2:5D:17:71": True}).create_client))
+
+    # WHEN
+    result = agent.compiled_graph.invoke({"messages": [HumanMessage(content="Have a chat with a human.")]})
+
+    # THEN
+    tool_messages = [message for message in result["messages"] if isinstance(message, ToolMessage)]
+    assert [message.tool_call_id for message in tool_messages] == [name for name, _ in calls]
+    assert tool_messages[2].content == '{"Pawel": true}'
+    # The contact event was written before the history was read
+    assert tool_messages[1].content.splitlines()[1].endswith("|yes")
+    storage.close()
+
+
+def test_agent_should_overlap_read_only_calls_of_a_step(tmp_path, monkeypatch):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    # Each read waits for the other one, they only get past the barrier if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    overlapped = []
+
+    def waiting_for_the_other_read(tool_use):
+        @functools.wraps(tool_use)
+        def use(self, *args, **kwargs):
+            try:
+                barrier.wait()
+                overlapped.append(True)
+            except threading.BrokenBarrierError:
+                overlapped.append(False)
+            return tool_use(self, *args, **kwargs)
+        return use
+
+    for tool_class in (HumansAndContactsEventsReaderTool, HumansAvailabilityVerifierTool):
+        monkeypatch.setattr(tool_class, "use", waiting_for_the_other_read(tool_class.use))
+    calls = [
+        ("write_contact_event", {"human_name": "Pawel"}),
+        ("read_humans_and_contacts_events", {}),
+        ("humans_availability_verifier", {}),
+    ]
+
+    def script(messages):
+        if isinstance(messages[-1], HumanMessage):
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": name, "type": "tool_call"} for name, args in calls])
+        return AIMessage(content="Done.")
+
+    agent = SmallTalkAgent(
+        pre_gate=False,
+        model=ScriptedChatModel(script=script),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService()),
+        host_cache=RouterHostCache(client_factory=StubRouter({}).create_client))
+
+    # WHEN
+    agent.compiled_graph.invoke({"messages": [HumanMessage(content="Have a chat with a human.")]})
+
+    # THEN
+    assert overlapped == [True, True]
+    storage.close()
+
+
+def test_agent_should_export_metrics_at_the_end_of_every_run(tmp_path):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    agent = SmallTalkAgent(
+        model=ScriptedChatModel(script=lambda messages: AIMessage(content="Done.")),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService()),
+        host_cache=RouterHostCache(client_factory=StubRouter({}).create_client),
+        metrics=Metrics(),
+        metrics_dir=str(tmp_path / "metrics"))
+
+    # WHEN
+    agent.run("morning", [HumanMessage(content="Have a chat with a human.")])
+
+    # THEN
+    assert 'smalltalk_node_seconds_count{node="gate"} 1' in (tmp_path / "metrics" / "smalltalk.prom").read_text()
+    assert (tmp_path / "metrics" / "smalltalk.jsonl").exists()
+    storage.close()
@@ -0,0 +1,64 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timedelta
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from tools.fairnessranking import FairnessScorer
+from tools.statestorage import StateStorage, to_epoch
+
+
+NOW = datetime(2025, 3, 20, 9, 0)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    storage = StateStorage(db_file)
+    yield storage
+    storage.close()
+
+
+def _add_human(storage, name, contacts_days_ago):
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (f"{name.lower()}@example.com", None, name))
+        human_id = cursor.lastrowid
+        for days_ago in contacts_days_ago:
+            cursor.execute("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)", (human_id, to_epoch(NOW - timedelta(days=days_ago))))
+
+
+def test_scorer_should_rank_least_recently_and_least_frequently_contacted_first(storage):
+    # GIVEN
+    _add_human(storage, "Pawel", [1, 3, 5])
+    _add_human(storage, "Giulia", [2])
+    _add_human(storage, "Marco", [])
+    _add_human(storage, "Anna", [20])
+
+    # WHEN
+    ranking = FairnessScorer().rank(storage, availability={"Marco": False}, now=NOW)
+
+    # THEN
+    assert ranking.contact_allowed
+    assert [human.name for human in ranking.humans] == ["Anna", "Giulia", "Pawel", "Marco"]
+    assert ranking.best.name == "Anna"
+    assert not ranking.humans[-1].eligible
+    assert ranking.humans[2].short_window_contacts == 3
+    assert ranking.humans[0].days_since_last_contact == 20
+
+
+def test_scorer_should_disallow_contact_when_someone_was_contacted_today(storage):
+    # GIVEN
+    _add_human(storage, "Pawel", [])
+    _add_human(storage, "Giulia", [1 / 24])
+
+    # WHEN
+    ranking = FairnessScorer().rank(storage, now=NOW)
+
+    # THEN
+    assert not ranking.contact_allowed
+    assert "Giulia" in ranking.reason
+    assert ranking.best is None
+    assert not any(human.eligible for human in ranking.humans)
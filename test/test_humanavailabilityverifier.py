@@ -0,0 +1,115 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from tools.humanavailabilityverifier import HumanAvailabilityVerifierTool, HumansAvailabilityVerifierTool
+from tools.metrics import Metrics
+from tools.routerhostcache import RouterHostCache, create_sagemcom_client
+from tools.statestorage import StateStorage
+from fakes import FakeClock
+from stubrouter import StubRouter
+
+
+@pytest.fixture
+def router():
+    return StubRouter({"B2:66:C2:5D:17:71": True, "3A:52:10:1D:4D:75": False})
+
+
+def test_availability_verifier_should_answer_from_one_session_until_ttl_expires(router):
+    # GIVEN
+    clock = FakeClock()
+    host_cache = RouterHostCache(client_factory=router.create_client, ttl=60, clock=clock.time)
+    tool = HumanAvailabilityVerifierTool(host_cache=host_cache)
+
+    # WHEN
+    first_results = [tool.use("b2:66:c2:5d:17:71"), tool.use("3A:52:10:1D:4D:75"), tool.use("00:00:00:00:00:00")]
+    clock.now = 61
+    router.devices["3A:52:10:1D:4D:75"] = True
+    second_result = tool.use("3A:52:10:1D:4D:75")
+    host_cache.close()
+
+    # THEN
+    assert first_results == [True, False, False]
+    assert second_result is True
+    assert router.logins == 1
+    assert router.get_hosts_calls == 2
+
+
+def test_availability_verifier_should_log_in_again_when_session_expires(router):
+    # GIVEN
+    clock = FakeClock()
+    host_cache = RouterHostCache(client_factory=router.create_client, ttl=60, clock=clock.time)
+    tool = HumanAvailabilityVerifierTool(host_cache=host_cache)
+    tool.use("B2:66:C2:5D:17:71")
+
+    # WHEN
+    clock.now = 61
+    router.expire_sessions = True
+    result = tool.use("B2:66:C2:5D:17:71")
+    host_cache.close()
+
+    # THEN
+    assert result is True
+    assert router.logins == 2
+
+
+def test_availability_verifier_should_return_none_when_router_login_fails(router):
+    # GIVEN
+    router.fail_logins = True
+    host_cache = RouterHostCache(client_factory=router.create_client)
+    metrics = Metrics()
+    tool = HumanAvailabilityVerifierTool(host_cache=host_cache, metrics=metrics)
+
+    # WHEN
+    result = tool.use("B2:66:C2:5D:17:71")
+    host_cache.close()
+
+    # THEN
+    assert result is None
+    assert metrics.summary()["availability_errors"] == [{"labels": {"error": "ConnectionError", "tool": "human_availability_verifier"}, "value": 1}]
+
+
+def test_availability_verifier_should_report_a_missing_router_password(monkeypatch):
+    # GIVEN
+    monkeypatch.delenv("ROUTER_PASSWORD", raising=False)
+    metrics = Metrics()
+    host_cache = RouterHostCache()
+    tool = HumanAvailabilityVerifierTool(host_cache=host_cache, metrics=metrics)
+
+    # WHEN
+    result = tool.use("B2:66:C2:5D:17:71")
+    host_cache.close()
+
+    # THEN
+    assert result is None
+    assert metrics.summary()["availability_errors"] == [{"labels": {"error": "RuntimeError", "tool": "human_availability_verifier"}, "value": 1}]
+    with pytest.raises(RuntimeError, match="ROUTER_PASSWORD"):
+        create_sagemcom_client()
+
+
+def test_batch_availability_verifier_should_check_everyone_with_one_host_table_fetch(router, tmp_path):
+    # GIVEN
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    storage = StateStorage(db_file)
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (None, "B2:66:C2:5D:17:71", "Pawel"))
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (None, "3A:52:10:1D:4D:75", "Giulia"))
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (None, "11:22:33:44:55:66", "Marco"))
+    host_cache = RouterHostCache(client_factory=router.create_client)
+    tool = HumansAvailabilityVerifierTool(host_cache=host_cache, storage=storage)
+
+    # WHEN
+    everyone = tool.use()
+    selected = tool.use(["3A:52:10:1D:4D:75", "B2:66:C2:5D:17:71"])
+    host_cache.close()
+    storage.close()
+
+    # THEN
+    assert everyone == {"Pawel": True, "Giulia": False, "Marco": False}
+    assert selected == {"3A:52:10:1D:4D:75": False, "B2:66:C2:5D:17:71": True}
+    assert router.logins == 1
+    assert router.get_hosts_calls == 1
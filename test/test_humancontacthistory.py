@@ -0,0 +1,253 @@
+import pytest
+import contextlib
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from tools.humancontacthistory import HumansAndContactsEventsReaderTool, ContactEventRecorderTool, ContactEventWriter
+from tools.metrics import Metrics
+from tools.statestorage import StateStorage, to_epoch
+
+
+@pytest.fixture
+def storage(tmp_path):
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    storage = StateStorage(db_file)
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("giulia@example.com", "3A:52:10:1D:4D:75", "Giulia"))
+        for days_ago in [1, 3, 20]:
+            cursor.execute("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)", (2, to_epoch(datetime.now() - timedelta(days=days_ago))))
+    yield storage
+    storage.close()
+
+
+def test_reader_should_summarize_contacts_per_human(storage):
+    # GIVEN
+    ContactEventRecorderTool(storage=storage).use("Pawel")
+    reader = HumansAndContactsEventsReaderTool(storage=storage)
+
+    # WHEN
+    summaries = reader.read(window_days=7)
+    output = reader.use(window_days=7)
+
+    # THEN
+    pawel, giulia = summaries
+    assert (pawel.contacts_in_window, pawel.days_since_last_contact, pawel.contacted_today) == (1, 0, True)
+    assert (giulia.contacts_in_window, giulia.days_since_last_contact, giulia.contacted_today) == (2, 1, False)
+    lines = output.splitlines()
+    assert lines[0] == "name|email|phone|last_contact|contacts_last_7_days|days_since_last_contact|contacted_today"
+    assert lines[2].startswith("Giulia|giulia@example.com|3A:52:10:1D:4D:75|")
+    assert lines[2].endswith("|2|1|no")
+
+
+def test_reader_should_page_through_history_with_human_names(storage):
+    # GIVEN
+    reader = HumansAndContactsEventsReaderTool(storage=storage)
+
+    # WHEN
+    humans, first_page = reader.read(mode="history", history_limit=2)
+    _, second_page = reader.read(mode="history", history_limit=2, history_offset=2)
+    output = reader.use(mode="history", history_limit=1)
+
+    # THEN
+    assert [human.name for human in humans] == ["Pawel", "Giulia"]
+    assert len(first_page) == 2 and len(second_page) == 1
+    assert first_page[0].datetime_ > first_page[1].datetime_ > second_page[0].datetime_
+    assert output.splitlines()[-2:] == ["contacted|datetime", f"Giulia|{first_page[0].datetime_:%Y-%m-%d %H:%M}"]
+
+
+def test_reader_should_count_contacts_only_inside_the_window(storage):
+    # GIVEN
+    reader = HumansAndContactsEventsReaderTool(storage=storage)
+
+    # WHEN
+    narrow = {summary.name: summary for summary in reader.read(window_days=2)}
+    wide = {summary.name: summary for summary in reader.read(window_days=30)}
+
+    # THEN
+    assert (narrow["Giulia"].contacts_in_window, wide["Giulia"].contacts_in_window) == (1, 3)
+    assert narrow["Giulia"].last_contact == wide["Giulia"].last_contact
+    # Never contacted: no last contact, in the summary nor in its table
+    assert (wide["Pawel"].last_contact, wide["Pawel"].contacts_in_window, wide["Pawel"].days_since_last_contact, wide["Pawel"].contacted_today) == (None, 0, None, False)
+    assert reader.use(window_days=30).splitlines()[1] == "Pawel|pawel@example.com|B2:66:C2:5D:17:71||0||no"
+
+
+def test_reader_should_return_an_empty_history_page_past_the_last_event(storage):
+    # GIVEN
+    reader = HumansAndContactsEventsReaderTool(storage=storage)
+
+    # WHEN
+    humans, contact_events = reader.read(mode="history", history_offset=3)
+    output = reader.use(mode="history", history_offset=3)
+
+    # THEN
+    assert len(humans) == 2 and contact_events == []
+    assert output.split("\n\n") == ["name|email|phone\nPawel|pawel@example.com|B2:66:C2:5D:17:71\nGiulia|giulia@example.com|3A:52:10:1D:4D:75", "contacted|datetime"]
+
+
+def test_reader_should_reject_unknown_mode(storage):
+    with pytest.raises(ValueError):
+        HumansAndContactsEventsReaderTool(storage=storage).use(mode="everything")
+
+
+def _commits(metrics: Metrics) -> int:
+    return sum(span["count"] for span in metrics.summary().get("sqlite", []) if span["labels"]["statement"] == "COMMIT")
+
+
+def test_writer_should_record_many_events_in_one_commit(tmp_path):
+    # GIVEN
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    metrics = Metrics()
+    storage = StateStorage(db_file, metrics=metrics)
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, 'Pawel')")
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, 'Giulia')")
+    writer = ContactEventWriter(storage)
+    commits_before = _commits(metrics)
+
+    # WHEN
+    ids = writer.record_many([("Pawel" if i % 2 else "Giulia", datetime.now() - timedelta(hours=i)) for i in range(50)])
+
+    # THEN
+    assert len(set(ids)) == 50
+    assert _commits(metrics) - commits_before == 1
+    with pytest.raises(ValueError):
+        writer.record_many([("Pawel", None), ("Nobody", None)])
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ContactEvent").fetchone()[0] == 50
+    storage.close()
+
+
+def test_writer_should_buffer_events_until_flushed(storage):
+    # GIVEN
+    writer = ContactEventWriter(storage, max_pending=3, flush_interval=60)
+
+    # WHEN
+    writer.record("Pawel", wait=False)
+    writer.record("Pawel", wait=False)
+    with storage.connection() as conn:
+        buffered = conn.execute("SELECT COUNT(*) FROM ContactEvent WHERE human_id = 1").fetchone()[0]
+    writer.record("Pawel", wait=False)
+    with storage.connection() as conn:
+        flushed_on_size = conn.execute("SELECT COUNT(*) FROM ContactEvent WHERE human_id = 1").fetchone()[0]
+    writer.record("Pawel", wait=False)
+    writer.close()
+
+    # THEN
+    assert (buffered, flushed_on_size) == (0, 3)
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ContactEvent WHERE human_id = 1").fetchone()[0] == 4
+
+
+def test_writer_should_flush_buffered_events_after_the_interval(storage):
+    # GIVEN
+    writer = ContactEventWriter(storage, flush_interval=0.05)
+
+    # WHEN
+    writer.record("Pawel", wait=False)
+    flushed = 0
+    for _ in range(100):
+        with storage.connection() as conn:
+            flushed = conn.execute("SELECT COUNT(*) FROM ContactEvent WHERE human_id = 1").fetchone()[0]
+        if flushed:
+            break
+        time.sleep(0.02)
+
+    # THEN
+    assert flushed == 1
+
+
+def test_concurrent_recorders_should_share_commits(tmp_path):
+    # GIVEN
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    metrics = Metrics()
+    storage = StateStorage(db_file, pool_size=16, metrics=metrics)
+    with storage.transaction() as cursor:
+        cursor.executemany("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, ?)", [(f"Human{i}",) for i in range(8)])
+    writer = ContactEventWriter(storage)
+    recorder = ContactEventRecorderTool(writer=writer)
+    commits_before = _commits(metrics)
+    ids = []
+
+    # The first commit is held until the other recorders have buffered their events
+    first_commit_started = threading.Event()
+    release_first_commit = threading.Event()
+    transaction = storage.transaction
+
+    @contextlib.contextmanager
+    def held_transaction(*args, **kwargs):
+        if not first_commit_started.is_set():
+            first_commit_started.set()
+            release_first_commit.wait(5)
+        with transaction(*args, **kwargs) as cursor:
+            yield cursor
+    storage.transaction = held_transaction
+
+    # WHEN
+    threads = [threading.Thread(target=lambda name=f"Human{i}": ids.append(recorder.use(name))) for i in range(8)]
+    threads[0].start()
+    first_commit_started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    for _ in range(250):
+        if len(writer._pending.events) == 7:
+            break
+        time.sleep(0.02)
+    release_first_commit.set()
+    for thread in threads:
+        thread.join()
+
+    # THEN
+    assert sorted(ids) == list(range(1, 9))
+    # One commit for the first event, one for the seven buffered meanwhile
+    assert _commits(metrics) - commits_before == 2
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM ContactEvent").fetchone()[0] == 8
+    storage.close()
+
+
+def test_writer_should_record_under_the_current_id_of_a_re_added_human(storage):
+    # GIVEN
+    writer = ContactEventWriter(storage)
+    writer.record("Pawel")
+    with storage.transaction() as cursor:
+        cursor.execute("DELETE FROM ContactEvent WHERE human_id = 1")
+        cursor.execute("DELETE FROM Human WHERE id = 1")
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+        human_id = cursor.lastrowid
+
+    # WHEN
+    event_id = writer.record("Pawel")
+
+    # THEN
+    with storage.connection() as conn:
+        assert conn.execute("SELECT human_id FROM ContactEvent WHERE id = ?", (event_id,)).fetchone()[0] == human_id
+
+
+def test_writer_should_fail_only_the_events_of_a_deleted_human(storage):
+    # GIVEN
+    writer = ContactEventWriter(storage, flush_interval=60)
+    writer.record("Pawel", wait=False)
+    # Deleted while the event is buffered
+    with storage.transaction() as cursor:
+        cursor.execute("DELETE FROM Human WHERE id = 1")
+
+    # WHEN
+    event_id = writer.record("Giulia")
+
+    # THEN
+    with storage.connection() as conn:
+        assert conn.execute("SELECT human_id FROM ContactEvent WHERE id = ?", (event_id,)).fetchone()[0] == 2
+    # The buffered event failed in the same commit, raised once by the next call
+    with pytest.raises(ValueError, match="Pawel"):
+        writer.flush()
+    writer.flush()
@@ -0,0 +1,126 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from langchain_core.messages import ToolMessage
+from smalltalk_routing import LARGE_MODEL, SMALL_MODEL, ModelRoutingPolicy
+from tools.gmailreplywatcher import GmailReplyWatcher
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool, HumanMessagingInterfaceReturnStatus
+from fakegmail import FakeGmailService
+from fakes import FakeClock
+
+
+def _create_tool(gmail: FakeGmailService, clock: FakeClock) -> HumanMessagingInterfaceTool:
+    tool = HumanMessagingInterfaceTool(service=gmail)
+    tool._reply_watcher = GmailReplyWatcher(gmail, sleep=clock.sleep, clock=clock.time)
+    return tool
+
+
+def test_reply_watcher_should_only_report_replies_in_watched_threads():
+    # GIVEN
+    gmail = FakeGmailService(history_page_size=2)
+    watcher = GmailReplyWatcher(gmail)
+    start_history_id = watcher.current_history_id()
+    gmail.add_reply("t1", "unrelated")
+    gmail.users().messages().send(userId="me", body={"raw": "", "threadId": "t2"}).execute()
+    reply_id = gmail.add_reply("t2", "Sure!")
+
+    # WHEN
+    replies, history_id = watcher.poll(start_history_id, ["t2"])
+
+    # THEN
+    assert replies == {"t2": [reply_id]}
+    assert history_id == str(gmail.history_id)
+    assert gmail.calls["history.list"] == 2
+
+
+def test_reply_watcher_should_back_off_between_polls_until_timeout():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    watcher = GmailReplyWatcher(gmail, initial_interval=1.0, max_interval=8.0, backoff_factor=2.0, sleep=clock.sleep, clock=clock.time)
+
+    # WHEN
+    reply_id = watcher.wait_for_reply("t1", watcher.current_history_id(), timeout=60)
+
+    # THEN
+    assert reply_id is None
+    assert clock.sleeps[:5] == [1.0, 2.0, 4.0, 8.0, 8.0]
+    assert sum(clock.sleeps) == 60
+    assert gmail.calls["history.list"] == len(clock.sleeps) + 1
+
+
+def test_messaging_tool_should_return_reply_detected_from_history():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    tool = _create_tool(gmail, clock)
+    gmail.schedule_reply("tm1", "Doing great, thanks!\n\nOn Mon, Agent wrote:\n> How are you?", after_history_polls=3)
+
+    # WHEN
+    status, response, thread_id = tool.use("pawel@example.com", "Ciao!", "How are you?", await_response=True, response_timeout=10)
+
+    # THEN
+    assert status == HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE
+    assert response == "Doing great, thanks!"
+    assert thread_id == "tm1"
+    assert gmail.calls["history.list"] == 4
+    assert gmail.calls["threads.get"] == 0
+    assert gmail.calls["messages.get"] == 1
+    assert "UNREAD" not in gmail.messages["m2"]["labelIds"]
+
+
+def test_messaging_tool_should_time_out_without_reply():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    tool = _create_tool(gmail, clock)
+
+    # WHEN
+    result = tool.use("pawel@example.com", "Ciao!", "How are you?", await_response=True, response_timeout=10)
+
+    # THEN
+    assert result == (HumanMessagingInterfaceReturnStatus.RETURNED_ON_TIMEOUT_REACHED, None, None)
+    assert clock.now == 10 * 60
+    assert gmail.calls["history.list"] < 40
+
+
+def test_messaging_tool_should_limit_round_trips_and_fields_per_conversation():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    tool = _create_tool(gmail, clock)
+    gmail.schedule_reply("tm1", "Doing great, thanks!", after_history_polls=2)
+
+    # WHEN
+    status, response, _ = tool.use("pawel@example.com", "Ciao!", "How are you?", await_response=True, response_timeout=10)
+
+    # THEN
+    assert status == HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE
+    assert response == "Doing great, thanks!"
+    # getProfile + send + history polls + a single batch for reading and marking the reply
+    assert gmail.round_trips == 1 + 1 + gmail.calls["history.list"] + 1
+    assert gmail.calls["batch"] == 1
+    assert gmail.calls["messages.modify"] == 1
+    assert all("fields" in kwargs for _, kwargs in gmail.requests)
+
+
+def test_messaging_tool_should_return_its_status_as_artifact_for_the_routing():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    tool = _create_tool(gmail, clock)
+    gmail.schedule_reply("tm1", "Doing great, thanks!", after_history_polls=1)
+    tool_call = {"name": "human_messaging_interface", "args": {"human_email": "pawel@example.com", "message_subject": "Ciao!", "message_body": "How are you?", "await_response": True}, "id": "call", "type": "tool_call"}
+    # A message whose text merely mentions the status
+    echoed = ToolMessage(name="human_messaging_interface", tool_call_id="echo", content="Told Pawel I would wait for RETURNED_WITH_RESPONSE: nothing yet")
+
+    # WHEN
+    message = tool.definition.invoke(tool_call)
+
+    # THEN
+    assert message.artifact == {"status": HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE.name}
+    assert ModelRoutingPolicy().route([message]) == LARGE_MODEL
+    assert ModelRoutingPolicy().route([echoed]) == SMALL_MODEL
@@ -0,0 +1,73 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from langchain_core.messages import AIMessage
+from tools.metrics import Metrics
+from tools.statestorage import StateStorage
+from fakes import FakeClock
+
+
+def test_metrics_should_aggregate_spans_and_counters_by_labels():
+    # GIVEN
+    clock = FakeClock()
+    metrics = Metrics(clock=clock.time)
+
+    # WHEN
+    for seconds in [0.5, 1.5]:
+        with metrics.span("node", node="assistant"):
+            clock.now += seconds
+    with pytest.raises(ValueError):
+        with metrics.span("tool", tool="write_contact_event"):
+            raise ValueError("Human not found")
+    metrics.record_llm_usage(AIMessage(content="", usage_metadata={"input_tokens": 100, "output_tokens": 20, "total_tokens": 120}))
+
+    # THEN
+    summary = metrics.summary()
+    assert summary["node"] == [{"labels": {"node": "assistant"}, "count": 2, "seconds": 2.0, "max_seconds": 1.5}]
+    assert summary["tool"][0]["count"] == 1
+    assert summary["llm_tokens"] == [{"labels": {"kind": "input"}, "value": 100}, {"labels": {"kind": "output"}, "value": 20}]
+    assert '"error": "ValueError"' in metrics.to_json_lines()
+
+    prometheus = metrics.to_prometheus()
+    assert '# TYPE smalltalk_node_seconds summary' in prometheus
+    assert 'smalltalk_node_seconds_count{node="assistant"} 2' in prometheus
+    assert 'smalltalk_node_seconds_sum{node="assistant"} 2.000000' in prometheus
+    assert 'smalltalk_llm_tokens_total{kind="output"} 20' in prometheus
+
+
+def test_storage_should_record_every_statement_by_kind(tmp_path):
+    # GIVEN
+    metrics = Metrics()
+    storage = StateStorage(str(tmp_path / "state.db"), metrics=metrics)
+
+    # WHEN
+    with storage.transaction() as cursor:
+        cursor.execute("CREATE TABLE Human (id INTEGER PRIMARY KEY, name TEXT)")
+        cursor.executemany("INSERT INTO Human (name) VALUES (?)", [("Pawel",), ("Giulia",)])
+    with storage.connection() as conn:
+        conn.execute("SELECT name FROM Human").fetchall()
+    storage.close()
+
+    # THEN
+    counts = {span["labels"]["statement"]: span["count"] for span in metrics.summary()["sqlite"]}
+    # The PRAGMAs configure the single pooled connection
+    assert counts == {"PRAGMA": 3, "BEGIN": 1, "CREATE": 1, "INSERT": 1, "COMMIT": 1, "SELECT": 1}
+
+
+def test_metrics_should_export_to_the_configured_directory(tmp_path, monkeypatch):
+    # GIVEN
+    metrics = Metrics()
+    metrics.count("scheduled_runs", household="rossi", result="ok")
+
+    # WHEN
+    without_directory = metrics.export_to_dir()
+    monkeypatch.setenv("SMALLTALK_METRICS_DIR", str(tmp_path / "metrics"))
+    exported = metrics.export_to_dir(name="smalltalk_scheduler")
+
+    # THEN
+    assert (without_directory, exported) == (False, True)
+    assert sorted(os.listdir(tmp_path / "metrics")) == ["smalltalk_scheduler.jsonl", "smalltalk_scheduler.prom"]
+    assert 'smalltalk_scheduled_runs_total{household="rossi",result="ok"} 1' in (tmp_path / "metrics" / "smalltalk_scheduler.prom").read_text()
@@ -0,0 +1,30 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from tools.replyparser import extract_reply, find_text_parts, strip_quoted
+from replycorpus import CORPUS, multipart, text_part
+
+
+@pytest.mark.parametrize("payload, expected", [(payload, expected) for _, payload, expected in CORPUS], ids=[name for name, _, _ in CORPUS])
+def test_extract_reply_should_keep_only_what_the_human_wrote(payload, expected):
+    assert extract_reply(payload) == expected
+
+
+def test_find_text_parts_should_prefer_the_first_plain_part_in_document_order():
+    # GIVEN
+    payload = multipart("multipart/mixed",
+                        multipart("multipart/alternative", text_part("text/html", "<p>first html</p>"), text_part("text/plain", "first plain")),
+                        text_part("text/plain", "second plain"))
+
+    # WHEN
+    plain, html = find_text_parts(payload)
+
+    # THEN
+    assert (plain["body"], html["body"]) == (payload["parts"][0]["parts"][1]["body"], payload["parts"][0]["parts"][0]["body"])
+
+
+def test_strip_quoted_should_keep_interleaved_answers():
+    assert strip_quoted("> Are you free on Sunday?\nYes!\n> And Pawel?\nHe is too.") == "Yes!\nHe is too."
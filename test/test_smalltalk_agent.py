@@ -8,6 +8,7 @@ import sqlite3
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.realpath(f"{dir_path}/.."))
 from smalltalk_agent import SmallTalkAgent
+from tools.statestorage import from_epoch, to_epoch
 
 
 smalltalk_agent = SmallTalkAgent()
@@ -54,12 +55,12 @@ def test_smalltalk_agent_should_choose_fairly_between_humans_and_store_new_conta
     giulia_id = row[0]
     
     time_ago_25_hours = datetime.now() - timedelta(hours=25)
-    time_ago_str = time_ago_25_hours.isoformat()
+    time_ago_epoch = to_epoch(time_ago_25_hours)
     
     cursor.execute("""
         INSERT INTO ContactEvent (human_id, datetime) 
         VALUES (?, ?)
-    """, (giulia_id, time_ago_str))
+    """, (giulia_id, time_ago_epoch))
     conn.commit()
     conn.close()
     
@@ -94,9 +95,9 @@ def test_smalltalk_agent_should_choose_fairly_between_humans_and_store_new_conta
     one_minute_ago = now - timedelta(minutes=1)
 
     last_minute_contacts = 0
-    for (dt_string,) in rows:
-        # Convert the stored datetime string to a Python datetime
-        contact_dt = datetime.fromisoformat(dt_string)
+    for (dt_epoch,) in rows:
+        # Convert the stored epoch seconds to a Python datetime
+        contact_dt = from_epoch(dt_epoch)
         if contact_dt >= one_minute_ago:
             last_minute_contacts += 1
 
@@ -123,12 +124,12 @@ def test_smalltalk_agent_should_skip_contact_if_someone_was_contacted_today():
     giulia_id = row[0]
     
     time_ago_1_hour = datetime.now() - timedelta(hours=1)
-    time_ago_str = time_ago_1_hour.isoformat()
+    time_ago_epoch = to_epoch(time_ago_1_hour)
     
     cursor.execute("""
         INSERT INTO ContactEvent (human_id, datetime) 
         VALUES (?, ?)
-    """, (giulia_id, time_ago_str))
+    """, (giulia_id, time_ago_epoch))
     conn.commit()
     conn.close()
     
@@ -150,4 +151,5 @@ def test_smalltalk_agent_should_skip_contact_if_someone_was_contacted_today():
         if tup and tup[0] in restricted:
             incorrect_tool_calls += 1
 
-    assert incorrect_tool_calls == 0
\ No newline at end of file
+    assert incorrect_tool_calls == 0
+    assert result["gate_decision"]["contact_allowed"] == False
\ No newline at end of file
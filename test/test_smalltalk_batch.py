@@ -0,0 +1,123 @@
+import pytest
+import os
+import sys
+import threading
+import time
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from benchmark.scriptedmodel import ScriptedChatModel, SmallTalkScript
+from config.createdb import create_database
+from smalltalk_agent import SmallTalkAgent
+from smalltalk_batch import BatchRunner
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.metrics import Metrics
+from tools.ratelimits import create_rate_limiters
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage
+from fakegmail import FakeGmailService
+from stubrouter import StubRouter
+
+
+def _households(tmp_path, count: int) -> dict[str, str]:
+    households = {}
+    for i in range(count):
+        state_db = str(tmp_path / f"household{i}.db")
+        create_database(state_db)
+        storage = StateStorage(state_db)
+        with storage.transaction() as cursor:
+            cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (f"pawel{i}@example.com", "B2:66:C2:5D:17:71", f"Pawel{i}"))
+        storage.close()
+        households[f"household{i}"] = state_db
+    return households
+
+
+def _create_offline_agent(household, storage, rate_limiters, host_cache, metrics):
+    return SmallTalkAgent(
+        model=ScriptedChatModel(script=SmallTalkScript(response_timeout=0)),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService(), metrics=metrics, rate_limiter=rate_limiters["gmail"]),
+        host_cache=host_cache,
+        metrics=metrics,
+        rate_limiters=rate_limiters)
+
+
+def test_batch_runner_should_run_every_household_under_shared_rate_limits(tmp_path):
+    # GIVEN
+    households = _households(tmp_path, 6)
+    metrics = Metrics()
+    rate_limiters = create_rate_limiters({"llm": 100, "gmail": 100, "router": 100})
+    router = StubRouter({"B2:66:C2:5D:17:71": True})
+    clients = []
+
+    def create_client():
+        clients.append(router.create_client())
+        return clients[-1]
+    host_cache = RouterHostCache(client_factory=create_client, metrics=metrics, rate_limiter=rate_limiters["router"])
+    runner = BatchRunner(_create_offline_agent, max_concurrency=3, rate_limiters=rate_limiters, host_cache=host_cache, metrics=metrics)
+
+    # WHEN
+    report = runner.run(households)
+
+    # THEN
+    assert [outcome.status for outcome in report.outcomes] == ["ok"] * 6
+    assert [outcome.contacted for outcome in report.outcomes] == [[f"Pawel{i}"] for i in range(6)]
+    assert report.to_dict()["households_per_minute"] > 0
+    waits = {span["labels"]["api"]: span["count"] for span in metrics.summary()["rate_limit"]}
+    assert waits["gmail"] >= 6 * 2
+    # One router session for the whole batch, left open for the owner of the host cache
+    assert (router.logins, router.get_hosts_calls, waits["router"]) == (1, 1, 2)
+    assert [client.closed for client in clients] == [False]
+    # The chat model waits for its limiter itself
+    assert rate_limiters["llm"].last is not None
+    host_cache.close()
+
+
+def test_batch_runner_should_cap_concurrency_and_report_failures(tmp_path):
+    # GIVEN
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    class _SlowAgent:
+        def __init__(self, household):
+            self._household = household
+
+        def run(self, run_id, messages):
+            with lock:
+                running.append(run_id)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(run_id)
+            if self._household == "household3":
+                raise RuntimeError("quota exceeded")
+            return {"messages": messages}
+
+    runner = BatchRunner(lambda household, storage, rate_limiters, host_cache, metrics: _SlowAgent(household), max_concurrency=2, metrics=Metrics())
+
+    # WHEN
+    report = runner.run({f"household{i}": str(tmp_path / f"household{i}.db") for i in range(6)})
+
+    # THEN
+    assert max(peak) == 2
+    assert [outcome.status for outcome in report.outcomes] == ["ok", "ok", "ok", "error", "ok", "ok"]
+    assert report.outcomes[3].error == "RuntimeError: quota exceeded"
+    assert report.to_dict()["failed"] == 1
+
+
+def test_rate_limiter_should_be_shared_by_concurrent_callers():
+    # GIVEN
+    limiter = create_rate_limiters({"gmail": 20})["gmail"]
+    start = time.monotonic()
+
+    # WHEN
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range(3)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # THEN
+    # 12 requests at 20 per second, without a burst
+    assert time.monotonic() - start >= 0.5
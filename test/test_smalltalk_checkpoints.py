@@ -0,0 +1,120 @@
+import pytest
+import os
+import sqlite3
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from langchain_core.messages import HumanMessage
+from benchmark.scriptedmodel import ScriptedChatModel
+from config.createdb import create_database
+from smalltalk_agent import SmallTalkAgent
+from smalltalk_checkpoints import SqliteCheckpointSaver
+from tools.gmailreplywatcher import GmailReplyWatcher
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage
+from fakegmail import FakeGmailService
+from fakes import CountingScript, FakeClock
+from stubrouter import StubRouter
+
+
+@pytest.fixture
+def household(tmp_path):
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+    gmail = FakeGmailService()
+    gmail.schedule_reply("tm1", "Doing great, thanks!", after_history_polls=0)
+    yield storage, gmail, str(tmp_path / "checkpoints.db")
+    storage.close()
+
+
+def _create_agent(household, script, defer_responses=False) -> SmallTalkAgent:
+    storage, gmail, checkpoint_db = household
+    clock = FakeClock()
+    messaging_tool = HumanMessagingInterfaceTool(service=gmail, defer_responses=defer_responses)
+    messaging_tool._reply_watcher = GmailReplyWatcher(gmail, sleep=clock.sleep, clock=clock.time)
+    return SmallTalkAgent(
+        defer_responses=defer_responses,
+        checkpoint_db=checkpoint_db,
+        model=ScriptedChatModel(script=script),
+        storage=storage,
+        messaging_tool=messaging_tool,
+        host_cache=RouterHostCache(client_factory=StubRouter({"B2:66:C2:5D:17:71": True}).create_client))
+
+
+def _contact_events(storage: StateStorage) -> int:
+    with storage.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM ContactEvent").fetchone()[0]
+
+
+def test_agent_should_continue_crashed_run_from_last_completed_node(household):
+    # GIVEN
+    storage, gmail, _ = household
+    messages = [HumanMessage(content="Have a chat with a human.")]
+    crashed_script = CountingScript(crash_on_turn=3)
+    with pytest.raises(ConnectionError):
+        _create_agent(household, crashed_script).run("2025-03-21", messages)
+
+    # WHEN
+    restarted_script = CountingScript()
+    result = _create_agent(household, restarted_script).run("2025-03-21", messages)
+
+    # THEN
+    # Ranking and messaging were not replayed: recording and scheduling, then the final answer remained
+    assert restarted_script.turns == 2
+    assert len(gmail.sent) == 1
+    assert _contact_events(storage) == 1
+    assert result["messages"][-1].content == "I had a chat with Pawel today."
+
+
+def test_agent_should_not_run_finished_run_again(household):
+    # GIVEN
+    storage, gmail, _ = household
+    messages = [HumanMessage(content="Have a chat with a human.")]
+    _create_agent(household, CountingScript()).run("2025-03-21", messages)
+
+    # WHEN
+    script = CountingScript()
+    _create_agent(household, script).run("2025-03-21", messages)
+
+    # THEN
+    assert script.turns == 0
+    assert len(gmail.sent) == 1
+
+
+def test_agent_should_resume_suspended_run_after_restart(household):
+    # GIVEN
+    storage, gmail, _ = household
+    _create_agent(household, CountingScript(), defer_responses=True).run("2025-03-21", [HumanMessage(content="Have a chat with a human.")])
+
+    # WHEN
+    agent = _create_agent(household, CountingScript(), defer_responses=True)
+    [pending_reply] = agent.pending_replies("2025-03-21")
+    result = agent.resume("2025-03-21", {"status": "RETURNED_WITH_RESPONSE", "response": "Doing great, thanks!", "thread_id": pending_reply["thread_id"]})
+
+    # THEN
+    assert len(gmail.sent) == 1
+    assert _contact_events(storage) == 1
+    assert result["messages"][-1].content == "I had a chat with Pawel today."
+
+
+def test_checkpoint_saver_should_keep_latest_checkpoints_and_drop_stale_runs(household):
+    # GIVEN
+    _, _, checkpoint_db = household
+    _create_agent(household, CountingScript()).run("2025-03-21", [HumanMessage(content="Have a chat with a human.")])
+
+    # WHEN
+    conn = sqlite3.connect(checkpoint_db)
+    kept = conn.execute("SELECT COUNT(*) FROM Checkpoint WHERE thread_id = '2025-03-21'").fetchone()[0]
+    orphan_writes = conn.execute("SELECT COUNT(*) FROM CheckpointWrite WHERE checkpoint_id NOT IN (SELECT checkpoint_id FROM Checkpoint)").fetchone()[0]
+    conn.close()
+    saver = SqliteCheckpointSaver(checkpoint_db, max_age_days=0)
+
+    # THEN
+    assert kept == 3
+    assert orphan_writes == 0
+    assert saver.thread_ids() == []
+    saver.close()
@@ -0,0 +1,46 @@
+import pytest
+import os
+import sys
+from langchain_core.messages import HumanMessage, ToolMessage, AIMessage
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from smalltalk_compaction import COMPACTED_PREFIX, compact_tool_messages, estimate_tokens
+
+
+def _tool_step(index: int, content: str) -> list:
+    tool_call = {"name": "read_humans_and_contacts_events", "args": {}, "id": f"call{index}"}
+    return [
+        AIMessage(content="", tool_calls=[tool_call], id=f"ai{index}"),
+        ToolMessage(content=content, name=tool_call["name"], tool_call_id=tool_call["id"], id=f"tool{index}"),
+    ]
+
+
+def test_compaction_should_keep_conversation_untouched_within_budget():
+    # GIVEN
+    messages = [HumanMessage(content="Good morning", id="h")] + _tool_step(1, "x" * 400)
+
+    # WHEN
+    replacements = compact_tool_messages(messages, token_budget=1000)
+
+    # THEN
+    assert replacements == []
+
+
+def test_compaction_should_summarize_oldest_tool_results_and_keep_latest_verbatim():
+    # GIVEN
+    messages = [HumanMessage(content="Good morning", id="h")]
+    for index in range(4):
+        messages += _tool_step(index, f"result {index} " + "x" * 4000)
+
+    # WHEN
+    replacements = compact_tool_messages(messages, token_budget=2500)
+
+    # THEN
+    assert [message.id for message in replacements] == ["tool0", "tool1"]
+    assert all(message.content.startswith(COMPACTED_PREFIX) for message in replacements)
+    assert replacements[0].tool_call_id == "call0"
+    compacted = {message.id: message for message in replacements}
+    remaining = [compacted.get(message.id, message) for message in messages]
+    assert estimate_tokens(remaining) <= 2500
+    assert remaining[-1].content == messages[-1].content
@@ -0,0 +1,94 @@
+import pytest
+import itertools
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import StructuredTool
+from benchmark.scriptedmodel import ScriptedChatModel
+from config.createdb import create_database
+from smalltalk_agent import SmallTalkAgent
+from smalltalk_llmcache import SqliteLLMCache
+from tools.metrics import Metrics
+from tools.statestorage import StateStorage
+from fakes import CountingScript, FakeClock
+
+
+def _rank_humans_script():
+    # A new call id on every turn
+    call_ids = itertools.count(1)
+    return lambda messages: AIMessage(content="", tool_calls=[{"name": "rank_humans_for_contact", "args": {}, "id": f"call_{next(call_ids)}", "type": "tool_call"}])
+
+
+def _tool(name: str) -> StructuredTool:
+    def use() -> str:
+        return ""
+    return StructuredTool.from_function(use, name=name, description=name)
+
+
+def test_cached_model_should_answer_repeated_turn_without_calling_provider(tmp_path):
+    # GIVEN
+    script = CountingScript(_rank_humans_script())
+    cache = SqliteLLMCache(str(tmp_path / "llm_cache.db"))
+    model = ScriptedChatModel(script=script, cache=cache).bind_tools([_tool("rank_humans_for_contact")])
+
+    # WHEN
+    first = model.invoke([HumanMessage(content="Have a chat with a human.", id="a")])
+    second = model.invoke([HumanMessage(content="Have a chat with a human.", id="b")])
+    other_tools = ScriptedChatModel(script=script, cache=cache).bind_tools([_tool("write_contact_event")]).invoke([HumanMessage(content="Have a chat with a human.")])
+
+    # THEN
+    assert script.turns == 2
+    assert second.tool_calls == first.tool_calls
+    assert second.id != first.id
+    assert other_tools.tool_calls[0]["id"] == "call_2"
+
+
+def test_cache_should_expire_entries_and_evict_least_recently_used(tmp_path):
+    # GIVEN
+    clock = FakeClock(1000.0)
+    cache = SqliteLLMCache(str(tmp_path / "llm_cache.db"), max_entries=2, ttl=60, clock=clock.time)
+    model = ScriptedChatModel(script=CountingScript(_rank_humans_script()))
+    generations = model._generate([HumanMessage(content="x")]).generations
+
+    for prompt in ["a", "b"]:
+        cache.update(prompt, "model", generations)
+        clock.now += 1
+    cache.lookup("a", "model")
+    clock.now += 1
+
+    # WHEN
+    cache.update("c", "model", generations)
+
+    # THEN
+    assert cache.lookup("b", "model") is None
+    assert cache.lookup("a", "model") is not None
+    clock.now += 60
+    assert cache.lookup("c", "model") is None
+
+
+def test_agent_should_not_count_tokens_of_cached_turns(tmp_path):
+    # GIVEN
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    cache = SqliteLLMCache(str(tmp_path / "llm_cache.db"))
+    metrics = Metrics()
+    agent = SmallTalkAgent(pre_gate=False, model=ScriptedChatModel(script=lambda messages: AIMessage(content="Nobody to contact today.")), storage=storage, llm_cache=cache, metrics=metrics)
+    turns = []
+
+    # WHEN
+    for _ in range(2):
+        metrics.reset()
+        agent.compiled_graph.invoke({"messages": [HumanMessage(content="Have a chat with a human.")]})
+        turns.append({name: aggregates for name, aggregates in metrics.summary().items() if name.startswith("llm_")})
+
+    # THEN
+    assert turns[0]["llm_turns"] == [{"labels": {"model": "large"}, "value": 1}]
+    assert {counter["labels"]["kind"] for counter in turns[0]["llm_tokens"]} == {"input", "output"}
+    # The replayed turn spent no tokens
+    assert "llm_turns" not in turns[1] and "llm_tokens" not in turns[1]
+    assert turns[1]["llm_cache_hits"] == [{"labels": {"model": "large"}, "value": 1}]
+    storage.close()
+    cache.close()
@@ -0,0 +1,145 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from smalltalk_replies import ReplyDispatcher
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool, HumanMessagingInterfaceReturnStatus
+from tools.metrics import Metrics
+from fakegmail import FakeGmailService
+from fakes import FakeClock
+
+
+class _StubAgent:
+    def __init__(self, messaging_tool):
+        self.messaging_tool = messaging_tool
+        self.pending = {}
+        self.resumed = {}
+
+    def run(self, run_id, messages):
+        # Each run messages its own human and suspends awaiting the response
+        _, pending_reply = self.messaging_tool.use_deferred(f"{run_id}@example.com", "Ciao!", "How are you?", await_response=True, response_timeout=1)
+        self.pending[run_id] = pending_reply
+        return {"messages": messages}
+
+    def pending_replies(self, run_id):
+        return [self.pending[run_id]] if run_id in self.pending else []
+
+    def resume(self, run_id, reply):
+        self.pending.pop(run_id)
+        self.resumed[run_id] = reply
+
+
+def test_reply_dispatcher_should_resume_each_run_on_its_reply_or_timeout():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    messaging_tool = HumanMessagingInterfaceTool(service=gmail, defer_responses=True)
+    agent = _StubAgent(messaging_tool)
+    dispatcher = ReplyDispatcher(agent, clock=clock.time)
+
+    for run_id in ["pawel", "giulia", "marco"]:
+        dispatcher.start(run_id, [])
+    pawel_thread = agent.pending["pawel"]["thread_id"]
+    giulia_thread = agent.pending["giulia"]["thread_id"]
+
+    # WHEN
+    nothing_resumed = dispatcher.poll_once()
+    gmail.add_reply(pawel_thread, "All good!")
+    first_resumed = dispatcher.poll_once()
+    clock.now = agent.pending["marco"]["deadline"]
+    gmail.add_reply(giulia_thread, "Busy day!")
+    second_resumed = dispatcher.poll_once()
+
+    # THEN
+    assert nothing_resumed == []
+    assert first_resumed == ["pawel"]
+    assert sorted(second_resumed) == ["giulia", "marco"]
+    assert dispatcher.pending_runs == []
+    assert agent.resumed["pawel"] == {"status": HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE.name, "response": "All good!", "thread_id": pawel_thread}
+    assert agent.resumed["giulia"]["response"] == "Busy day!"
+    assert agent.resumed["marco"]["status"] == HumanMessagingInterfaceReturnStatus.RETURNED_ON_TIMEOUT_REACHED.name
+    assert gmail.calls["history.list"] == 3
+
+
+def test_reply_dispatcher_should_resume_every_run_awaiting_the_same_thread():
+    # GIVEN
+    gmail = FakeGmailService()
+    clock = FakeClock()
+    messaging_tool = HumanMessagingInterfaceTool(service=gmail, defer_responses=True)
+    agent = _StubAgent(messaging_tool)
+    dispatcher = ReplyDispatcher(agent, clock=clock.time)
+    dispatcher.start("pawel", [])
+    thread_id = agent.pending["pawel"]["thread_id"]
+    gmail.add_reply(thread_id, "All good!")
+    # A second run follows up on the same thread, after the reply was written
+    _, agent.pending["follow_up"] = messaging_tool.use_deferred("pawel@example.com", "Re: Ciao!", "And Giulia?", await_response=True, response_timeout=1, messaging_thread_handle=thread_id)
+    dispatcher.recover(["follow_up"])
+
+    # WHEN
+    resumed = dispatcher.poll_once()
+
+    # THEN
+    assert sorted(resumed) == ["follow_up", "pawel"]
+    assert agent.resumed["pawel"]["response"] == "All good!"
+    assert agent.resumed["follow_up"]["thread_id"] == thread_id
+
+
+class _HttpError(Exception):
+    # The status of a googleapiclient HttpError is in resp.status
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+
+class _FlakyGmailService(FakeGmailService):
+    def __init__(self):
+        super().__init__()
+        self.history_errors = []
+
+    def _history_list(self, userId, startHistoryId, **kwargs):
+        if self.history_errors:
+            raise _HttpError(self.history_errors.pop(0))
+        return super()._history_list(userId, startHistoryId, **kwargs)
+
+
+def test_reply_dispatcher_should_keep_dispatching_through_errors():
+    # GIVEN
+    gmail = _FlakyGmailService()
+    messaging_tool = HumanMessagingInterfaceTool(service=gmail, defer_responses=True)
+    agent = _StubAgent(messaging_tool)
+    metrics = Metrics()
+    dispatcher = ReplyDispatcher(agent, clock=FakeClock().time, metrics=metrics)
+    for run_id in ["pawel", "giulia"]:
+        dispatcher.start(run_id, [])
+    resume = agent.resume
+    failing_resumes = ["giulia"]
+
+    def flaky_resume(run_id, reply):
+        if run_id in failing_resumes:
+            failing_resumes.remove(run_id)
+            raise RuntimeError("checkpoint unavailable")
+        resume(run_id, reply)
+    agent.resume = flaky_resume
+
+    # WHEN
+    gmail.add_reply(agent.pending["pawel"]["thread_id"], "All good!")
+    gmail.add_reply(agent.pending["giulia"]["thread_id"], "Busy day!")
+    gmail.history_errors = [503]
+    during_outage = dispatcher.poll_once()
+    # The start history id expired meanwhile, the threads are re-scanned
+    gmail.history_errors = [404]
+    after_outage = dispatcher.poll_once()
+    retried = dispatcher.poll_once()
+
+    # THEN
+    assert during_outage == []
+    assert after_outage == ["pawel"]
+    assert retried == ["giulia"]
+    assert agent.resumed["pawel"]["response"] == "All good!" and agent.resumed["giulia"]["response"] == "Busy day!"
+    assert dispatcher.pending_runs == []
+    summary = metrics.summary()
+    assert [counter["labels"] for counter in summary["reply_polls"]] == [{"error": "_HttpError", "result": "error"}, {"result": "rescan"}]
+    assert {"labels": {"error": "RuntimeError", "result": "error"}, "value": 1} in summary["reply_resumes"]
+    assert gmail.calls["threads.get"] == 2
@@ -0,0 +1,137 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from smalltalk_scheduler import ContactScheduler
+from tools.metrics import Metrics
+from tools.nextcontactschedule import NextContactScheduleTool
+from tools.statestorage import StateStorage
+from fakes import FakeClock
+
+NOW = datetime(2025, 3, 20, 9, 0, tzinfo=timezone.utc).timestamp()
+DAY = 24 * 3600
+
+
+class _StubAgent:
+    # Each run sets the next contact the way the model would, unless next_contact is None
+    def __init__(self, storage, clock, next_contact=None, fail=False):
+        self.runs = []
+        self._schedule_tool = NextContactScheduleTool(storage=storage, clock=clock.time)
+        self._clock = clock
+        self.next_contact = next_contact
+        self.fail = fail
+
+    def run(self, run_id, messages):
+        self.runs.append(run_id)
+        if self.fail:
+            raise RuntimeError("provider unavailable")
+        if self.next_contact is not None:
+            next_contact = datetime.fromtimestamp(self._clock.now + self.next_contact, timezone.utc)
+            assert self._schedule_tool.use(next_contact.strftime("%Y-%m-%d %H:%M:%S"))
+        return {"messages": messages}
+
+
+@pytest.fixture
+def storages(tmp_path):
+    storages = {}
+    for name in ["rossi", "kowalski"]:
+        db_file = str(tmp_path / f"{name}.db")
+        create_database(db_file)
+        storages[name] = StateStorage(db_file)
+    yield storages
+    for storage in storages.values():
+        storage.close()
+
+
+def _scheduled(storage):
+    with storage.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT datetime FROM ContactSchedule")]
+
+
+def test_scheduler_should_run_households_only_when_due(storages):
+    # GIVEN
+    clock = FakeClock(NOW)
+    with storages["kowalski"].transaction() as cursor:
+        cursor.execute("INSERT INTO ContactSchedule (datetime) VALUES (?)", (NOW + 3600,))
+    rossi = _StubAgent(storages["rossi"], clock, next_contact=DAY)
+    kowalski = _StubAgent(storages["kowalski"], clock)
+    scheduler = ContactScheduler(clock=clock.time, metrics=Metrics())
+    scheduler.add_household("rossi", rossi, storages["rossi"])
+    scheduler.add_household("kowalski", kowalski, storages["kowalski"])
+
+    # WHEN
+    first_ran = scheduler.run_due()
+    nothing_ran = scheduler.run_due()
+    clock.now = NOW + 3600
+    second_ran = scheduler.run_due()
+
+    # THEN
+    assert (first_ran, nothing_ran, second_ran) == (["rossi"], [], ["kowalski"])
+    assert rossi.runs == ["rossi@0"]
+    assert kowalski.runs == [f"kowalski@{int(NOW) + 3600}"]
+    # The next contact set by the run is kept, a run without one gets the fallback
+    assert _scheduled(storages["rossi"]) == [NOW + DAY]
+    assert _scheduled(storages["kowalski"]) == [NOW + 3600 + DAY]
+    assert scheduler.next_due == (NOW + DAY, "rossi")
+
+
+def test_scheduler_should_recover_its_queue_after_restart_and_coalesce_entries(storages):
+    # GIVEN
+    clock = FakeClock(NOW)
+    agent = _StubAgent(storages["rossi"], clock, next_contact=2 * 3600)
+    scheduler = ContactScheduler(clock=clock.time, metrics=Metrics())
+    scheduler.add_household("rossi", agent, storages["rossi"])
+    scheduler.run_due()
+
+    # WHEN
+    restarted = ContactScheduler(clock=clock.time, metrics=Metrics())
+    restarted.add_household("rossi", agent, storages["rossi"])
+    restarted.add_household("rossi", agent, storages["rossi"])
+    clock.now = NOW + 2 * 3600
+    ran = restarted.run_due()
+
+    # THEN
+    assert ran == ["rossi"]
+    assert agent.runs == ["rossi@0", f"rossi@{int(NOW) + 2 * 3600}"]
+    assert restarted.next_due == (NOW + 4 * 3600, "rossi")
+
+
+def test_scheduler_should_retry_failed_runs_later(storages):
+    # GIVEN
+    clock = FakeClock(NOW)
+    agent = _StubAgent(storages["rossi"], clock, fail=True)
+    scheduler = ContactScheduler(retry_interval=600, clock=clock.time, metrics=Metrics())
+    scheduler.add_household("rossi", agent, storages["rossi"])
+
+    # WHEN
+    ran = scheduler.run_due()
+    next_due = scheduler.next_due
+    clock.now += 600
+    scheduler.run_due()
+    clock.now += 600
+    agent.fail = False
+    retried = scheduler.run_due()
+
+    # THEN
+    assert ran == []
+    assert next_due == (NOW + 600, "rossi")
+    assert retried == ["rossi"]
+    # Every retry continues the checkpointed run of the failed one
+    assert agent.runs == ["rossi@0"] * 3
+
+
+def test_schedule_tool_should_reject_malformed_and_past_datetimes(storages):
+    # GIVEN
+    clock = FakeClock(NOW)
+    tool = NextContactScheduleTool(storage=storages["rossi"], clock=clock.time)
+
+    # WHEN
+    results = [tool.use("tomorrow at 9"), tool.use("2025-03-19 09:00:00"), tool.use("2025-03-21 09:00:00"), tool.use("2025-03-22 09:00:00")]
+
+    # THEN
+    assert results == [False, False, True, True]
+    assert _scheduled(storages["rossi"]) == [NOW + 2 * DAY]
@@ -0,0 +1,164 @@
+import pytest
+import http.client
+import json
+import os
+import socket
+import sys
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from benchmark.scriptedmodel import ScriptedChatModel, SmallTalkScript
+from config.createdb import create_database
+from smalltalk_agent import SmallTalkAgent
+from smalltalk_service import SmallTalkService
+from tools.humanmessaginginterface import HumanMessagingInterfaceTool
+from tools.metrics import Metrics
+from tools.routerhostcache import RouterHostCache
+from tools.statestorage import StateStorage
+from fakegmail import FakeGmailService
+from stubrouter import StubRouter
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+@pytest.fixture
+def agent_and_router(tmp_path):
+    create_database(str(tmp_path / "state.db"))
+    storage = StateStorage(str(tmp_path / "state.db"))
+    with storage.transaction() as cursor:
+        cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", ("pawel@example.com", "B2:66:C2:5D:17:71", "Pawel"))
+    router = StubRouter({"B2:66:C2:5D:17:71": True})
+    metrics = Metrics()
+    agent = SmallTalkAgent(
+        model=ScriptedChatModel(script=SmallTalkScript(response_timeout=0)),
+        storage=storage,
+        messaging_tool=HumanMessagingInterfaceTool(service=FakeGmailService(), metrics=metrics),
+        host_cache=RouterHostCache(client_factory=router.create_client, ttl=3600, metrics=metrics),
+        metrics=metrics)
+    yield agent, router, metrics
+    storage.close()
+
+
+def test_service_should_warm_up_once_and_run_on_http_triggers(agent_and_router):
+    # GIVEN
+    agent, router, _ = agent_and_router
+    service = SmallTalkService(agent, metrics=Metrics())
+    address = service.start("127.0.0.1:0")
+    logins_after_warm_up = router.logins
+
+    # WHEN
+    try:
+        request = urllib.request.Request(f"http://{address}/runs", data=json.dumps({"run_id": "morning"}).encode("utf-8"), method="POST")
+        with urllib.request.urlopen(request) as response:
+            first_run = json.loads(response.read())
+        request = urllib.request.Request(f"http://{address}/runs", data=b"{}", method="POST")
+        with urllib.request.urlopen(request) as response:
+            second_run = json.loads(response.read())
+        with urllib.request.urlopen(f"http://{address}/health") as response:
+            health = json.loads(response.read())
+        with urllib.request.urlopen(f"http://{address}/metrics") as response:
+            prometheus = response.read().decode("utf-8")
+    finally:
+        service.stop()
+
+    # THEN
+    assert logins_after_warm_up == 1
+    assert "smalltalk_service_run_seconds_count 2" in prometheus
+    assert (first_run["run_id"], first_run["contacted"]) == ("morning", ["Pawel"])
+    # Contacted today already, the second run is ended by the gate
+    assert second_run["contacted"] == []
+    assert health["runs"] == 2
+    # The router session and host table of the warm up served both runs
+    assert (router.logins, router.get_hosts_calls) == (1, 1)
+
+
+def test_service_should_serve_on_a_unix_socket(agent_and_router, tmp_path):
+    # GIVEN
+    agent, _, _ = agent_and_router
+    service = SmallTalkService(agent, metrics=Metrics())
+    path = service.start(str(tmp_path / "smalltalk.sock"))
+
+    # WHEN
+    try:
+        connection = _UnixHTTPConnection(path)
+        connection.request("POST", "/runs", body=json.dumps({"instructions": "Have a chat with a human."}))
+        response = connection.getresponse()
+        run = json.loads(response.read())
+        connection.request("GET", "/unknown")
+        missing = connection.getresponse()
+        missing.read()
+    finally:
+        service.stop()
+
+    # THEN
+    assert response.status == 200 and run["contacted"] == ["Pawel"]
+    assert missing.status == 404
+    assert not os.path.exists(path)
+
+
+def test_service_should_start_while_the_router_is_unreachable(agent_and_router):
+    # GIVEN
+    agent, router, metrics = agent_and_router
+    router.fail_logins = True
+    service = SmallTalkService(agent, metrics=Metrics())
+
+    # WHEN
+    address = service.start("127.0.0.1:0")
+    try:
+        with urllib.request.urlopen(f"http://{address}/health") as response:
+            health = json.loads(response.read())
+        # Back online by the first run, which checks the availability itself
+        router.fail_logins = False
+        run = service.trigger()
+    finally:
+        service.stop()
+
+    # THEN
+    assert health["status"] == "ok"
+    assert metrics.summary()["warm_up_errors"] == [{"labels": {"component": "router", "error": "ConnectionError"}, "value": 1}]
+    assert run["contacted"] == ["Pawel"]
+
+
+class _FakeCredentials:
+    def __init__(self, expires_in: timedelta):
+        self.refresh_token = "refresh"
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + expires_in
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        return self.expiry > datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+
+    def to_json(self):
+        return json.dumps({"refresh_token": self.refresh_token})
+
+
+def test_messaging_tool_should_refresh_credentials_only_close_to_expiry(tmp_path, monkeypatch):
+    # GIVEN
+    monkeypatch.chdir(tmp_path)
+    tool = HumanMessagingInterfaceTool(service=FakeGmailService())
+    tool._credentials = _FakeCredentials(timedelta(minutes=30))
+
+    # WHEN
+    far_from_expiry = tool.refresh_credentials(margin=600)
+    tool._credentials.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=5)
+    close_to_expiry = tool.refresh_credentials(margin=600)
+
+    # THEN
+    assert (far_from_expiry, close_to_expiry) == (False, True)
+    assert tool._credentials.refreshes == 1
+    assert os.path.exists(tmp_path / "token.json")
@@ -0,0 +1,15 @@
+import pytest
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from benchmark.startup import measure_startup
+
+
+def test_agent_startup_should_not_load_llm_gmail_or_router_clients():
+    # WHEN
+    startup = measure_startup(runs=1)
+
+    # THEN
+    assert startup["loaded_heavy_modules"] == []
@@ -0,0 +1,129 @@
+import pytest
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from tools.fairnessranking import FairnessScorer
+from tools.humancontacthistory import ContactEventRecorderTool, HumansAndContactsEventsReaderTool
+from tools.statemigrations import SCHEMA_VERSION, migrate, schema_version
+from tools.statestorage import StateStorage, from_epoch, to_epoch
+
+
+def _create_legacy_database(db_file: str, humans: list[str], contacts: list[tuple[int, str]]):
+    # The schema created before the migrations: ISO datetimes as text, no indexes, no version
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE Human (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT, phone TEXT, name TEXT)")
+    conn.execute("CREATE TABLE ContactEvent (id INTEGER PRIMARY KEY AUTOINCREMENT, human_id INTEGER, datetime TEXT, FOREIGN KEY (human_id) REFERENCES Human(id))")
+    conn.executemany("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, ?)", [(name,) for name in humans])
+    conn.executemany("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)", contacts)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def large_storage(tmp_path):
+    # 2000 humans with up to 60 contacts each over the last year
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    storage = StateStorage(db_file)
+    rng = random.Random(0)
+    now = to_epoch(datetime.now())
+    with storage.transaction() as cursor:
+        cursor.executemany("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, ?)", [(f"Human{i}",) for i in range(2000)])
+        cursor.executemany("INSERT INTO ContactEvent (human_id, datetime) VALUES (?, ?)",
+                           [(human_id, now - rng.randrange(365 * 86400)) for human_id in range(1, 2001) for _ in range(rng.randrange(60))])
+    yield storage
+    storage.close()
+
+
+def _query_plans(storage: StateStorage, action) -> dict[str, list[str]]:
+    # Runs the action tracing its statements, then explains every SELECT it ran. A single
+    # thread gets the same pooled connection back every time
+    statements = []
+    with storage.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    action()
+    with storage.connection() as conn:
+        conn.set_trace_callback(None)
+        return {
+            statement: [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()]
+            for statement in statements if statement.lstrip().upper().startswith("SELECT")
+        }
+
+
+def test_migrate_should_upgrade_legacy_database_in_place(tmp_path):
+    # GIVEN
+    db_file = str(tmp_path / "state.db")
+    contacted = datetime(2025, 3, 19, 18, 30, 15, 123456)
+    _create_legacy_database(db_file, ["Pawel", "Giulia"], [(2, contacted.isoformat()), (1, (contacted - timedelta(days=3)).isoformat())])
+
+    # WHEN
+    applied = create_database(db_file)
+    reapplied = create_database(db_file)
+
+    # THEN
+    assert applied == [1, 2, 3, 4]
+    assert reapplied == []
+    storage = StateStorage(db_file)
+    assert schema_version(storage) == SCHEMA_VERSION
+    with storage.connection() as conn:
+        rows = conn.execute("SELECT id, human_id, datetime, typeof(datetime) FROM ContactEvent ORDER BY id").fetchall()
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert [(id_, human_id, from_epoch(epoch), kind) for (id_, human_id, epoch, kind) in rows] == [
+        (1, 2, contacted.replace(microsecond=0), "integer"),
+        (2, 1, (contacted - timedelta(days=3)).replace(microsecond=0), "integer"),
+    ]
+    assert {"HumanName", "ContactEventHumanDatetime", "ContactEventDatetime"} <= indexes
+
+    # New events keep counting from the migrated ids
+    assert ContactEventRecorderTool(storage=storage).use("Pawel") == 3
+    storage.close()
+
+
+def test_migrate_should_refuse_duplicated_human_names_and_resume_once_fixed(tmp_path):
+    # GIVEN
+    db_file = str(tmp_path / "state.db")
+    _create_legacy_database(db_file, ["Pawel", "Pawel", "Giulia"], [])
+    storage = StateStorage(db_file)
+
+    # WHEN
+    with pytest.raises(ValueError, match="Pawel"):
+        migrate(storage)
+    version_after_failure = schema_version(storage)
+    with storage.transaction() as cursor:
+        cursor.execute("UPDATE Human SET name = 'Pawel S' WHERE id = 2")
+    applied = migrate(storage)
+
+    # THEN
+    assert version_after_failure == 2
+    assert applied == [3, 4]
+    with pytest.raises(sqlite3.IntegrityError):
+        with storage.transaction() as cursor:
+            cursor.execute("INSERT INTO Human (email, phone, name) VALUES (NULL, NULL, 'Giulia')")
+    storage.close()
+
+
+def test_tool_queries_should_search_the_indexes_on_a_large_database(large_storage):
+    # GIVEN
+    reader = HumansAndContactsEventsReaderTool(storage=large_storage)
+    recorder = ContactEventRecorderTool(storage=large_storage)
+
+    # WHEN
+    plans = {}
+    plans.update(_query_plans(large_storage, lambda: reader.read(mode="summary")))
+    plans.update(_query_plans(large_storage, lambda: reader.read(mode="history")))
+    plans.update(_query_plans(large_storage, lambda: FairnessScorer().rank(large_storage)))
+    plans.update(_query_plans(large_storage, lambda: recorder.use("Human1999")))
+
+    # THEN
+    details = [detail for plan in plans.values() for detail in plan]
+    assert not [detail for detail in details if detail.startswith("SCAN ContactEvent") and "INDEX" not in detail]
+    assert not [detail for detail in details if "TEMP B-TREE" in detail]
+    assert sum("COVERING INDEX ContactEventHumanDatetime (human_id=? AND datetime>?)" in detail for detail in details) == 3
+    assert any("INDEX ContactEventDatetime" in detail for detail in details)
+    assert any("COVERING INDEX HumanName (name=?)" in detail for detail in details)
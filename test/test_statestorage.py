@@ -0,0 +1,70 @@
+import pytest
+import os
+import sys
+import threading
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(f"{dir_path}/.."))
+from config.createdb import create_database
+from tools.statestorage import StateStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    db_file = str(tmp_path / "state.db")
+    create_database(db_file)
+    storage = StateStorage(db_file)
+    yield storage
+    storage.close()
+
+
+def test_storage_should_use_wal_journal_mode_and_reuse_connections(storage):
+    # WHEN
+    with storage.connection() as conn:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        first_connection = conn
+    with storage.connection() as conn:
+        second_connection = conn
+
+    # THEN
+    assert journal_mode == "wal"
+    assert first_connection is second_connection
+
+
+def test_storage_should_roll_back_failed_transaction(storage):
+    # WHEN
+    with pytest.raises(ValueError):
+        with storage.transaction(immediate=True) as cursor:
+            cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (None, None, "Pawel"))
+            raise ValueError("failure after insert")
+
+    # THEN
+    with storage.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM Human").fetchone()[0]
+    assert count == 0
+
+
+def test_storage_should_serialize_concurrent_writers_without_lock_errors(storage):
+    # GIVEN
+    errors = []
+
+    def write_humans(worker_id):
+        try:
+            for i in range(50):
+                with storage.transaction(immediate=True) as cursor:
+                    cursor.execute("INSERT INTO Human (email, phone, name) VALUES (?, ?, ?)", (None, None, f"{worker_id}-{i}"))
+        except Exception as exception:
+            errors.append(exception)
+
+    # WHEN
+    threads = [threading.Thread(target=write_humans, args=(worker_id,)) for worker_id in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # THEN
+    assert errors == []
+    with storage.connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM Human").fetchone()[0]
+    assert count == 8 * 50
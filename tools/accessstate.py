@@ -1,6 +1,4 @@
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 from langchain_core.tools import tool
 from typing import Any
 
@@ -8,8 +6,20 @@ from langchain_core.messages import ToolMessage
 from langchain_core.runnables import RunnableLambda, RunnableWithFallbacks
 from langgraph.prebuilt import ToolNode
 
+from tools.statestorage import get_storage
 
-db = SQLDatabase.from_uri("sqlite:///state.db")
+
+@lru_cache(maxsize=None)
+def get_db():
+    """
+    The SQLAlchemy view of the state database, created on first use. Same database file and
+    busy timeout as the tools using the shared state storage.
+    """
+    from langchain_community.utilities import SQLDatabase
+
+    return SQLDatabase.from_uri(
+        f"sqlite:///{get_storage().db_path}",
+        engine_args={"connect_args": {"timeout": 5.0}})
 
 
 def create_tool_node_with_fallback(tools: list) -> RunnableWithFallbacks[Any, dict]:
@@ -35,15 +45,46 @@ def handle_tool_error(state) -> dict:
     }
 
 
-toolkit = SQLDatabaseToolkit(db=db, llm=ChatOpenAI(model="gpt-4"))
-tools = toolkit.get_tools()
+@lru_cache(maxsize=None)
+def get_toolkit():
+    from langchain_community.agent_toolkits import SQLDatabaseToolkit
+    from langchain_openai import ChatOpenAI
+
+    return SQLDatabaseToolkit(db=get_db(), llm=ChatOpenAI(model="gpt-4"))
+
+
+@lru_cache(maxsize=None)
+def get_toolkit_tools() -> list:
+    return get_toolkit().get_tools()
+
+
+def get_list_tables_tool():
+    return next(tool for tool in get_toolkit_tools() if tool.name == "sql_db_list_tables")
+
+
+def get_db_schema_tool():
+    return next(tool for tool in get_toolkit_tools() if tool.name == "sql_db_schema")
+
+
+# The module attributes from before they were created on first use
+_LAZY_ATTRIBUTES = {
+    "db": get_db,
+    "toolkit": get_toolkit,
+    "tools": get_toolkit_tools,
+    "list_tables_tool": get_list_tables_tool,
+    "get_schema_tool": get_db_schema_tool,
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-list_tables_tool = next(tool for tool in tools if tool.name == "sql_db_list_tables")
-get_schema_tool = next(tool for tool in tools if tool.name == "sql_db_schema")
 
 @tool
 def db_query_tool(query: str) -> str:
-  result = db.run_no_throw(query)
+  result = get_db().run_no_throw(query)
   if not result:
       return "Error: Query failed. Please rewrite your query and try again."
   return result
\ No newline at end of file
@@ -0,0 +1,33 @@
+
+from datetime import datetime
+
+
+def format_timestamp(value) -> str:
+    """
+    Truncates a stored timestamp to the minute, which is all the agent needs to reason about.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    return str(value)[:16].replace("T", " ")
+
+
+def format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def format_table(columns: list[str], rows) -> str:
+    """
+    Token-efficient columnar text for tool results: a header row and one row per record,
+    values separated by "|", empty for missing values.
+    """
+    lines = ["|".join(columns)]
+    lines.extend("|".join(format_value(value) for value in row) for row in rows)
+    return "\n".join(lines)
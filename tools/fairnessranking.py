@@ -0,0 +1,175 @@
+
+from langchain_core.tools import StructuredTool
+from datetime import datetime, timedelta
+
+from tools.compacttable import format_table, format_timestamp
+from tools.humanavailabilityverifier import HumansAvailabilityVerifierTool
+from tools.statestorage import StateStorage, from_epoch, get_storage, to_epoch
+
+
+class FairnessWeights:
+    __slots__ = ("recency", "short_window_frequency", "long_window_frequency", "short_window_days", "long_window_days", "recency_cap_days")
+
+    def __init__(self, recency: float = 1.0, short_window_frequency: float = 0.5, long_window_frequency: float = 0.25, short_window_days: int = 7, long_window_days: int = 30, recency_cap_days: int = 14):
+        self.recency = recency
+        self.short_window_frequency = short_window_frequency
+        self.long_window_frequency = long_window_frequency
+        self.short_window_days = short_window_days
+        self.long_window_days = long_window_days
+        self.recency_cap_days = recency_cap_days
+
+
+class HumanFairness:
+    __slots__ = ("human_id", "name", "email", "phone", "last_contact", "days_since_last_contact", "short_window_contacts", "long_window_contacts", "contacted_today", "available", "eligible", "score")
+
+    def __init__(self, human_id, name, email, phone, last_contact, days_since_last_contact, short_window_contacts, long_window_contacts, contacted_today, available):
+        self.human_id = human_id
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.last_contact = last_contact
+        self.days_since_last_contact = days_since_last_contact
+        self.short_window_contacts = short_window_contacts
+        self.long_window_contacts = long_window_contacts
+        self.contacted_today = contacted_today
+        self.available = available
+        self.eligible = False
+        self.score = 0.0
+
+    def __repr__(self):
+        return (f"HumanFairness(name='{self.name}', email='{self.email}', eligible={self.eligible}, score={self.score:.3f}, "
+                f"last_contact='{self.last_contact}', days_since_last_contact={self.days_since_last_contact}, "
+                f"short_window_contacts={self.short_window_contacts}, long_window_contacts={self.long_window_contacts}, "
+                f"contacted_today={self.contacted_today}, available={self.available})")
+
+
+class FairnessRanking:
+    __slots__ = ("contact_allowed", "reason", "humans")
+
+    def __init__(self, contact_allowed: bool, reason: str, humans: list[HumanFairness]):
+        self.contact_allowed = contact_allowed
+        self.reason = reason
+        self.humans = humans
+
+    @property
+    def best(self) -> HumanFairness:
+        """The eligible human to contact, if any"""
+        return self.humans[0] if self.humans and self.humans[0].eligible else None
+
+    def __repr__(self):
+        return f"FairnessRanking(contact_allowed={self.contact_allowed}, reason='{self.reason}', humans={self.humans})"
+
+
+class FairnessScorer:
+    """
+    Ranks humans by how fair it is to contact them now: the longer since the last contact and the
+    fewer contacts in the sliding windows, the higher the score. Subclass and override score to
+    plug in another policy.
+    """
+
+    def __init__(self, weights: FairnessWeights = None):
+        self._weights = weights or FairnessWeights()
+
+    def score(self, human: HumanFairness) -> float:
+        weights = self._weights
+        days_since = human.days_since_last_contact
+        if days_since is None:
+            days_since = weights.recency_cap_days
+        recency = min(days_since, weights.recency_cap_days) / weights.recency_cap_days
+        return (weights.recency * recency
+                - weights.short_window_frequency * human.short_window_contacts / weights.short_window_days
+                - weights.long_window_frequency * human.long_window_contacts / weights.long_window_days)
+
+    def _read_humans(self, cursor, now: datetime, availability: dict[str, bool]) -> list[HumanFairness]:
+        short_window_start = now - timedelta(days=self._weights.short_window_days)
+        long_window_start = now - timedelta(days=self._weights.long_window_days)
+
+        # All humans in one pass: the last contact and both window counts are range
+        # searches on the (human_id, datetime) index
+        cursor.execute("""
+            SELECT h.id, h.name, h.email, h.phone,
+                   (SELECT MAX(datetime) FROM ContactEvent WHERE human_id = h.id),
+                   (SELECT COUNT(*) FROM ContactEvent WHERE human_id = h.id AND datetime >= :short_window_start),
+                   (SELECT COUNT(*) FROM ContactEvent WHERE human_id = h.id AND datetime >= :long_window_start)
+            FROM Human h
+            ORDER BY h.id
+        """, {"short_window_start": to_epoch(short_window_start), "long_window_start": to_epoch(long_window_start)})
+
+        humans = []
+        for (id_, name, email, phone, last_contact, short_window_contacts, long_window_contacts) in cursor.fetchall():
+            last_contact_dt = from_epoch(last_contact)
+            humans.append(HumanFairness(
+                id_, name, email, phone, last_contact_dt,
+                (now - last_contact_dt).days if last_contact_dt else None,
+                short_window_contacts,
+                long_window_contacts,
+                last_contact_dt is not None and last_contact_dt.date() == now.date(),
+                availability.get(name) if availability is not None else None))
+        return humans
+
+    def rank(self, storage: StateStorage, availability: dict[str, bool] = None, now: datetime = None) -> FairnessRanking:
+        """
+        Scores all humans and orders them eligible first, best score first. availability maps human
+        names to their availability, humans missing from it are considered available.
+        """
+        now = now or datetime.now()
+        with storage.transaction() as cursor:
+            humans = self._read_humans(cursor, now, availability)
+
+        contacted_today = [human.name for human in humans if human.contacted_today]
+        for human in humans:
+            human.score = self.score(human)
+            human.eligible = not contacted_today and human.available is not False
+
+        humans.sort(key=lambda human: (not human.eligible, -human.score, human.human_id))
+
+        if not humans:
+            return FairnessRanking(False, "There are no humans to contact", humans)
+        if contacted_today:
+            return FairnessRanking(False, f"Already contacted today: {', '.join(contacted_today)}", humans)
+        if not any(human.eligible for human in humans):
+            return FairnessRanking(False, "No human is available", humans)
+        return FairnessRanking(True, f"{humans[0].name} is the fairest choice", humans)
+
+
+class FairnessRankingTool:
+
+    def __init__(self, storage: StateStorage = None, scorer: FairnessScorer = None, availability_tool: HumansAvailabilityVerifierTool = None):
+        self._storage = storage or get_storage()
+        self._scorer = scorer or FairnessScorer()
+        self._availability_tool = availability_tool or HumansAvailabilityVerifierTool(storage=self._storage)
+
+    def rank(self, check_availability: bool = True) -> FairnessRanking:
+        availability = self._availability_tool.use() if check_availability else None
+        return self._scorer.rank(self._storage, availability)
+
+    def use(self, check_availability: bool = True) -> str:
+        ranking = self.rank(check_availability)
+
+        # Compact table for the model, best candidate first
+        return f"contact_allowed: {'yes' if ranking.contact_allowed else 'no'} ({ranking.reason})\n" + format_table(
+            ["name", "email", "eligible", "score", "last_contact", "days_since_last_contact", "short_window_contacts", "long_window_contacts", "contacted_today", "available"],
+            ((human.name, human.email, human.eligible, human.score, format_timestamp(human.last_contact), human.days_since_last_contact,
+              human.short_window_contacts, human.long_window_contacts, human.contacted_today, human.available)
+             for human in ranking.humans))
+
+    def description(self) -> str:
+        return """
+            rank_humans_for_contact(check_availability: bool = True) -> str:
+                Applies the fairness rules to the contact history and the availability of all humans and ranks them: nobody is eligible if someone was already contacted today, unavailable humans are not eligible, and the least recently and least frequently contacted humans score highest.
+
+            Args:
+                check_availability: bool - Whether to verify the availability of the humans as part of the ranking.
+
+            Returns:
+                str - Whether a contact is allowed today and why, followed by a table ("|" separated values) of all humans ordered eligible first, best score first.
+            """
+
+    @property
+    def definition(self) -> StructuredTool:
+        return StructuredTool.from_function(
+            self.use,
+            name="rank_humans_for_contact",
+            description=self.description(),
+            # Only reads, can run concurrently with other read-only tools
+            metadata={"read_only": True})
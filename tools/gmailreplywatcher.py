@@ -0,0 +1,122 @@
+
+import time
+
+from tools.metrics import Metrics, get_metrics
+from tools.ratelimits import BaseRateLimiter, acquire
+
+
+def is_history_expired(error: Exception) -> bool:
+    """
+    Whether a history.list error means the startHistoryId is too old (HTTP 404), in which case
+    the threads must be re-scanned, see GmailReplyWatcher.rescan.
+    """
+    return getattr(getattr(error, "resp", None), "status", None) == 404
+
+
+class GmailReplyWatcher:
+    """
+    Detects replies in Gmail threads from the mailbox history (history.list with a stored
+    startHistoryId), instead of re-reading the whole thread on every poll.
+    """
+
+    def __init__(self, service, user_id: str = "me", initial_interval: float = 1.0, max_interval: float = 30.0, backoff_factor: float = 1.5, sleep=time.sleep, clock=time.monotonic, metrics: Metrics = None, rate_limiter: BaseRateLimiter = None):
+        self._service = service
+        self._rate_limiter = rate_limiter
+        self._metrics = metrics or get_metrics()
+        self._user_id = user_id
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._backoff_factor = backoff_factor
+        self._sleep = sleep
+        self._clock = clock
+
+    def current_history_id(self) -> str:
+        """
+        Returns the latest history id of the mailbox. Take it before sending a message,
+        so that a reply arriving right after the send is not missed.
+        """
+        acquire(self._rate_limiter, self._metrics, "gmail")
+        with self._metrics.span("gmail", api="users.getProfile"):
+            profile = self._service.users().getProfile(userId=self._user_id, fields="historyId").execute()
+        return profile["historyId"]
+
+    def poll(self, start_history_id: str, thread_ids) -> tuple[dict[str, list[str]], str]:
+        """
+        Returns the ids of messages added to the given threads after start_history_id, skipping
+        messages we sent ourselves, and the history id to continue polling from. thread_ids may
+        also map each thread to its own, later, start history id, so that many threads can be
+        watched with a single request.
+        """
+        if not isinstance(thread_ids, dict):
+            thread_ids = {thread_id: start_history_id for thread_id in thread_ids}
+        replies = {}
+        latest_history_id = start_history_id
+        page_token = None
+
+        while True:
+            request_args = {
+                "userId": self._user_id,
+                "startHistoryId": start_history_id,
+                "historyTypes": ["messageAdded"],
+                # Only what is needed to match replies to threads
+                "fields": "history(id,messagesAdded/message(id,threadId,labelIds)),historyId,nextPageToken",
+            }
+            if page_token:
+                request_args["pageToken"] = page_token
+            acquire(self._rate_limiter, self._metrics, "gmail")
+            with self._metrics.span("gmail", api="history.list"):
+                response = self._service.users().history().list(**request_args).execute()
+
+            latest_history_id = response.get("historyId", latest_history_id)
+            for record in response.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message = added["message"]
+                    if message.get("threadId") not in thread_ids or "SENT" in message.get("labelIds", []):
+                        continue
+                    if int(record["id"]) <= int(thread_ids[message["threadId"]]):
+                        continue
+                    thread_replies = replies.setdefault(message["threadId"], [])
+                    if message["id"] not in thread_replies:
+                        thread_replies.append(message["id"])
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return replies, latest_history_id
+
+    def rescan(self, thread_ids: dict) -> tuple[dict[str, list[str]], str]:
+        """
+        Same result as poll, read from the threads themselves (one threads.get each) rather than
+        the history, for when the start history ids have expired.
+        """
+        latest_history_id = self.current_history_id()
+        replies = {}
+        for thread_id, start_history_id in thread_ids.items():
+            acquire(self._rate_limiter, self._metrics, "gmail")
+            with self._metrics.span("gmail", api="threads.get"):
+                thread = self._service.users().threads().get(userId=self._user_id, id=thread_id, format="minimal", fields="messages(id,labelIds,historyId)").execute()
+            for message in thread.get("messages", []):
+                if "SENT" in message.get("labelIds", []) or int(message["historyId"]) <= int(start_history_id):
+                    continue
+                replies.setdefault(thread_id, []).append(message["id"])
+        return replies, latest_history_id
+
+    def wait_for_reply(self, thread_id: str, start_history_id: str, timeout: float) -> str:
+        """
+        Polls the history with an increasing interval until a reply shows up in the thread
+        or the timeout (in seconds) is reached. Returns the id of the first reply or None.
+        """
+        deadline = self._clock() + timeout
+        interval = self._initial_interval
+        history_id = start_history_id
+
+        while True:
+            replies, history_id = self.poll(history_id, [thread_id])
+            if replies.get(thread_id):
+                return replies[thread_id][0]
+
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                return None
+
+            self._sleep(min(interval, remaining))
+            interval = min(interval * self._backoff_factor, self._max_interval)
@@ -1,35 +1,25 @@
 
 from langchain_core.tools import StructuredTool
-from datetime import datetime, timedelta
-import asyncio
-from sagemcom_api.client import SagemcomClient
-from sagemcom_api.enums import EncryptionMethod
-from sagemcom_api.exceptions import NonWritableParameterException
 
-class HumanAvailabilityVerifierTool:
-
-    def __init__(self):
-        pass
+from tools.metrics import Metrics, get_metrics
+from tools.routerhostcache import RouterHostCache, get_router_host_cache
+from tools.statestorage import StateStorage, get_storage
 
-    async def _use_async(self, human_phone_handle: str) -> bool:
-        async with SagemcomClient("192.168.1.1", "1234", "*Bamb!n!Inf!n!t!*0524", EncryptionMethod.MD5, verify_ssl=True) as client:
-            try:
-                await client.login()
-            except Exception as exception:
-                print(exception)
-                return None
-        
-            devices = await client.get_hosts()
-
-            for device in devices:
-                if(device.active and device.id == human_phone_handle):
-                    return True
+class HumanAvailabilityVerifierTool:
 
-            return False
+    def __init__(self, host_cache: RouterHostCache = None, metrics: Metrics = None):
+        self._host_cache = host_cache or get_router_host_cache()
+        self._metrics = metrics or get_metrics()
 
     def use(self, human_phone_handle: str) -> bool:
-        return asyncio.run(self._use_async(human_phone_handle))
-    
+        # Answered from the cached host table, the router is only asked once the table expires
+        try:
+            return self._host_cache.is_active(human_phone_handle)
+        except Exception as exception:
+            # Availability unknown, the router calls are traced by the host cache
+            self._metrics.count("availability_errors", tool="human_availability_verifier", error=type(exception).__name__)
+            return None
+
     def description(self) -> str:
         return """
             human_availability_verifier() -> bool:
@@ -41,15 +31,63 @@ class HumanAvailabilityVerifierTool:
             Returns:
                 bool - True if the human is available, False otherwise.
             """
-    
+
     @property
     def definition(self) -> StructuredTool:
         return StructuredTool.from_function(
             self.use,
             name="human_availability_verifier",
-            description=self.description())
-    
+            description=self.description(),
+            # Only reads, can run concurrently with other read-only tools
+            metadata={"read_only": True})
+
+
+class HumansAvailabilityVerifierTool:
+
+    def __init__(self, host_cache: RouterHostCache = None, storage: StateStorage = None, metrics: Metrics = None):
+        self._host_cache = host_cache or get_router_host_cache()
+        self._storage = storage or get_storage()
+        self._metrics = metrics or get_metrics()
+
+    def use(self, human_phone_handles: list[str] = None) -> dict[str, bool]:
+        if human_phone_handles is None:
+            # Everyone in the Human table, keyed by name
+            with self._storage.connection() as conn:
+                handles = dict(conn.execute("SELECT name, phone FROM Human WHERE phone IS NOT NULL").fetchall())
+        else:
+            handles = {handle: handle for handle in human_phone_handles}
+
+        # A single host table snapshot answers all the lookups
+        try:
+            active_hosts = self._host_cache.active_hosts()
+        except Exception as exception:
+            self._metrics.count("availability_errors", tool="humans_availability_verifier", error=type(exception).__name__)
+            return {key: None for key in handles}
+
+        return {key: active_hosts.get(handle.upper(), False) for key, handle in handles.items()}
+
+    def description(self) -> str:
+        return """
+            humans_availability_verifier(human_phone_handles: list[str] = None) -> dict[str, bool]:
+                This tool is used to verify at once which humans are available to receive a message.
+
+            Args:
+                human_phone_handles: list[str] - The phone handles of the humans to verify availability. When omitted, all known humans are verified.
+
+            Returns:
+                dict[str, bool] - True if the human is available, False otherwise, keyed by phone handle, or by human name when human_phone_handles is omitted.
+            """
+
+    @property
+    def definition(self) -> StructuredTool:
+        return StructuredTool.from_function(
+            self.use,
+            name="humans_availability_verifier",
+            description=self.description(),
+            # Only reads, can run concurrently with other read-only tools
+            metadata={"read_only": True})
+
 
 if __name__ == "__main__":
     tool = HumanAvailabilityVerifierTool()
-    print(tool.use("B2:66:C2:5D:17:71"))
\ No newline at end of file
+    print(tool.use("B2:66:C2:5D:17:71"))
@@ -1,9 +1,16 @@
 
 from langchain_core.tools import StructuredTool
 from datetime import datetime, timedelta
-import sqlite3
+from typing import Iterable
+import threading
+import weakref
+
+from tools.compacttable import format_table, format_timestamp
+from tools.statestorage import StateStorage, from_epoch, get_storage, to_epoch
 
 class Human:
+    __slots__ = ("id", "email", "phone", "name")
+
     def __init__(self, id, email, phone, name):
         self.id = id
         self.email = email
@@ -15,55 +22,132 @@ class Human:
 
 
 class ContactEvent:
-    def __init__(self, id, human_id, datetime_):
+    __slots__ = ("id", "human_id", "datetime_", "human_name")
+
+    def __init__(self, id, human_id, datetime_, human_name=None):
         self.id = id
         self.human_id = human_id
         self.datetime_ = datetime_
+        self.human_name = human_name
     
     def __repr__(self):
         return f"ContactEvent(id={self.id}, human_id={self.human_id}, datetime_='{self.datetime_}')"
 
 
+class HumanContactSummary:
+    __slots__ = ("human_id", "email", "phone", "name", "last_contact", "contacts_in_window", "days_since_last_contact", "contacted_today")
+
+    def __init__(self, human_id, email, phone, name, last_contact, contacts_in_window, days_since_last_contact, contacted_today):
+        self.human_id = human_id
+        self.email = email
+        self.phone = phone
+        self.name = name
+        self.last_contact = last_contact
+        self.contacts_in_window = contacts_in_window
+        self.days_since_last_contact = days_since_last_contact
+        self.contacted_today = contacted_today
+
+    def __repr__(self):
+        return (f"HumanContactSummary(human_id={self.human_id}, email='{self.email}', phone='{self.phone}', name='{self.name}', "
+                f"last_contact='{self.last_contact}', contacts_in_window={self.contacts_in_window}, "
+                f"days_since_last_contact={self.days_since_last_contact}, contacted_today={self.contacted_today})")
+
+
 class HumansAndContactsEventsReaderTool:
 
-    def __init__(self):
-        pass
+    SUMMARY_MODE = "summary"
+    HISTORY_MODE = "history"
+
+    def __init__(self, storage: StateStorage = None):
+        self._storage = storage or get_storage()
 
-    def use(self) -> list[tuple[str, datetime]]:
-        # Connect to the database
-        conn = sqlite3.connect("state.db")
-        cursor = conn.cursor()
+    def _read_summary(self, cursor, window_days: int) -> list[HumanContactSummary]:
+        now = datetime.now()
+        window_start = now - timedelta(days=window_days)
 
+        # One row per human: the last contact and the contacts inside the requested window
+        # are both range searches on the (human_id, datetime) index
+        cursor.execute("""
+            SELECT h.id, h.email, h.phone, h.name,
+                   (SELECT MAX(datetime) FROM ContactEvent WHERE human_id = h.id),
+                   (SELECT COUNT(*) FROM ContactEvent WHERE human_id = h.id AND datetime >= :window_start)
+            FROM Human h
+            ORDER BY h.id
+        """, {"window_start": to_epoch(window_start)})
+
+        summaries = []
+        for (id_, email, phone, name, last_contact, contacts) in cursor.fetchall():
+            last_contact = from_epoch(last_contact)
+            summaries.append(HumanContactSummary(
+                id_, email, phone, name, last_contact, contacts,
+                (now - last_contact).days if last_contact else None,
+                last_contact is not None and last_contact.date() == now.date()))
+        return summaries
+
+    def _read_history(self, cursor, history_limit: int, history_offset: int) -> tuple[list[Human], list[ContactEvent]]:
         # Retrieve all rows from Human
         cursor.execute("SELECT id, email, phone, name FROM Human")
         human_rows = cursor.fetchall()
-        
+
         # Create a list of Human objects
         humans = [Human(id_, email, phone, name) for (id_, email, phone, name) in human_rows]
 
-        # Retrieve all rows from ContactEvent
-        cursor.execute("SELECT id, human_id, datetime FROM ContactEvent")
+        # Retrieve one page of ContactEvent rows, most recent first
+        cursor.execute("""
+            SELECT e.id, e.human_id, e.datetime, h.name
+            FROM ContactEvent e
+            LEFT JOIN Human h ON h.id = e.human_id
+            ORDER BY e.datetime DESC, e.id DESC
+            LIMIT ? OFFSET ?
+        """, (history_limit, history_offset))
         contact_event_rows = cursor.fetchall()
-        
+
         # Create a list of ContactEvent objects
         contact_events = [
-            ContactEvent(id_, human_id, datetime_) 
-            for (id_, human_id, datetime_) in contact_event_rows
+            ContactEvent(id_, human_id, from_epoch(datetime_), human_name)
+            for (id_, human_id, datetime_, human_name) in contact_event_rows
         ]
 
-        # Close the connection
-        conn.close()
-
-        # Return both lists
         return humans, contact_events
-        
+
+    def read(self, mode: str = SUMMARY_MODE, window_days: int = 7, history_limit: int = 50, history_offset: int = 0):
+        if mode not in (self.SUMMARY_MODE, self.HISTORY_MODE):
+            raise ValueError(f"Unknown mode: {mode}, expected '{self.SUMMARY_MODE}' or '{self.HISTORY_MODE}'")
+
+        # Read from a single snapshot of the database
+        with self._storage.transaction() as cursor:
+            if mode == self.SUMMARY_MODE:
+                return self._read_summary(cursor, window_days)
+            return self._read_history(cursor, history_limit, history_offset)
+
+    def use(self, mode: str = SUMMARY_MODE, window_days: int = 7, history_limit: int = 50, history_offset: int = 0) -> str:
+        result = self.read(mode, window_days, history_limit, history_offset)
+
+        # Compact tables for the model: names instead of ids, timestamps to the minute
+        if mode == self.SUMMARY_MODE:
+            return format_table(
+                ["name", "email", "phone", "last_contact", f"contacts_last_{window_days}_days", "days_since_last_contact", "contacted_today"],
+                ((summary.name, summary.email, summary.phone, format_timestamp(summary.last_contact), summary.contacts_in_window, summary.days_since_last_contact, summary.contacted_today)
+                 for summary in result))
+
+        humans, contact_events = result
+        return "\n\n".join([
+            format_table(["name", "email", "phone"], ((human.name, human.email, human.phone) for human in humans)),
+            format_table(["contacted", "datetime"], ((event.human_name, format_timestamp(event.datetime_)) for event in contact_events)),
+        ])
+
     def description(self) -> str:
         return """
-            read_humans_and_contacts_events() -> tuple[list[Human], list[ContactEvent]]:
-                Provide with a list of humans available to contact and a list with all historical contact events.
+            read_humans_and_contacts_events(mode: str = "summary", window_days: int = 7, history_limit: int = 50, history_offset: int = 0) -> str:
+                Provide with the humans available to contact and their contact history, as tables with a header row and "|" separated values.
+                In "summary" mode (default) returns one row per human with the last contact time, the number of contacts in the last window_days days, the number of days since the last contact and whether the human was contacted today.
+                In "history" mode returns a table of humans and a table with one page of raw historical contact events, most recent first.
 
             Args:
-                None
+                mode: str - Either "summary" or "history".
+                window_days: int - The size of the window, in days, used to count recent contacts in "summary" mode.
+                history_limit: int - The maximum number of contact events returned in "history" mode.
+                history_offset: int - The number of most recent contact events to skip in "history" mode, used to page through older events.
             """
     
     @property
@@ -71,39 +155,199 @@ class HumansAndContactsEventsReaderTool:
         return StructuredTool.from_function(
             self.use,
             name="read_humans_and_contacts_events",
-            description=self.description())
+            description=self.description(),
+            # Only reads, can run concurrently with other read-only tools
+            metadata={"read_only": True})
     
 
-class ContactEventRecorderTool:
+class _PendingContactEvents:
+    __slots__ = ("events", "results", "error", "done", "awaited")
 
     def __init__(self):
-        pass
+        # (human_name, epoch, deferred), deferred when recorded with wait=False
+        self.events = []
+        # Per event, its id or the ValueError of a human deleted since it was recorded
+        self.results = []
+        # Failure of the whole commit
+        self.error = None
+        self.done = False
+        # A flush waits for all the events, including the deferred ones
+        self.awaited = False
+
+
+class ContactEventWriter:
+    """
+    Write-behind recorder of contact events with group commit. Human names are resolved through a
+    cache, events are buffered and written in one transaction per flush: concurrent writers (e.g.
+    many households sharing the database) wait for the same commit instead of one each.
+
+    record and record_many return once the events are committed, with their ids. With wait=False
+    they return right away and the events are flushed when max_pending are buffered, after
+    flush_interval seconds, or on flush and close (at the end of a run). When such events fail
+    and no flush waited for them, the error is raised by the next record, record_many, flush or
+    close call.
+
+    The cache only rejects unknown names early, the events are written under the id the name has
+    at commit time, so a human deleted and added again keeps getting their events. An event of a
+    human deleted meanwhile fails alone, the other events of the commit are written.
+    """
+
+    def __init__(self, storage: StateStorage = None, max_pending: int = 100, flush_interval: float = 1.0):
+        self._storage = storage or get_storage()
+        self._max_pending = max_pending
+        self._flush_interval = flush_interval
+        self._condition = threading.Condition()
+        self._pending = _PendingContactEvents()
+        self._flushing = False
+        self._timer = None
+        self._deferred_error = None
+        self._known_names = set()
+
+    def _check_known(self, human_name: str):
+        if human_name not in self._known_names:
+            with self._storage.connection() as conn:
+                row = conn.execute("SELECT id FROM Human WHERE name = ?", (human_name,)).fetchone()
+            if not row:
+                raise ValueError(f"No human found with name: {human_name}")
+            self._known_names.add(human_name)
+
+    @staticmethod
+    def _deferred_failure(batch: _PendingContactEvents) -> Exception:
+        if batch.error is not None:
+            return batch.error if all(deferred for _, _, deferred in batch.events) else None
+        return next((result for (_, _, deferred), result in zip(batch.events, batch.results) if deferred and isinstance(result, Exception)), None)
+
+    def _raise_deferred_error(self):
+        with self._condition:
+            deferred_error, self._deferred_error = self._deferred_error, None
+        if deferred_error is not None:
+            raise deferred_error
+
+    def record(self, human_name: str, when: datetime = None, wait: bool = True) -> int:
+        ids = self.record_many([(human_name, when)], wait=wait)
+        return ids[0] if ids else None
+
+    def record_many(self, events: Iterable[tuple[str, datetime]], wait: bool = True) -> list[int]:
+        """
+        Records (human_name, when) contact events, when defaulting to now. Unknown names are
+        rejected before anything is buffered.
+        """
+        self._raise_deferred_error()
+        now = datetime.now()
+        rows = [(human_name, to_epoch(when or now), not wait) for human_name, when in events]
+        for human_name, _, _ in rows:
+            self._check_known(human_name)
+        with self._condition:
+            pending = self._pending
+            first = len(pending.events)
+            pending.events.extend(rows)
+            full = len(pending.events) >= self._max_pending
+            if not wait and not full and self._timer is None:
+                self._timer = threading.Timer(self._flush_interval, self._flush_buffered)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if wait or full:
+            self._commit(pending)
+        if not wait:
+            return None
+        if pending.error is not None:
+            raise pending.error
+        ids = pending.results[first:first + len(rows)]
+        # Only the failures of this caller's events
+        for result in ids:
+            if isinstance(result, Exception):
+                raise result
+        return ids
+
+    def _flush_buffered(self):
+        # From the timer thread, a failure is raised by the next call instead
+        with self._condition:
+            pending = self._pending
+        self._commit(pending)
+
+    def flush(self):
+        """Commits the buffered events, raises the failure of those recorded with wait=False"""
+        with self._condition:
+            pending = self._pending
+            pending.awaited = True
+        self._commit(pending)
+        failure = self._deferred_failure(pending) if pending.error is None else pending.error
+        if failure is not None:
+            raise failure
+        self._raise_deferred_error()
+
+    def _commit(self, pending: _PendingContactEvents):
+        # The first waiter commits everything buffered so far, the others wait for its commit
+        # (and the ones arriving meanwhile gather for the next one)
+        with self._condition:
+            while not pending.done and self._flushing:
+                self._condition.wait()
+            if pending.done:
+                return
+            if not pending.events:
+                # Nothing to write, later events go to a fresh buffer
+                pending.done = True
+                self._pending = _PendingContactEvents()
+                return
+            self._flushing = True
+            batch, self._pending = self._pending, _PendingContactEvents()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        try:
+            with self._storage.transaction(immediate=True) as cursor:
+                for human_name, epoch, _ in batch.events:
+                    cursor.execute("INSERT INTO ContactEvent (human_id, datetime) SELECT id, ? FROM Human WHERE name = ?", (epoch, human_name))
+                    if cursor.rowcount == 0:
+                        # Deleted since it was recorded, only this event fails
+                        self._known_names.discard(human_name)
+                        batch.results.append(ValueError(f"No human found with name: {human_name}"))
+                    else:
+                        batch.results.append(cursor.lastrowid)
+        except Exception as error:
+            batch.results = []
+            batch.error = error
+        finally:
+            with self._condition:
+                # Kept for the next call only when no caller receives it
+                if not batch.awaited:
+                    self._deferred_error = self._deferred_failure(batch) or self._deferred_error
+                batch.done = True
+                self._flushing = False
+                self._condition.notify_all()
+
+    def close(self):
+        self.flush()
+
+
+_writers: "weakref.WeakKeyDictionary[StateStorage, ContactEventWriter]" = weakref.WeakKeyDictionary()
+_writers_lock = threading.Lock()
+
+
+def get_contact_event_writer(storage: StateStorage = None) -> ContactEventWriter:
+    """
+    Returns the contact event writer shared by all recorders of the storage, so that their
+    events are committed together.
+    """
+    storage = storage or get_storage()
+    with _writers_lock:
+        writer = _writers.get(storage)
+        if writer is None:
+            writer = _writers[storage] = ContactEventWriter(storage)
+        return writer
+
+
+class ContactEventRecorderTool:
+
+    def __init__(self, storage: StateStorage = None, writer: ContactEventWriter = None):
+        self._writer = writer or get_contact_event_writer(storage)
 
     def use(self, human_name: str) -> int:
-        conn = sqlite3.connect("state.db")
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id FROM Human WHERE name = ?", (human_name,))
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            raise ValueError(f"No human found with name: {human_name}")
-        human_id = row[0]
-        
-        now_str = datetime.now().isoformat()
-        
-        cursor.execute("""
-            INSERT INTO ContactEvent (human_id, datetime)
-            VALUES (?, ?)
-        """, (human_id, now_str))
-        
-        new_contact_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
-        
-        return new_contact_id
-            
+        # Returns once the event is committed, possibly together with other households' events
+        return self._writer.record(human_name)
+
     def description(self) -> str:
         return """
             write_contact_event(human_name: str) -> int:
@@ -1,24 +1,54 @@
 from langchain_core.tools import StructuredTool
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from enum import Enum
 import base64
 import os
 import time
 from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+
+from tools.gmailreplywatcher import GmailReplyWatcher
+from tools.metrics import Metrics, get_metrics
+from tools.ratelimits import BaseRateLimiter, acquire
+from tools.replyparser import extract_reply
 
 class HumanMessagingInterfaceReturnStatus(Enum):
     RETURNED_WITH_RESPONSE = 0
     RETURNED_WITHOUT_AWAITING_RESPONSE = 1
     RETURNED_ON_TIMEOUT_REACHED = 2
+    RETURNED_WITH_RESPONSE_PENDING = 3
 
 
 class HumanMessagingInterfaceTool:
 
-    def __init__(self):
+    def __init__(self, service=None, defer_responses: bool = False, metrics: Metrics = None, rate_limiter: BaseRateLimiter = None):
+        # The Gmail client (OAuth and discovery) is only built when a message is first sent
+        self._service = service
+        self._reply_watcher = None
+        self._defer_responses = defer_responses
+        self._metrics = metrics or get_metrics()
+        self._rate_limiter = rate_limiter
+        self._credentials = None
+
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = self._build_service()
+        return self._service
+
+    @property
+    def reply_watcher(self) -> GmailReplyWatcher:
+        if self._reply_watcher is None:
+            self._reply_watcher = GmailReplyWatcher(self.service, metrics=self._metrics, rate_limiter=self._rate_limiter)
+        return self._reply_watcher
+
+    def _build_service(self):
+        import httplib2
+        from google.oauth2.credentials import Credentials
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
         creds = None
         if os.path.exists("token.json"):
             creds = Credentials.from_authorized_user_file('token.json', ['https://www.googleapis.com/auth/gmail.modify'])
@@ -34,7 +64,30 @@ class HumanMessagingInterfaceTool:
                 with open("token.json", "w") as token:
                     token.write(creds.to_json())
         
-        self._service = build('gmail', 'v1', credentials=creds)
+        self._credentials = creds
+        # One authorized HTTP client, its keep-alive connection is reused by every request and batch.
+        # Discovery document from the copy bundled with google-api-python-client, no HTTP round trip
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=60))
+        return build('gmail', 'v1', http=http, static_discovery=True, cache_discovery=False)
+
+    def refresh_credentials(self, margin: float = 300.0) -> bool:
+        """
+        Refreshes the OAuth access token when it expires within margin seconds, so that a long
+        running process never pays the refresh on a send. The client keeps using the same
+        credentials object. Returns whether a refresh happened.
+        """
+        creds = self._credentials
+        if creds is None or not creds.refresh_token:
+            return False
+        if creds.valid and creds.expiry is not None and (creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() > margin:
+            return False
+
+        from google.auth.transport.requests import Request
+
+        creds.refresh(Request())
+        with open("token.json", "w") as token:
+            token.write(creds.to_json())
+        return True
 
     def _send_message(self, human_email: str, message_subject: str, message_body, thread_id: str = None) -> str:
         message = MIMEText(message_body, 'plain')
@@ -45,95 +98,93 @@ class HumanMessagingInterfaceTool:
             message['subject'] = "Re: " + message_subject
         else:
             message['subject'] = message_subject
-        print(message)
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        if thread_id:
-            sent_message = self._service.users().messages().send(
+        body = {'raw': raw_message, 'threadId': thread_id} if thread_id else {'raw': raw_message}
+        acquire(self._rate_limiter, self._metrics, "gmail")
+        with self._metrics.span("gmail", api="messages.send"):
+            sent_message = self.service.users().messages().send(
                 userId='me',
-                body={'raw': raw_message, 'threadId': thread_id}
+                body=body,
+                fields='id,threadId'
             ).execute()
-        else:
-            sent_message = self._service.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
-        print(sent_message)
         thread_id = sent_message['threadId']
         return thread_id
 
-    def _await_response(self, thread_id, response_timeout: int = 10) -> tuple[HumanMessagingInterfaceReturnStatus, str, str]:
-        start_time = datetime.now()
-        timeout_delta = timedelta(minutes=response_timeout)
-        
-        while datetime.now() - start_time < timeout_delta:
-            # Get messages in thread
-            thread_messages = self._service.users().threads().get(
-                userId='me', 
-                id=thread_id
-            ).execute()
-            
-            # Look for unread messages in the thread
-            for message in thread_messages['messages']:
-                # Skip the first message (our sent message)
-                if message == thread_messages['messages'][0]:
-                    continue
-                    
-                # Check if message is unread
-                if 'UNREAD' in message['labelIds']:
-                    # Get message payload
-                    message_data = self._service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='full'
-                    ).execute()
-                    
-                    # Extract message body
-                    if 'data' in message_data['payload']['body']:
-                        raw_body = base64.urlsafe_b64decode(
-                            message_data['payload']['body']['data']
-                        ).decode('utf-8')
-                    else:
-                        # Handle multipart messages
-                        raw_body = base64.urlsafe_b64decode(
-                            message_data['payload']['parts'][0]['body']['data']
-                        ).decode('utf-8')
-
-                    # Extract only the new message content by splitting on common email markers
-                    markers = [
-                        "\r\n\r\nOn ",  # Common reply marker
-                        "\n\nOn ",      # Alternative reply marker
-                        "\r\n> ",       # Quoted text marker
-                        "\n> ",         # Alternative quote marker
-                        "\r\n\r\n-----Original Message-----", # Forwarded message marker
-                        "\n\n-----Original Message-----"      # Alternative forward marker
-                    ]
-                    
-                    message_body = raw_body
-                    for marker in markers:
-                        if marker in message_body:
-                            message_body = message_body.split(marker)[0].strip()
-                    
-                    # Mark message as read
-                    self._service.users().messages().modify(
-                        userId='me',
-                        id=message['id'],
-                        body={'removeLabelIds': ['UNREAD']}
-                    ).execute()
-                    
-                    return (HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE, message_body, thread_id)
-            
-            # Sleep for 1 second before trying again
-            time.sleep(1)
+    def read_reply(self, message_id: str) -> str:
+        # Get the message payload and mark the message as read in one batched round trip
+        responses = {}
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                raise exception
+            responses[request_id] = response
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        batch.add(self.service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='full',
+            fields='payload'
+        ), request_id='get')
+        batch.add(self.service.users().messages().modify(
+            userId='me',
+            id=message_id,
+            body={'removeLabelIds': ['UNREAD']},
+            fields='id'
+        ), request_id='modify')
+        # Each request of the batch counts against the quota
+        acquire(self._rate_limiter, self._metrics, "gmail", requests=2)
+        with self._metrics.span("gmail", api="batch"):
+            batch.execute()
+        # The text the human wrote, without the quoted history and the signature
+        return extract_reply(responses['get']['payload'])
+
+    def _await_response(self, thread_id, start_history_id: str, response_timeout: int = 10) -> tuple[HumanMessagingInterfaceReturnStatus, str, str]:
+        # Only the mailbox history since the message was sent is polled, with a growing interval
+        reply_id = self.reply_watcher.wait_for_reply(thread_id, start_history_id, timeout=response_timeout * 60)
+        if reply_id is not None:
+            return (HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE, self.read_reply(reply_id), thread_id)
         
         # If timeout reached without response
         return (HumanMessagingInterfaceReturnStatus.RETURNED_ON_TIMEOUT_REACHED, None, None)
 
     def use(self, human_email: str, message_subject: str, message_body: str, await_response: bool = False, response_timeout: int = 10, messaging_thread_handle: str = None) -> tuple[HumanMessagingInterfaceReturnStatus, str, str]:
+        # Remember where the mailbox history stands before sending, so the reply cannot be missed
+        start_history_id = self.reply_watcher.current_history_id() if await_response == True else None
         thread_id = self._send_message(human_email, message_subject, message_body, messaging_thread_handle)
         if await_response == True:
-            return self._await_response(thread_id, response_timeout)
+            return self._await_response(thread_id, start_history_id, response_timeout)
         else:
             return (HumanMessagingInterfaceReturnStatus.RETURNED_WITHOUT_AWAITING_RESPONSE, None, None)
+
+    def use_with_status(self, human_email: str, message_subject: str, message_body: str, await_response: bool = False, response_timeout: int = 10, messaging_thread_handle: str = None) -> tuple[str, dict]:
+        """
+        Same as use, for the agent: the result as the tool message content and {"status": status
+        name} as the tool artifact, so that the status can be checked without parsing the content.
+        """
+        status, response, thread_id = self.use(human_email, message_subject, message_body, await_response, response_timeout, messaging_thread_handle)
+        return str((status, response, thread_id)), {"status": status.name}
+
+    def use_deferred(self, human_email: str, message_subject: str, message_body: str, await_response: bool = False, response_timeout: int = 10, messaging_thread_handle: str = None) -> tuple[str, dict]:
+        """
+        Same as use_with_status, but instead of waiting for the response it returns immediately with
+        a pending reply handle (status RETURNED_WITH_RESPONSE_PENDING) as the tool artifact. The
+        agent suspends the run on it and a ReplyDispatcher resumes the run once the reply arrives
+        or the timeout expires.
+        """
+        start_history_id = self.reply_watcher.current_history_id() if await_response == True else None
+        thread_id = self._send_message(human_email, message_subject, message_body, messaging_thread_handle)
+        if await_response != True:
+            status = HumanMessagingInterfaceReturnStatus.RETURNED_WITHOUT_AWAITING_RESPONSE
+            return str((status, None, None)), {"status": status.name}
+
+        pending_reply = {
+            "status": HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE_PENDING.name,
+            "thread_id": thread_id,
+            "start_history_id": start_history_id,
+            "deadline": time.time() + response_timeout * 60,
+        }
+        return str((HumanMessagingInterfaceReturnStatus.RETURNED_WITH_RESPONSE_PENDING, None, thread_id)), pending_reply
     
     def description(self) -> str:
         return """
@@ -154,10 +205,17 @@ class HumanMessagingInterfaceTool:
     
     @property
     def definition(self) -> StructuredTool:
+        if self._defer_responses:
+            return StructuredTool.from_function(
+                self.use_deferred,
+                name="human_messaging_interface",
+                description=self.description(),
+                response_format="content_and_artifact")
         return StructuredTool.from_function(
-            self.use,
+            self.use_with_status,
             name="human_messaging_interface",
-            description=self.description())
+            description=self.description(),
+            response_format="content_and_artifact")
     
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+
+from contextlib import contextmanager
+from collections import deque
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """
+    In-process recorder of spans (timed blocks: graph nodes, tools, Gmail and router calls, SQLite
+    statements) and counters (LLM tokens). Aggregates are kept per name and labels, the latest
+    spans are kept as events; both can be exported as JSON lines or as Prometheus text.
+    """
+
+    def __init__(self, max_events: int = 10000, clock=time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._spans = {}
+        self._counters = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        start = self._clock()
+        error = None
+        try:
+            yield
+        except BaseException as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            self.record_span(name, self._clock() - start, error=error, **labels)
+
+    def record_span(self, name: str, seconds: float, error: str = None, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            count, total, maximum = self._spans.get(key, (0, 0.0, 0.0))
+            self._spans[key] = (count + 1, total + seconds, max(maximum, seconds))
+            event = {"type": "span", "name": name, "labels": labels, "time": time.time(), "seconds": seconds}
+            if error:
+                event["error"] = error
+            self._events.append(event)
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_llm_usage(self, message, **labels):
+        """Counts the turn and the tokens reported in the usage metadata of a chat model response"""
+        self.count("llm_turns", **labels)
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return
+        self.count("llm_tokens", usage.get("input_tokens", 0), kind="input", **labels)
+        self.count("llm_tokens", usage.get("output_tokens", 0), kind="output", **labels)
+        cache_read = (usage.get("input_token_details") or {}).get("cache_read")
+        if cache_read:
+            self.count("llm_tokens", cache_read, kind="cache_read", **labels)
+
+    def traced(self, name: str, function, **labels):
+        """Wraps a function so that every call is recorded as a span"""
+        def traced_function(*args, **kwargs):
+            with self.span(name, **labels):
+                return function(*args, **kwargs)
+        return traced_function
+
+    def reset(self):
+        with self._lock:
+            self._events.clear()
+            self._spans.clear()
+            self._counters.clear()
+
+    def summary(self) -> dict:
+        """Aggregates as {name: [{labels, count, seconds, max_seconds} or {labels, value}]}"""
+        with self._lock:
+            spans, counters = dict(self._spans), dict(self._counters)
+        summary = {}
+        for (name, labels), (count, total, maximum) in sorted(spans.items()):
+            summary.setdefault(name, []).append({"labels": dict(labels), "count": count, "seconds": total, "max_seconds": maximum})
+        for (name, labels), value in sorted(counters.items()):
+            summary.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return summary
+
+    def to_json_lines(self) -> str:
+        with self._lock:
+            events = list(self._events)
+        lines = [json.dumps(event, sort_keys=True) for event in events]
+        lines.extend(json.dumps({"type": "aggregate", "name": name, **aggregate}, sort_keys=True)
+                     for name, aggregates in self.summary().items() for aggregate in aggregates)
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def to_prometheus(self, prefix: str = "smalltalk") -> str:
+        def labels_text(labels: dict) -> str:
+            if not labels:
+                return ""
+            return "{" + ",".join(f"{key}={json.dumps(str(value))}" for key, value in sorted(labels.items())) + "}"
+
+        lines = []
+        for name, aggregates in self.summary().items():
+            if "value" in aggregates[0]:
+                metric = f"{prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f"{metric}{labels_text(aggregate['labels'])} {aggregate['value']}" for aggregate in aggregates)
+            else:
+                metric = f"{prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} summary")
+                for aggregate in aggregates:
+                    lines.append(f"{metric}_count{labels_text(aggregate['labels'])} {aggregate['count']}")
+                    lines.append(f"{metric}_sum{labels_text(aggregate['labels'])} {aggregate['seconds']:.6f}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def export(self, json_lines_path: str = None, prometheus_path: str = None):
+        # Replaced atomically, concurrent exports and readers never see a partial file
+        for path, text in [(json_lines_path, self.to_json_lines), (prometheus_path, self.to_prometheus)]:
+            if path:
+                temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporary_path, "w") as output:
+                    output.write(text())
+                os.replace(temporary_path, path)
+
+    def export_to_dir(self, metrics_dir: str = None, name: str = "smalltalk") -> bool:
+        """
+        Exports to <name>.jsonl and <name>.prom (e.g. for the Prometheus textfile collector) in
+        metrics_dir, by default the SMALLTALK_METRICS_DIR environment variable, replacing the
+        previous export. Returns False, without exporting, when no directory is set.
+        """
+        metrics_dir = metrics_dir or os.getenv("SMALLTALK_METRICS_DIR")
+        if not metrics_dir:
+            return False
+        os.makedirs(metrics_dir, exist_ok=True)
+        self.export(os.path.join(metrics_dir, f"{name}.jsonl"), os.path.join(metrics_dir, f"{name}.prom"))
+        return True
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the metrics shared by the agent and its tools.
+    """
+    return _metrics
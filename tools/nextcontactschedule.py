@@ -1,13 +1,27 @@
-
 from langchain_core.tools import StructuredTool
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+import time
+
+from tools.statestorage import StateStorage, get_storage, to_epoch
 
 class NextContactScheduleTool:
 
-    def __init__(self):
-        pass
+    def __init__(self, storage: StateStorage = None, clock=time.time):
+        self._storage = storage or get_storage()
+        self._clock = clock
 
     def use(self, next_contact_datetime: str) -> bool:
+        try:
+            next_contact = to_epoch(datetime.strptime(next_contact_datetime.strip(), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc))
+        except ValueError:
+            return False
+        if next_contact <= self._clock():
+            return False
+
+        # A household has a single next contact, setting it replaces the previous one
+        with self._storage.transaction(immediate=True) as cursor:
+            cursor.execute("DELETE FROM ContactSchedule")
+            cursor.execute("INSERT INTO ContactSchedule (datetime) VALUES (?)", (next_contact,))
         return True
     
     def description(self) -> str:
@@ -19,7 +33,7 @@ class NextContactScheduleTool:
                 next_contact_datetime: str - The datetime of the next contact in UTC timezone in the format "YYYY-MM-DD HH:MM:SS"
 
             Returns:
-                bool - True the schedule was set successfully, False otherwise
+                bool - True the schedule was set successfully, False otherwise (malformed or past datetime)
             """
     
     @property
@@ -27,4 +41,4 @@ class NextContactScheduleTool:
         return StructuredTool.from_function(
             self.use,
             name="next_contact_schedule",
-            description=self.description())
\ No newline at end of file
+            description=self.description())
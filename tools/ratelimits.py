@@ -0,0 +1,34 @@
+from langchain_core.rate_limiters import BaseRateLimiter, InMemoryRateLimiter
+
+from tools.metrics import Metrics
+
+# Requests per second allowed by default to all the agents of a process, per API
+DEFAULT_RATES = {"llm": 2.0, "gmail": 10.0, "router": 1.0}
+
+
+def create_rate_limiters(rates: dict[str, float] = None, burst: int = 1) -> dict[str, BaseRateLimiter]:
+    """
+    Creates one token bucket per API ("llm", "gmail" and "router"), to be shared by all the
+    agents running in the process so that together they stay under the quotas.
+    """
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    return {
+        api: InMemoryRateLimiter(requests_per_second=rate, check_every_n_seconds=min(0.1, 1 / rate), max_bucket_size=burst)
+        for api, rate in rates.items()
+    }
+
+
+def acquire(rate_limiter: BaseRateLimiter, metrics: Metrics, api: str, requests: int = 1):
+    """Waits for the limiter (if any) to allow the requests, the wait is recorded as a rate_limit span"""
+    if rate_limiter is None:
+        return
+    with metrics.span("rate_limit", api=api):
+        for _ in range(requests):
+            rate_limiter.acquire()
+
+
+async def aacquire(rate_limiter: BaseRateLimiter, metrics: Metrics, api: str):
+    if rate_limiter is None:
+        return
+    with metrics.span("rate_limit", api=api):
+        await rate_limiter.aacquire()
@@ -0,0 +1,152 @@
+from html.parser import HTMLParser
+import base64
+import binascii
+import re
+
+# Where the quoted history of a reply starts: attribution lines ("On ... wrote:", also in the
+# household languages), forwarded and original message separators, and signatures
+_CUTOFF = re.compile(
+    r"^\s*(?:"
+    r"On\b.+\bwrote:\s*$"
+    r"|Il giorno\b.+\bha scritto:\s*$"
+    r"|Am\b.+\bschrieb\b.*:\s*$"
+    r"|Le\b.+\ba écrit\s*:\s*$"
+    r"|W dniu\b.+\bpisze:\s*$"
+    r"|-{2,}\s*(?:Original Message|Messaggio originale|Forwarded message|Messaggio inoltrato)\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|From:\s.+$"
+    r"|Da:\s.+$"
+    r"|--\s*$"
+    r"|Sent from my\b.+$"
+    r"|Inviato da\b.+$"
+    r")",
+    re.IGNORECASE)
+# The first line of an attribution wrapped over two lines
+_ATTRIBUTION_START = re.compile(r"^\s*(?:On|Il giorno|Am|Le|W dniu)\b", re.IGNORECASE)
+_QUOTED = re.compile(r"^\s*>")
+_CHARSET = re.compile(r"charset=\"?([\w.:-]+)", re.IGNORECASE)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# HTML elements ending a line, and those whose content is never part of the reply
+_BLOCK_TAGS = frozenset({"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol"})
+_SKIPPED_TAGS = frozenset({"script", "style", "head", "title", "blockquote"})
+_QUOTE_CLASSES = ("gmail_quote", "gmail_attr", "moz-cite-prefix", "yahoo_quoted", "divRplyFwdMsg")
+
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((header.get("value", "") for header in part.get("headers", []) if header.get("name", "").lower() == name), "")
+
+
+def _decode(part: dict) -> str:
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (binascii.Error, ValueError):
+        return ""
+    charset = _CHARSET.search(_header(part, "Content-Type"))
+    try:
+        return raw.decode(charset.group(1) if charset else "utf-8", errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def find_text_parts(payload: dict) -> tuple[dict, dict]:
+    """
+    Walks the MIME tree of a Gmail message payload once, depth first in document order, and
+    returns its first text/plain and first text/html parts (None when missing). Attachments
+    are skipped.
+    """
+    plain = html = None
+    stack = [payload]
+    while stack and plain is None:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+            continue
+        if part.get("filename") or _header(part, "Content-Disposition").lower().startswith("attachment"):
+            continue
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type == "text/plain":
+            plain = part
+        elif mime_type == "text/html" and html is None:
+            html = part
+    return plain, html
+
+
+class _HTMLText(HTMLParser):
+    # Text of the HTML, one line per block element, without the quoted history
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skipped_depth = 0
+        self._open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.chunks.append("\n")
+        if tag in ("br", "img", "hr", "meta", "link", "input"):
+            return
+        quote = any(name == "class" and value and any(quote_class in value for quote_class in _QUOTE_CLASSES) for name, value in attrs)
+        skipped = tag in _SKIPPED_TAGS or quote
+        self._open_tags.append((tag, skipped))
+        if skipped:
+            self._skipped_depth += 1
+
+    def handle_endtag(self, tag):
+        # Close up to the matching tag, tolerating unclosed ones
+        for index in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[index][0] == tag:
+                for _, skipped in self._open_tags[index:]:
+                    if skipped:
+                        self._skipped_depth -= 1
+                del self._open_tags[index:]
+                break
+        if tag in _BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipped_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    lines = ("".join(parser.chunks)).replace("\xa0", " ").split("\n")
+    return "\n".join(" ".join(line.split()) for line in lines)
+
+
+def strip_quoted(text: str) -> str:
+    """
+    Keeps only what the human wrote: everything from the first attribution, separator or
+    signature line on is dropped, and so are the ">" quoted lines. One pass over the lines.
+    """
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    kept = []
+    for index, line in enumerate(lines):
+        if _CUTOFF.match(line):
+            break
+        if _ATTRIBUTION_START.match(line) and index + 1 < len(lines) and _CUTOFF.match(f"{line} {lines[index + 1]}"):
+            break
+        if not _QUOTED.match(line):
+            kept.append(line.rstrip())
+    return _BLANK_LINES.sub("\n\n", "\n".join(kept)).strip()
+
+
+def extract_reply(payload: dict) -> str:
+    """
+    Returns the text a human wrote in a reply, from the Gmail message payload: the text/plain
+    part, or the text of the text/html one when there is none, without the quoted history and
+    the signature.
+    """
+    plain, html = find_text_parts(payload)
+    if plain is not None:
+        return strip_quoted(_decode(plain))
+    if html is not None:
+        return strip_quoted(html_to_text(_decode(html)))
+    return ""
@@ -0,0 +1,135 @@
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from tools.metrics import Metrics, get_metrics
+from tools.ratelimits import BaseRateLimiter, aacquire
+
+
+def create_sagemcom_client():
+    # The router password has no default, it must come from the environment
+    password = os.getenv("ROUTER_PASSWORD")
+    if not password:
+        raise RuntimeError("ROUTER_PASSWORD is not set, the router cannot be logged in to")
+
+    from sagemcom_api.client import SagemcomClient
+    from sagemcom_api.enums import EncryptionMethod
+
+    return SagemcomClient(
+        os.getenv("ROUTER_HOST", "192.168.1.1"),
+        os.getenv("ROUTER_USERNAME", "1234"),
+        password,
+        EncryptionMethod.MD5,
+        verify_ssl=True)
+
+
+class RouterHostCache:
+    """
+    Keeps one authenticated router session on a dedicated event loop and an in-memory index of
+    the devices connected to the router (MAC address -> active), refreshed at most every ttl seconds.
+    """
+
+    def __init__(self, client_factory=create_sagemcom_client, ttl: float = 60.0, clock=time.monotonic, metrics: Metrics = None, rate_limiter: BaseRateLimiter = None):
+        self._client_factory = client_factory
+        self._rate_limiter = rate_limiter
+        self._metrics = metrics or get_metrics()
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+        self._active_hosts = {}
+        self._refreshed_at = None
+
+    def _run(self, coroutine):
+        # All router calls run on one long-lived loop, so the session survives between calls
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="router-host-cache", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _login(self):
+        client = self._client_factory()
+        try:
+            await aacquire(self._rate_limiter, self._metrics, "router")
+            with self._metrics.span("router", call="login"):
+                await client.login()
+        except Exception:
+            await client.close()
+            raise
+        self._client = client
+
+    async def _logout(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.close()
+            except Exception:
+                pass
+
+    async def _fetch_hosts(self) -> list:
+        if self._client is None:
+            await self._login()
+        try:
+            await aacquire(self._rate_limiter, self._metrics, "router")
+            with self._metrics.span("router", call="get_hosts"):
+                return await self._client.get_hosts()
+        except Exception:
+            # The session may have expired on the router side, log in again once
+            await self._logout()
+            await self._login()
+            await aacquire(self._rate_limiter, self._metrics, "router")
+            with self._metrics.span("router", call="get_hosts"):
+                return await self._client.get_hosts()
+
+    def active_hosts(self) -> dict[str, bool]:
+        """
+        Returns the MAC address to active index, refreshing it from the router when older than the ttl.
+        """
+        with self._lock:
+            if self._refreshed_at is None or self._clock() - self._refreshed_at >= self._ttl:
+                devices = self._run(self._fetch_hosts())
+                self._active_hosts = {device.id.upper(): bool(device.active) for device in devices}
+                self._refreshed_at = self._clock()
+            return self._active_hosts
+
+    def is_active(self, mac_address: str) -> bool:
+        return self.active_hosts().get(mac_address.upper(), False)
+
+    def invalidate(self):
+        with self._lock:
+            self._refreshed_at = None
+
+    def close(self):
+        with self._lock:
+            if self._loop is not None:
+                self._run(self._logout())
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+            self._refreshed_at = None
+
+
+_host_cache = None
+_rate_limited_host_caches: "weakref.WeakKeyDictionary[BaseRateLimiter, RouterHostCache]" = weakref.WeakKeyDictionary()
+_host_cache_lock = threading.Lock()
+
+
+def get_router_host_cache(rate_limiter: BaseRateLimiter = None) -> RouterHostCache:
+    """
+    Returns the host cache shared by all availability checks, one per router rate limiter, so
+    that all the agents of a process share one router session. Its ttl can be set with the
+    ROUTER_HOSTS_TTL environment variable (seconds).
+    """
+    global _host_cache
+    with _host_cache_lock:
+        if rate_limiter is not None:
+            host_cache = _rate_limited_host_caches.get(rate_limiter)
+            if host_cache is None:
+                host_cache = _rate_limited_host_caches[rate_limiter] = RouterHostCache(ttl=float(os.getenv("ROUTER_HOSTS_TTL", "60")), rate_limiter=rate_limiter)
+            return host_cache
+        if _host_cache is None:
+            _host_cache = RouterHostCache(ttl=float(os.getenv("ROUTER_HOSTS_TTL", "60")))
+        return _host_cache
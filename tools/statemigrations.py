@@ -0,0 +1,117 @@
+from datetime import datetime
+
+from tools.statestorage import StateStorage
+
+
+def _create_tables(cursor):
+    # Databases created before the migrations already have both tables
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Human (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT,
+        phone TEXT,
+        name TEXT
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ContactEvent (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        human_id INTEGER,
+        datetime TEXT,
+        FOREIGN KEY (human_id) REFERENCES Human(id)
+    );
+    """)
+
+
+def _iso_to_epoch(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    # Written by datetime.now().isoformat(), naive values are local time
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def _epoch_timestamps(cursor):
+    # SQLite cannot change a column type in place: rebuild the table with the converted values,
+    # keeping the ids (and the AUTOINCREMENT sequence, renamed along with the table)
+    cursor.connection.create_function("iso_to_epoch", 1, _iso_to_epoch, deterministic=True)
+    cursor.execute("""
+    CREATE TABLE ContactEvent_migrated (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        human_id INTEGER,
+        datetime INTEGER NOT NULL,
+        FOREIGN KEY (human_id) REFERENCES Human(id)
+    );
+    """)
+    cursor.execute("""
+        INSERT INTO ContactEvent_migrated (id, human_id, datetime)
+        SELECT id, human_id, iso_to_epoch(datetime) FROM ContactEvent ORDER BY id
+    """)
+    cursor.execute("DROP TABLE ContactEvent")
+    cursor.execute("ALTER TABLE ContactEvent_migrated RENAME TO ContactEvent")
+
+
+def _indexes(cursor):
+    cursor.execute("SELECT name FROM Human GROUP BY name HAVING COUNT(*) > 1 ORDER BY name")
+    duplicated = [name for (name,) in cursor.fetchall()]
+    if duplicated:
+        raise ValueError(f"Human names must be unique, rename or merge: {', '.join(map(str, duplicated))}")
+
+    # The recorder and the tools look humans up by name
+    cursor.execute("CREATE UNIQUE INDEX HumanName ON Human (name)")
+    # Last contact and window counts per human are range searches on the covering index
+    cursor.execute("CREATE INDEX ContactEventHumanDatetime ON ContactEvent (human_id, datetime)")
+    # The history pages through all events, most recent first
+    cursor.execute("CREATE INDEX ContactEventDatetime ON ContactEvent (datetime)")
+
+
+def _contact_schedule(cursor):
+    # The next contact of the household, set by the agent and honored by the scheduler
+    cursor.execute("""
+    CREATE TABLE ContactSchedule (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        datetime INTEGER NOT NULL
+    );
+    """)
+
+
+# Version N is reached by applying the N-th migration, never edit a released one, append a new one
+MIGRATIONS = [
+    ("Create the Human and ContactEvent tables", _create_tables),
+    ("Store contact datetimes as UTC epoch seconds", _epoch_timestamps),
+    ("Index humans by name and contact events by human and datetime", _indexes),
+    ("Persist the next contact schedule", _contact_schedule),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(storage: StateStorage) -> int:
+    """
+    Returns the schema version of the database, as recorded in PRAGMA user_version.
+    """
+    with storage.connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(storage: StateStorage, target: int = SCHEMA_VERSION) -> list[int]:
+    """
+    Upgrades the database in place to the target schema version and returns the versions
+    applied. Every migration runs in its own transaction together with the version bump, so an
+    interrupted upgrade resumes from the last completed one.
+    """
+    if schema_version(storage) > SCHEMA_VERSION:
+        raise ValueError(f"The database schema version {schema_version(storage)} is newer than this code ({SCHEMA_VERSION})")
+
+    applied = []
+    for version, (_, migration) in enumerate(MIGRATIONS[:target], start=1):
+        # Checked again under the write lock, another process may have migrated meanwhile
+        with storage.transaction(immediate=True) as cursor:
+            current = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                continue
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+        applied.append(version)
+    return applied
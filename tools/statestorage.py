@@ -0,0 +1,160 @@
+
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import queue
+import sqlite3
+import threading
+
+from tools.metrics import Metrics, get_metrics
+
+DEFAULT_DB_PATH = "state.db"
+
+
+class _TimedCursor(sqlite3.Cursor):
+    # Every statement is recorded as a sqlite span, labelled with its kind (SELECT, INSERT, COMMIT...)
+    def execute(self, sql, parameters=()):
+        with self.connection.metrics.span("sqlite", statement=sql.lstrip().split(None, 1)[0].upper()):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with self.connection.metrics.span("sqlite", statement=sql.lstrip().split(None, 1)[0].upper()):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class _TimedConnection(sqlite3.Connection):
+    metrics = None
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class StateStorage:
+    """
+    Owns the access to the SQLite state database: a small pool of reusable connections
+    configured with WAL journaling and a busy timeout, plus explicit transactions.
+    """
+
+    def __init__(self, db_path: str = None, pool_size: int = 4, busy_timeout: float = 5.0, metrics: Metrics = None):
+        self._db_path = db_path or os.getenv("SMALLTALK_STATE_DB", DEFAULT_DB_PATH)
+        self._metrics = metrics or get_metrics()
+        self._busy_timeout = busy_timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._connections = []
+        self._closed = False
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode, transactions are always opened explicitly
+        conn = sqlite3.connect(
+            self._db_path,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            factory=_TimedConnection)
+        conn.metrics = self._metrics
+        conn.execute(f"PRAGMA busy_timeout = {int(self._busy_timeout * 1000)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError(f"Storage for {self._db_path} is closed")
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+            with self._lock:
+                self._connections.append(conn)
+            return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            # More threads than pooled connections were active, drop the extra one
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool. Statements run in autocommit mode.
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """
+        Runs the block in a single transaction and yields a cursor. Use immediate=True for
+        read-then-write blocks, so the write lock is taken upfront instead of failing on upgrade.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+_storages: dict[str, StateStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(db_path: str = None) -> StateStorage:
+    """
+    Returns the storage shared by all tools for the given database path (by default
+    the SMALLTALK_STATE_DB environment variable or state.db).
+    """
+    db_path = db_path or os.getenv("SMALLTALK_STATE_DB", DEFAULT_DB_PATH)
+    with _storages_lock:
+        storage = _storages.get(db_path)
+        if storage is None:
+            storage = StateStorage(db_path)
+            _storages[db_path] = storage
+        return storage
+
+
+def to_epoch(value: datetime) -> int:
+    """
+    Converts a datetime to the stored form of timestamps: UTC epoch seconds. Naive datetimes
+    are local time.
+    """
+    return int(value.timestamp())
+
+
+def from_epoch(value) -> datetime:
+    """
+    Converts a stored timestamp to a naive local datetime, None stays None.
+    """
+    return datetime.fromtimestamp(value) if value is not None else None